@@ -0,0 +1,10 @@
+# app/__main__.py
+#
+# Dev entry point: `python -m app` from src/. Prefer it to `python -m
+# app.server`: spawn/forkserver children re-import the parent's __main__
+# module unless it is a package __main__, so with this entry the derivative
+# workers never rebuild the Flask app.
+from app.server import main
+
+if __name__ == "__main__":
+    main()
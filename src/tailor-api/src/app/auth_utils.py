@@ -1,11 +1,25 @@
 # app/auth_utils.py
 from __future__ import annotations
 
+import os
+import threading
+import time
 from functools import wraps
 from typing import Callable, Any, Optional, Dict
 
-from flask import session, abort, g
-from utils.tailor_utils import get_or_create_user_from_session
+from flask import Flask, session, abort, g, got_request_exception
+from psycopg2 import errors as pg_errors
+from utils.tailor_utils import get_or_create_user_from_session, get_schema_epoch
+
+# Session emails allowed to use admin endpoints (bulk import, ...)
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+
+# How long a worker trusts its cached schema epoch before re-reading it.
+USER_EPOCH_TTL = float(os.getenv("USER_EPOCH_TTL", "30"))
+
+_epoch_lock = threading.Lock()
+_epoch_value: Optional[str] = None
+_epoch_checked_at = float("-inf")
 
 
 def get_current_user() -> Optional[Dict[str, Any]]:
@@ -16,32 +30,102 @@ def get_current_user() -> Optional[Dict[str, Any]]:
     return session.get("user")
 
 
-def _ensure_db_user() -> Optional[Dict[str, Any]]:
+def _schema_epoch() -> Optional[str]:
     """
-    Ensures there's a corresponding row in the DB for the current session user.
-    Returns the DB row (RealDict) or None if not authenticated.
-    Stores it on flask.g.db_user for convenience.
+    Per-process cached copy of app_meta.schema_epoch. The epoch changes whenever
+    tables.sql recreates the schema, which invalidates every cached users.id.
+    """
+    global _epoch_value, _epoch_checked_at
+    now = time.monotonic()
+    if now - _epoch_checked_at < USER_EPOCH_TTL:
+        return _epoch_value
+    with _epoch_lock:
+        if now - _epoch_checked_at >= USER_EPOCH_TTL:
+            _epoch_value = get_schema_epoch()
+            _epoch_checked_at = now
+    return _epoch_value
+
+
+def invalidate_user_identity() -> None:
+    """Forget the cached users.id (session + process epoch), e.g. after an FK error."""
+    global _epoch_checked_at
+    session.pop("db_user", None)
+    g.pop("db_user_id", None)
+    _epoch_checked_at = float("-inf")
+
+
+def _on_request_exception(sender, exception, **_extra) -> None:
+    # A users.id cached from before a DB reset fails on the first write that
+    # references it (the epoch is trusted for up to USER_EPOCH_TTL). Drop it so
+    # the next request re-reads the epoch and recreates the user row.
+    if isinstance(exception, pg_errors.ForeignKeyViolation):
+        if "user_id" in (exception.diag.constraint_name or ""):
+            invalidate_user_identity()
+
+
+def init_app(app: Flask) -> None:
+    got_request_exception.connect(_on_request_exception, app)
+
+
+def current_user_id() -> Optional[int]:
     """
+    Internal users.id for the session user, resolved at most once per request.
+
+    The id is cached in the session together with the schema epoch it was
+    resolved under; while the epoch matches no query is needed. After a DB reset
+    the epoch differs and we fall back to get_or_create_user_from_session, which
+    recreates the row.
+    """
+    if "db_user_id" in g:
+        return g.db_user_id
+
     sess_user = get_current_user()
     if not sess_user:
+        g.db_user_id = None
         return None
 
-    db_user = get_or_create_user_from_session(sess_user)
-    g.db_user = db_user
-    return db_user
+    epoch = _schema_epoch()
+    cached = session.get("db_user") or {}
+    if (
+        epoch is not None
+        and cached.get("epoch") == epoch
+        and cached.get("google_id") == sess_user.get("google_id")
+    ):
+        g.db_user_id = cached.get("id")
+        return g.db_user_id
+
+    row = get_or_create_user_from_session(sess_user)
+    user_id = row["id"] if row else None
+    if user_id is not None and epoch is not None:
+        session["db_user"] = {"id": user_id, "epoch": epoch, "google_id": sess_user.get("google_id")}
+    g.db_user_id = user_id
+    return user_id
 
 
 def login_required(fn: Callable) -> Callable:
     """
     Decorator that:
       1) Requires a session user (401 if missing)
-      2) Ensures a DB user row exists (autocreates if DB was reset)
+      2) Resolves the DB user id (autocreates the row if the DB was reset)
     """
     @wraps(fn)
     def _wrapped(*args, **kwargs):
         if not get_current_user():
             abort(401, description="Unauthorized")
-        # Make sure a DB row exists even after a full schema reset.
-        _ensure_db_user()
+        current_user_id()
+        return fn(*args, **kwargs)
+    return _wrapped
+
+
+def admin_required(fn: Callable) -> Callable:
+    """Like login_required, but the session email must be listed in ADMIN_EMAILS (403 otherwise)."""
+    @wraps(fn)
+    def _wrapped(*args, **kwargs):
+        user = get_current_user()
+        if not user:
+            abort(401, description="Unauthorized")
+        if (user.get("email") or "").lower() not in ADMIN_EMAILS:
+            abort(403, description="Forbidden")
+        current_user_id()
         return fn(*args, **kwargs)
     return _wrapped
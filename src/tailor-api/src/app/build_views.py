@@ -0,0 +1,81 @@
+# app/build_views.py
+#
+# View counts for published builds (feed sort=popular). Viewing a build must
+# not write on the GET path: views are tallied in memory and added to
+# build_views (db/sql/tables.sql) in one batched statement every
+# BUILD_VIEWS_FLUSH_INTERVAL seconds, and once more at exit. A crash loses at
+# most one interval of views, which a popularity ranking can afford.
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from utils.tailor_utils import add_build_views
+
+log = logging.getLogger(__name__)
+
+BUILD_VIEWS_FLUSH_INTERVAL = float(os.getenv("BUILD_VIEWS_FLUSH_INTERVAL", "10"))  # seconds; 0 = write through
+
+_lock = threading.Lock()
+_pending: Counter = Counter()
+
+
+def record(build_id: int) -> None:
+    """Count one view of a published build."""
+    if BUILD_VIEWS_FLUSH_INTERVAL <= 0:
+        add_build_views({build_id: 1})
+        return
+    with _lock:
+        _pending[build_id] += 1
+
+
+def flush() -> int:
+    """Write the buffered views; returns how many were flushed. On failure they stay buffered."""
+    global _pending
+    with _lock:
+        counts, _pending = _pending, Counter()
+    if not counts:
+        return 0
+    try:
+        add_build_views(dict(counts))
+    except BaseException:
+        with _lock:
+            _pending.update(counts)
+        raise
+    return sum(counts.values())
+
+
+def _flush_at_exit() -> None:
+    try:
+        flush()
+    except Exception:
+        log.exception("build view flush at exit failed")
+
+
+_flusher: Optional[threading.Thread] = None
+
+
+def start_flusher(interval: float = BUILD_VIEWS_FLUSH_INTERVAL) -> Optional[threading.Thread]:
+    """Flush every `interval` seconds (jittered) on a daemon thread."""
+    global _flusher
+    if interval <= 0 or _flusher is not None:
+        return _flusher
+
+    def _loop():
+        while True:
+            time.sleep(interval * random.uniform(0.9, 1.1))
+            try:
+                flush()
+            except Exception:
+                log.exception("build view flush failed")
+
+    _flusher = threading.Thread(target=_loop, name="build-views-flush", daemon=True)
+    _flusher.start()
+    atexit.register(_flush_at_exit)
+    return _flusher
@@ -0,0 +1,111 @@
+# app/db_context.py
+#
+# Request-scoped unit of work.
+#
+# The first query in a request checks one connection out of the pool and binds it
+# to flask.g; every db_utils helper (and so every utils/tailor_utils function) in
+# that request reuses it. By default the request runs in a single transaction that
+# is committed when the response is < 400 and rolled back otherwise. Read-only
+# endpoints can opt into autocommit with @db_autocommit to skip BEGIN/COMMIT.
+from __future__ import annotations
+
+from functools import wraps
+from typing import Any, Callable, Optional
+
+import psycopg2
+from flask import Flask, g, has_request_context, jsonify
+
+from db.db_utils import get_pool, set_connection_scope, defer_version_bumps, commit_transaction
+
+
+def _request_connection() -> Optional[Any]:
+    if not has_request_context():
+        return None
+    conn = g.get("_db_conn")
+    if conn is None:
+        conn = get_pool().acquire()
+        # Pool hands out autocommit connections; the first statement opens the txn.
+        conn.autocommit = bool(g.get("_db_autocommit", False))
+        g._db_conn = conn
+        if not conn.autocommit:
+            # Table version bumps wait for COMMIT instead of holding their row
+            # locks for the rest of the request.
+            defer_version_bumps(conn)
+    return conn
+
+
+def _defer_until_commit(fn: Callable[[], None]) -> bool:
+    if not has_request_context():
+        return False
+    conn = g.get("_db_conn")
+    if conn is None or conn.autocommit:
+        return False
+    g.setdefault("_db_after_commit", []).append(fn)
+    return True
+
+
+def _finish(commit: bool) -> None:
+    conn = g.pop("_db_conn", None)
+    callbacks = g.pop("_db_after_commit", [])
+    if conn is None:
+        return
+    discard = False
+    committed = False
+    try:
+        if not conn.autocommit:
+            if commit:
+                commit_transaction(conn)
+                committed = True
+            else:
+                conn.rollback()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        get_pool().release(conn, discard=discard or bool(conn.closed))
+    if committed:
+        for fn in callbacks:
+            fn()
+
+
+def db_autocommit(fn: Callable) -> Callable:
+    """
+    Run the wrapped view without a request transaction (each statement commits
+    on its own). Meant for read-only endpoints.
+    """
+    @wraps(fn)
+    def _wrapped(*args, **kwargs):
+        g._db_autocommit = True
+        conn = g.get("_db_conn")
+        if conn is not None and not conn.autocommit:
+            # A decorator further out (e.g. login_required) already queried.
+            commit_transaction(conn)
+            conn.autocommit = True
+            for cb in g.pop("_db_after_commit", []):
+                cb()
+        return fn(*args, **kwargs)
+    return _wrapped
+
+
+def init_app(app: Flask) -> None:
+    set_connection_scope(_request_connection, _defer_until_commit)
+
+    @app.after_request
+    def _commit_request(response):
+        if g.get("_db_conn") is None:
+            return response
+        try:
+            _finish(commit=response.status_code < 400)
+        except psycopg2.Error:
+            app.logger.exception("Request transaction failed to commit")
+            return jsonify({"error": "db_commit_failed"}), 500
+        return response
+
+    @app.teardown_request
+    def _release_request(exc):
+        # Anything still bound here means after_request never ran (unhandled error).
+        if g.get("_db_conn") is not None:
+            try:
+                _finish(commit=False)
+            except psycopg2.Error:
+                app.logger.exception("Request transaction failed to roll back")
@@ -0,0 +1,166 @@
+# app/derivatives.py
+#
+# Background image derivatives (resized WebP variants) for uploaded part images.
+# Rendering runs in a small process pool so decoding/resizing never blocks the
+# upload request or holds the GIL in the web worker. Pillow is optional: without
+# it (or with DERIVATIVE_WORKERS=0) uploads work as before and only originals
+# are served.
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+log = logging.getLogger(__name__)
+
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+DERIVATIVE_WIDTHS = sorted({int(w) for w in os.getenv("DERIVATIVE_WIDTHS", "160,480,960").split(",") if w.strip()})
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+DERIVED_PREFIX = "derived"
+
+
+def derived_key(key: str, width: int) -> str:
+    return f"{DERIVED_PREFIX}/{key}/w{width}.webp"
+
+
+def pick_width(requested: int) -> Optional[int]:
+    """Smallest configured width >= requested; None means serve the original."""
+    for w in DERIVATIVE_WIDTHS:
+        if w >= requested:
+            return w
+    return None
+
+
+def _identity(path: str):
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def render_variants(src: str, base: str, key: str, widths: List[int], quality: int, sha256: str) -> List[int]:
+    """
+    Worker-side: write a WebP variant of `src` for each width narrower than the
+    original. Each file is written to a temp name and renamed, so readers never
+    see partial output. Returns the widths produced.
+
+    The job is tagged with the sha256 of the bytes it was queued for. If the
+    key was deleted or re-uploaded meanwhile (the source no longer hashes to
+    `sha256`, or changed while we rendered), the output is discarded rather
+    than served as an immutable variant of the new bytes.
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        before = _identity(src)
+        data = Path(src).read_bytes()
+    except FileNotFoundError:
+        return []
+    if hashlib.sha256(data).hexdigest() != sha256:
+        return []
+
+    made = []
+    with Image.open(io.BytesIO(data)) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+        for w in widths:
+            if w >= im.width:
+                break
+            h = max(1, round(im.height * w / im.width))
+            out = Path(base) / derived_key(key, w)
+            out.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".derive-", dir=out.parent)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    im.resize((w, h), Image.LANCZOS).save(f, "WEBP", quality=quality, method=4)
+                ino = os.stat(tmp).st_ino
+                os.replace(tmp, out)
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+            made.append((w, out, ino))
+
+    # A delete/re-upload that raced the renames above dropped derived/<key>
+    # before we wrote into it: take back whatever of ours is still there.
+    try:
+        current = _identity(src)
+    except FileNotFoundError:
+        current = None
+    if current != before:
+        for _, out, ino in made:
+            try:
+                if os.stat(out).st_ino == ino:
+                    os.unlink(out)
+            except FileNotFoundError:
+                pass
+        return []
+    return [w for w, _, _ in made]
+
+
+def _worker_context() -> multiprocessing.context.BaseContext:
+    """
+    forkserver where available, with the server preloading only this module
+    and Pillow rather than the default __main__ (the web app, its env checks
+    and schedulers). Children still re-import a module __main__ such as
+    `python -m app.server`; `python -m app` avoids that (see app/__main__.py).
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload([__name__, "PIL.Image"])
+    return ctx
+
+
+class DerivativePipeline:
+    def __init__(self, workers: int = DERIVATIVE_WORKERS):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.enabled = workers > 0 and bool(DERIVATIVE_WIDTHS) and _pillow_available()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Created on first use, from a request thread: fork() there would copy
+        # whatever locks other threads hold (pool, caches, logging), so workers
+        # start from a clean interpreter instead.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_worker_context())
+            return self._executor
+
+    def submit(self, src: str, base: str, key: str, sha256: str) -> Optional[Future]:
+        """Queue variant rendering for the bytes (by `sha256`) just stored at `key`; returns immediately."""
+        if not self.enabled:
+            return None
+        try:
+            fut = self._pool().submit(
+                render_variants, src, base, key, DERIVATIVE_WIDTHS, DERIVATIVE_QUALITY, sha256
+            )
+        except RuntimeError:
+            log.exception("derivative pool unavailable")
+            return None
+        fut.add_done_callback(lambda f: f.exception() and log.warning("derivatives failed for %s: %s", key, f.exception()))
+        return fut
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def _pillow_available() -> bool:
+    try:
+        import PIL  # noqa: F401
+        return True
+    except ImportError:
+        log.info("Pillow not installed; image derivatives disabled")
+        return False
+
+
+pipeline = DerivativePipeline()
@@ -0,0 +1,114 @@
+# app/http_cache.py
+#
+# Conditional GET support. ETags are derived from per-table version stamps
+# (table_versions, bumped by statement triggers -- right after COMMIT for
+# request transactions) plus the request path/query, so a matching
+# If-None-Match is answered with 304 before the handler runs its query or
+# serializes anything.
+from __future__ import annotations
+
+import hashlib
+import json
+from functools import wraps
+from typing import Callable, Iterable, List
+
+from flask import Response, request
+
+from utils.catalog_cache import catalog_cache
+from utils.compat import COMPAT_RULES
+from utils.tailor_utils import get_table_versions
+from .auth_utils import current_user_id
+
+# Cache-Control policies
+CATALOG_CACHE_CONTROL = "public, no-cache"       # shareable; always revalidate (cheap 304)
+PRIVATE_CACHE_CONTROL = "private, no-cache"      # per-user lists
+
+PART_TABLES = ("movements", "cases", "dials", "straps", "hands", "crowns")
+USAGE_TABLES = tuple(f"{t}_usage" for t in PART_TABLES)  # part_usage counters, per type
+CATALOG_TABLES = ("movement_types",) + PART_TABLES + USAGE_TABLES
+BUILD_TABLES = ("builds",) + CATALOG_TABLES
+# build_feed is trigger-maintained from builds, parts and users; view counts
+# live in the unstamped build_views, so they never move the feed ETag.
+FEED_TABLES = ("build_feed",)
+
+
+def catalog_tables(part_type: str, **_view_kwargs) -> List[str]:
+    # rows embed their usage counters; movements also movement_types.type_name
+    tables = [part_type, f"{part_type}_usage"]
+    return tables + ["movement_types"] if part_type == "movements" else tables
+
+
+def _with_catalog_tables(tables: List[str], part_types: Iterable[str]) -> List[str]:
+    for t in part_types:
+        tables += [d for d in catalog_tables(t) if d not in tables]
+    return tables
+
+
+def catalog_list_tables(part_type: str, **_view_kwargs) -> List[str]:
+    # ?compatible_with=cases:12 filters on the referenced part's dimensions,
+    # so its type's stamps belong in the ETag too.
+    refs = {
+        tok.split(":", 1)[0].strip()
+        for raw in request.args.getlist("compatible_with")
+        for tok in raw.split(",")
+    }
+    return _with_catalog_tables(catalog_tables(part_type), sorted(refs.intersection(PART_TABLES)))
+
+
+def compatible_tables(part_type: str, **_view_kwargs) -> List[str]:
+    # the part's own row plus every type a fit rule relates it to
+    related = {t for r in COMPAT_RULES if part_type in (r.a_type, r.b_type) for t in (r.a_type, r.b_type)}
+    return _with_catalog_tables(catalog_tables(part_type), sorted(related - {part_type}))
+
+
+def _sync_catalog_cache(stamps: dict) -> None:
+    # Only with every stamp a namespace depends on, so requests that read a
+    # subset (e.g. search) can't flip the stored stamp back and forth.
+    for t in PART_TABLES:
+        deps = catalog_tables(t)
+        if all(d in stamps for d in deps):
+            catalog_cache.sync(t, tuple(stamps[d] for d in deps))
+
+
+def _compute_etag(tables: Iterable[str], per_user: bool) -> str:
+    stamps = get_table_versions(list(tables))
+    _sync_catalog_cache(stamps)
+    basis = {
+        "path": request.path,
+        "query": sorted(request.args.items(multi=True)),
+        "stamps": sorted(stamps.items()),
+    }
+    if per_user:
+        basis["user"] = current_user_id()
+    return hashlib.sha1(json.dumps(basis, default=str).encode("utf-8")).hexdigest()
+
+
+def etag_cached(tables: Callable[..., Iterable[str]], cache_control: str = CATALOG_CACHE_CONTROL,
+                per_user: bool = False) -> Callable:
+    """
+    Resource method decorator. `tables(**view_kwargs)` names the tables whose
+    contents the response depends on. The version stamps are read *before* the
+    handler runs, so a concurrent write can only make the ETag older than the
+    body, never newer (clients then just miss once).
+    """
+    def deco(fn: Callable) -> Callable:
+        @wraps(fn)
+        def _wrapped(*args, **kwargs):
+            etag = _compute_etag(tables(*args, **kwargs), per_user)
+
+            if request.if_none_match.contains(etag):
+                resp = Response(status=304)
+            else:
+                resp = fn(*args, **kwargs)
+                if not isinstance(resp, Response):
+                    return resp  # error tuples etc. pass through untouched
+                if resp.status_code != 200:
+                    return resp
+
+            resp.set_etag(etag)
+            resp.headers["Cache-Control"] = cache_control
+            if per_user:
+                resp.vary.add("Cookie")
+            return resp
+        return _wrapped
+    return deco
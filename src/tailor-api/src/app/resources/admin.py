@@ -0,0 +1,51 @@
+import io
+
+import psycopg2
+from flask import request
+from flask_restful import Resource
+from ..auth_utils import admin_required, current_user_id, invalidate_user_identity
+from ..services.parts_service import is_allowed
+from utils.bulk_import import InvalidCSV, import_parts
+
+_FORMAT_BY_MIMETYPE = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+class AdminImport(Resource):
+    """
+    Bulk-load a supplier feed: POST the raw CSV (header row = column names) or
+    NDJSON body. Query params: format=csv|ndjson (default: from Content-Type),
+    mode=upsert|insert, owner=me|none. Responds with the import report,
+    including rejected lines.
+    """
+    method_decorators = [admin_required]
+
+    def post(self, part_type: str):
+        if not is_allowed(part_type):
+            return {"error": "invalid part_type"}, 400
+        fmt = request.args.get("format") or _FORMAT_BY_MIMETYPE.get(request.mimetype, "csv")
+        mode = request.args.get("mode", "upsert")
+        if mode not in ("upsert", "insert"):
+            return {"error": "invalid_mode"}, 400
+        owner = request.args.get("owner", "me")
+        if owner not in ("me", "none"):
+            return {"error": "invalid_owner"}, 400
+        user_id = current_user_id() if owner == "me" else None
+
+        # Decode the body as it streams in; rows are validated and COPYed in batches.
+        body = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+        try:
+            report = import_parts(part_type, body, fmt, user_id=user_id, upsert=mode == "upsert")
+        except UnicodeDecodeError:
+            return {"error": "invalid_encoding"}, 400
+        except InvalidCSV as e:
+            return {"error": str(e), "line": e.line, "detail": e.detail}, 400
+        except ValueError as e:
+            if str(e) == "unknown_user":
+                invalidate_user_identity()  # cached users.id from before a DB reset
+            return {"error": str(e)}, 400
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            return {"error": "import_failed", "detail": (e.pgerror or str(e)).strip().splitlines()[0]}, 400
+        return report
@@ -1,38 +1,121 @@
-from flask_restful import Resource, reqparse
-from flask import jsonify
-from ..auth_utils import login_required, get_current_user
+from urllib.parse import urlencode
+from flask_restful import Resource, reqparse, inputs
+from flask import jsonify, request
+from ..auth_utils import login_required, current_user_id
+from ..db_context import db_autocommit
+from ..http_cache import etag_cached, BUILD_TABLES, CATALOG_TABLES, FEED_TABLES, PRIVATE_CACHE_CONTROL
+from utils.compat import IncompatibleParts
 from ..services.builds_service import (
-    create_build_for_user, list_user_builds, delete_user_build, publish_build
+    create_build_for_user, list_user_builds, delete_user_build, publish_build, get_build, configure,
+    quote_builds, feed_page,
 )
 
 class BuildList(Resource):
-    method_decorators = [login_required]
+    method_decorators = {
+        "get": [
+            etag_cached(lambda: BUILD_TABLES, PRIVATE_CACHE_CONTROL, per_user=True),
+            db_autocommit,
+            login_required,
+        ],
+        "post": [login_required],
+    }
 
     def get(self):
-        user = get_current_user()
-        return jsonify(list_user_builds(user["google_id"]))
+        # ?expand=parts inlines every part (image_url, price, specs) server-side
+        expand = "parts" in (request.args.get("expand") or "").split(",")
+        return jsonify(list_user_builds(current_user_id(), expand=expand))
 
     def post(self):
         parser = reqparse.RequestParser()
         for key in ("movements_id","cases_id","dials_id","straps_id","hands_id","crowns_id"):
             parser.add_argument(key, type=int, required=False)
+        # Dimension conflicts are rejected unless the client opts in; then
+        # they come back as compat_warnings on the saved build.
+        parser.add_argument("allow_incompatible", type=inputs.boolean, default=False)
         data = parser.parse_args()
-        user = get_current_user()
-        build = create_build_for_user(user["google_id"], data)
+        allow = data.pop("allow_incompatible")
+        try:
+            build = create_build_for_user(current_user_id(), data, allow_incompatible=allow)
+        except IncompatibleParts as e:
+            return {"error": str(e), "conflicts": e.conflicts}, 400
+        except ValueError as e:
+            return {"error": str(e)}, 400
         return jsonify(build)
 
 class BuildItem(Resource):
-    method_decorators = [login_required]
+    # GET: owner, or anyone once published. DELETE: owner only.
+    method_decorators = {
+        "get": [etag_cached(lambda build_id: BUILD_TABLES, PRIVATE_CACHE_CONTROL, per_user=True), db_autocommit],
+        "delete": [login_required],
+    }
+
+    def get(self, build_id: int):
+        build = get_build(current_user_id(), build_id)
+        if not build:
+            return {"error": "not found"}, 404
+        return jsonify(build)
 
     def delete(self, build_id: int):
-        user = get_current_user()
-        ok = delete_user_build(user["google_id"], build_id)
+        ok = delete_user_build(current_user_id(), build_id)
         return ({"ok": True} if ok else ({"error": "not found"}, 404))
 
 class PublishBuild(Resource):
     method_decorators = [login_required]
 
     def post(self, build_id: int):
-        user = get_current_user()
-        ok = publish_build(user["google_id"], build_id)
+        ok = publish_build(current_user_id(), build_id)
         return {"ok": ok}
+
+class BuildConfigurator(Resource):
+    # Public: depends only on the catalog.
+    method_decorators = [etag_cached(lambda: CATALOG_TABLES), db_autocommit]
+
+    def get(self):
+        """
+        ?budget=300[&k=10][&sort=price_asc|price_desc][&<type>.<filter>=...]
+        Returns {"builds": [...], "exhaustive": bool}; exhaustive is false when
+        the search hit its time/node cap and the list may not be optimal.
+        """
+        try:
+            return jsonify(configure(request.args))
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+class BuildQuote(Resource):
+    # Public and read-only: nothing is persisted.
+    method_decorators = [db_autocommit]
+
+    def post(self):
+        """
+        {"builds": [{"movements_id": 1, "cases_id": 4, ...}, ...]} ->
+        {"quotes": [{"total_price", "prices": {type: price}, "missing": [type]}]},
+        in request order.
+        """
+        try:
+            return jsonify(quote_builds(request.get_json(silent=True)))
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+class BuildFeed(Resource):
+    # Public: served from the build_feed read model, whose version stamp
+    # covers publishes, part edits and renames. View counts are deliberately
+    # not stamped, so a 304 may carry slightly old `views` / popular order.
+    method_decorators = [etag_cached(lambda: FEED_TABLES), db_autocommit]
+
+    def get(self):
+        """
+        ?sort=newest|cheapest|popular[&brand=][&limit=][&cursor=]. Like the
+        parts list, the body is a plain array and the next page is advertised
+        via X-Next-Cursor and a Link: rel="next" header.
+        """
+        try:
+            rows, next_cursor = feed_page(request.args)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        resp = jsonify(rows)
+        if next_cursor:
+            args = request.args.copy()
+            args["cursor"] = next_cursor
+            resp.headers["X-Next-Cursor"] = next_cursor
+            resp.headers["Link"] = f'<{request.path}?{urlencode(list(args.items(multi=True)))}>; rel="next"'
+        return resp
@@ -1,23 +1,49 @@
+from urllib.parse import urlencode
 from flask_restful import Resource
 from flask import jsonify, request
-from ..services.parts_service import list_parts, get_part, is_allowed
-from ..auth_utils import get_current_user
+from ..services.parts_service import (
+    list_parts_page, get_part, is_allowed, search, batch, export_parts, compatible_parts, MAX_PAGE_SIZE,
+)
+from ..streaming import stream_rows
+from ..auth_utils import get_current_user, current_user_id
+from ..db_context import db_autocommit
+from ..http_cache import etag_cached, catalog_tables, catalog_list_tables, compatible_tables, PART_TABLES, CATALOG_TABLES
 from utils.tailor_utils import (
     create_part,
-    get_or_create_user_from_session,
     update_part,
     delete_part,
     list_my_parts,
 )
 
 class PartsList(Resource):
+    method_decorators = [etag_cached(catalog_list_tables), db_autocommit]
+
     def get(self, part_type: str):
+        """
+        One page of parts, newest first by default. Query params:
+          limit, cursor, sort (newest|oldest|price_asc|price_desc|brand|popular),
+          brand/material/color/movement_type (comma-separated), min_<col>/max_<col>.
+        The body stays a plain array; the next page is advertised via
+        X-Next-Cursor and a Link: rel="next" header.
+        """
         if not is_allowed(part_type):
             return {"error": "invalid part_type"}, 400
-        return jsonify(list_parts(part_type))
+        try:
+            rows, next_cursor = list_parts_page(part_type, request.args)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        resp = jsonify(rows)
+        if next_cursor:
+            args = request.args.copy()
+            args["cursor"] = next_cursor
+            resp.headers["X-Next-Cursor"] = next_cursor
+            resp.headers["Link"] = f'<{request.path}?{urlencode(list(args.items(multi=True)))}>; rel="next"'
+        return resp
 
 class PartById(Resource):
     # GET is public; write methods gate on session internally.
+    method_decorators = {"get": [etag_cached(catalog_tables), db_autocommit]}
+
     def get(self, part_type: str, part_id: int):
         if not is_allowed(part_type):
             return {"error": "invalid part_type"}, 400
@@ -32,13 +58,13 @@ class PartById(Resource):
         session_user = get_current_user()
         if not session_user:
             return {"error": "unauthorized"}, 401
-        user_row = get_or_create_user_from_session(session_user)
-        if not user_row:
+        user_id = current_user_id()
+        if user_id is None:
             return {"error": "user_not_found"}, 400
         payload = request.get_json(silent=True) or {}
         # Prevent part_type overwrite via payload
         payload.pop("part_type", None)
-        row = update_part(part_type, part_id, payload, user_id=user_row["id"])
+        row = update_part(part_type, part_id, payload, user_id=user_id)
         if not row:
             # not found or not owned
             return {"error": "not_found"}, 404
@@ -50,10 +76,10 @@ class PartById(Resource):
         session_user = get_current_user()
         if not session_user:
             return {"error": "unauthorized"}, 401
-        user_row = get_or_create_user_from_session(session_user)
-        if not user_row:
+        user_id = current_user_id()
+        if user_id is None:
             return {"error": "user_not_found"}, 400
-        ok = delete_part(part_type, part_id, user_id=user_row["id"])
+        ok = delete_part(part_type, part_id, user_id=user_id)
         if not ok:
             return {"error": "not_found"}, 404
         return {"ok": True}
@@ -74,12 +100,12 @@ class PartsCreate(Resource):
         data.pop("__type", None)
         data.pop("image_key", None)  # we only persist image_url
 
-        user_row = get_or_create_user_from_session(session_user)
-        if not user_row:
+        user_id = current_user_id()
+        if user_id is None:
             return {"error": "user_not_found"}, 400
 
         try:
-            row = create_part(part_type, data, user_id=user_row["id"])
+            row = create_part(part_type, data, user_id=user_id)
         except ValueError as e:
             msg = str(e)
             code = 400
@@ -87,12 +113,70 @@ class PartsCreate(Resource):
         return jsonify(row)
 
 class PartsMine(Resource):
-    """Return all parts for the current user, grouped by type."""
+    """
+    Return the current user's parts, grouped by type, in one query.
+    Optional: limit (per type) and <part_type>_before=<id> to page a type.
+    """
     def get(self):
         session_user = get_current_user()
         if not session_user:
             return {"error": "unauthorized"}, 401
-        user_row = get_or_create_user_from_session(session_user)
-        if not user_row:
+        user_id = current_user_id()
+        if user_id is None:
             return {"error": "user_not_found"}, 400
-        return jsonify(list_my_parts(user_row["id"]))
+        limit = request.args.get("limit", type=int)
+        before = {t: request.args.get(f"{t}_before", type=int) for t in PART_TABLES}
+        if limit is not None:
+            limit = max(1, min(limit, MAX_PAGE_SIZE))
+        return jsonify(list_my_parts(user_id, limit=limit, before=before))
+
+class PartsSearch(Resource):
+    """Ranked, typo-tolerant search across all part tables, with per-type counts."""
+    method_decorators = [etag_cached(lambda: PART_TABLES), db_autocommit]
+
+    def get(self):
+        try:
+            return jsonify(search(request.args))
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+class PartsBatch(Resource):
+    """Hydrate many parts at once: GET /api/parts/batch?ids=movements:1,cases:4"""
+    method_decorators = [etag_cached(lambda: CATALOG_TABLES), db_autocommit]
+
+    def get(self):
+        try:
+            return jsonify(batch(request.args))
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+class PartsExport(Resource):
+    """
+    Whole (filtered) catalog for a part type, streamed from a server-side
+    cursor as a JSON array, or NDJSON with ?format=ndjson / Accept: application/x-ndjson.
+    Takes the same filter and sort params as PartsList.
+    """
+    method_decorators = [etag_cached(catalog_list_tables)]
+
+    def get(self, part_type: str):
+        if not is_allowed(part_type):
+            return {"error": "invalid part_type"}, 400
+        try:
+            rows = export_parts(part_type, request.args)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        return stream_rows(rows)
+
+class PartCompatible(Resource):
+    """Ids of parts that fit this one: GET /api/parts/cases/12/compatible?types=dials,straps"""
+    method_decorators = [etag_cached(compatible_tables), db_autocommit]
+
+    def get(self, part_type: str, part_id: int):
+        if not is_allowed(part_type):
+            return {"error": "invalid part_type"}, 400
+        try:
+            return jsonify(compatible_parts(part_type, part_id, request.args))
+        except ValueError as e:
+            if str(e) == "invalid_compatible_with":
+                return {"error": "not found"}, 404
+            return {"error": str(e)}, 400
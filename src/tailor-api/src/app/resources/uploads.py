@@ -1,19 +1,38 @@
 import mimetypes
-from flask import request, jsonify, send_from_directory, abort
+import os
+from flask import request, jsonify, send_file, abort, redirect, Response
 from flask_restful import Resource
 from ..auth_utils import login_required, get_current_user
 from ..storage import (
     get_storage,
     ALLOWED_MIME,
     MAX_UPLOAD_BYTES,
-    LOCAL_STORAGE_DIR_ABS,
+    IMMUTABLE_KEY_RE,
+    LocalStorage,
+    upload_key_owner,
 )
+from ..upload_sessions import UploadSessions
 
 storage = get_storage()
+# Resumable uploads need shared local disk; S3 clients use presigned PUTs instead.
+sessions = UploadSessions(storage) if isinstance(storage, LocalStorage) else None
+
+# If set (e.g. "/_uploads/"), ServeUpload answers with X-Accel-Redirect and lets
+# nginx send the file from an `internal` location aliased to LOCAL_STORAGE_DIR.
+UPLOADS_ACCEL_PREFIX = os.getenv("UPLOADS_ACCEL_PREFIX", "")
+
+# Width the catalog grids render at; clients get a matching URL from presign.
+THUMB_WIDTH = int(os.getenv("THUMB_WIDTH", "480"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MUTABLE_CACHE_CONTROL = "public, max-age=300"
 
 
 class PresignUpload(Resource):
-    """Create a presigned-style PUT target (local backend today)."""
+    """
+    Create a presigned PUT target (API endpoint for local, bucket URL for S3).
+    `size` is required for S3: the presigned URL only accepts exactly that many bytes.
+    """
     method_decorators = [login_required]
 
     def post(self):
@@ -25,37 +44,197 @@ class PresignUpload(Resource):
         if content_type not in ALLOWED_MIME:
             return {"error": "unsupported_file_type"}, 400
 
-        presign = storage.generate_put(user["google_id"], filename, content_type)
+        size = data.get("size")
+        if size is not None and (not isinstance(size, int) or isinstance(size, bool) or size < 0):
+            return {"error": "invalid_size"}, 400
+        try:
+            presign = storage.generate_put(user["google_id"], filename, content_type, size=size)
+        except ValueError as e:
+            code = 413 if str(e) == "too_large" else 400
+            return {"error": str(e)}, code
         return jsonify({
             "key": presign["key"],
             "uploadUrl": presign["uploadUrl"],
             "maxBytes": MAX_UPLOAD_BYTES,
             "cdnUrl": storage.public_url(presign["key"]),
+            "thumbUrl": storage.public_url(presign["key"], width=THUMB_WIDTH),
         })
 
 
+_PUT_ERROR_STATUS = {"too_large": 413, "key_exists": 409}
+
+
 class PutUpload(Resource):
-    """Handle the actual PUT of bytes (local backend)."""
+    """Handle a PUT of bytes proxied through the API (always used by the local backend)."""
     method_decorators = [login_required]
 
     def put(self):
         key = request.args.get("key")
         if not key:
             return {"error": "missing_key"}, 400
-        data = request.get_data()
+        # Only the caller's own upload keys; this also keeps clients off blobs/ and derived/.
+        if upload_key_owner(key) != get_current_user()["google_id"]:
+            return {"error": "forbidden_key"}, 403
+        # Cheap early reject when the client tells us the size up front.
+        if request.content_length is not None and request.content_length > MAX_UPLOAD_BYTES:
+            return {"error": "too_large"}, 413
         content_type = request.mimetype or request.headers.get("Content-Type") or "application/octet-stream"
         try:
-            storage.handle_put(key, data, content_type)
+            # Stream from the WSGI input; the body is never held in memory.
+            info = storage.handle_put_stream(key, request.stream, content_type)
         except ValueError as e:
-            code = 413 if str(e) == "too_large" else 400
-            return {"error": str(e)}, code
+            return {"error": str(e)}, _PUT_ERROR_STATUS.get(str(e), 400)
+        return {"ok": True, "size": info["size"], "sha256": info["sha256"]}
+
+
+_SESSION_ERROR_STATUS = {
+    "too_large": 413,
+    "upload_session_not_found": 404,
+    "incomplete_upload": 409,
+    "upload_session_busy": 409,
+    "key_exists": 409,
+}
+
+
+def _session_error(e: ValueError):
+    return {"error": str(e)}, _SESSION_ERROR_STATUS.get(str(e), 400)
+
+
+def _session_body(meta: dict) -> dict:
+    body = {
+        "uploadId": meta["id"],
+        "key": meta["key"],
+        "size": meta["size"],
+        "chunkSize": meta["chunk_size"],
+        "chunks": meta["chunks"],
+        "chunkUrl": f"/api/uploads/sessions/{meta['id']}/chunks/{{index}}",
+        "cdnUrl": storage.public_url(meta["key"]),
+    }
+    if "received" in meta:
+        body.update(received=meta["received"], missing=meta["missing"], offset=meta["offset"])
+    return body
+
+
+class UploadSessionCreate(Resource):
+    """
+    Start a resumable upload: body {filename, contentType, size, sha256?}.
+    Chunks of `chunkSize` bytes (the last one shorter) are PUT to chunkUrl,
+    in any order and in parallel, then POSTed to .../complete.
+    """
+    method_decorators = [login_required]
+
+    def post(self):
+        if sessions is None:
+            return {"error": "resumable_uploads_unsupported"}, 501
+        user = get_current_user()
+        data = request.get_json(silent=True) or {}
+        filename = data.get("filename") or "upload"
+        content_type = data.get("contentType") or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        try:
+            meta = sessions.create(user["google_id"], filename, content_type, data.get("size"), data.get("sha256"))
+        except ValueError as e:
+            return _session_error(e)
+        return _session_body(meta), 201
+
+
+class UploadSessionItem(Resource):
+    """GET: which chunks arrived (and the contiguous offset to resume from). DELETE: abort."""
+    method_decorators = [login_required]
+
+    def get(self, upload_id):
+        if sessions is None:
+            return {"error": "resumable_uploads_unsupported"}, 501
+        try:
+            return _session_body(sessions.status(upload_id, get_current_user()["google_id"]))
+        except ValueError as e:
+            return _session_error(e)
+
+    def delete(self, upload_id):
+        if sessions is None:
+            return {"error": "resumable_uploads_unsupported"}, 501
+        try:
+            sessions.abort(upload_id, get_current_user()["google_id"])
+        except ValueError as e:
+            return _session_error(e)
         return {"ok": True}
 
 
+class UploadSessionChunk(Resource):
+    """PUT one chunk; an optional X-Chunk-Sha256 header is verified before it is kept."""
+    method_decorators = [login_required]
+
+    def put(self, upload_id, index):
+        if sessions is None:
+            return {"error": "resumable_uploads_unsupported"}, 501
+        try:
+            info = sessions.put_chunk(
+                upload_id, get_current_user()["google_id"], index, request.stream,
+                sha256=request.headers.get("X-Chunk-Sha256"),
+            )
+        except ValueError as e:
+            return _session_error(e)
+        return {"ok": True, **info}
+
+
+class UploadSessionComplete(Resource):
+    """Assemble the chunks, verify type/size/checksum, and publish the key."""
+    method_decorators = [login_required]
+
+    def post(self, upload_id):
+        if sessions is None:
+            return {"error": "resumable_uploads_unsupported"}, 501
+        data = request.get_json(silent=True) or {}
+        try:
+            info = sessions.complete(upload_id, get_current_user()["google_id"], data.get("sha256"))
+        except ValueError as e:
+            return _session_error(e)
+        return {"ok": True, **info, "cdnUrl": storage.public_url(info["key"])}
+
+
 class ServeUpload(Resource):
-    """Serve uploaded files. Public for hackathon; lock down later if needed."""
+    """
+    Serve uploaded files. Public for hackathon; lock down later if needed.
+
+    Hot path: cached metadata (no stat/MIME lookup), small files straight from
+    the in-memory LRU, everything else via send_file (wsgi.file_wrapper /
+    X-Sendfile when USE_X_SENDFILE is on) or nginx X-Accel-Redirect.
+    Conditional requests and Range are honored on every path.
+    """
     def get(self, key):
         if ".." in key or key.startswith("/"):
             abort(400)
-        guessed = mimetypes.guess_type(key)[0] or "application/octet-stream"
-        return send_from_directory(LOCAL_STORAGE_DIR_ABS, key, mimetype=guessed, conditional=True)
+        direct = storage.download_url(key)
+        if direct:
+            # Remote backend: hand the client a short-lived URL to the object itself.
+            return redirect(direct, code=302)
+
+        # ?w=<px>: serve the smallest rendered variant at least that wide.
+        width = request.args.get("w", type=int)
+        served = storage.variant_key(key, width) if width and width > 0 else key
+        try:
+            meta = storage.file_meta(served)
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            abort(404)
+        # A ?w= request answered with the original may get a variant later: keep it short-lived.
+        fallback = served == key and bool(width)
+        immutable = IMMUTABLE_KEY_RE.match(served) and not fallback
+        cache_control = IMMUTABLE_CACHE_CONTROL if immutable else MUTABLE_CACHE_CONTROL
+
+        if UPLOADS_ACCEL_PREFIX:
+            resp = Response(mimetype=meta.mimetype)
+            resp.headers["X-Accel-Redirect"] = f"{UPLOADS_ACCEL_PREFIX.rstrip('/')}/{served}"
+        else:
+            try:
+                data = storage.hot_bytes(served, meta)
+            except FileNotFoundError:
+                abort(404)
+            if data is not None:
+                resp = Response(data, mimetype=meta.mimetype)
+                resp.set_etag(meta.etag)
+                resp.last_modified = meta.mtime
+                resp.make_conditional(request, accept_ranges=True, complete_length=meta.size)
+            else:
+                resp = send_file(meta.path, mimetype=meta.mimetype, conditional=True,
+                                 etag=meta.etag, last_modified=meta.mtime)
+        resp.headers["Cache-Control"] = cache_control
+        return resp
@@ -1,4 +1,5 @@
 import os
+import threading
 from pathlib import Path
 from dotenv import load_dotenv
 from flask import Flask, jsonify, session, request, redirect, url_for, flash
@@ -6,6 +7,9 @@ from authlib.integrations.flask_client import OAuth
 from flask_restful import Api
 
 from app.use_store import JSONUserStore, PostgresUserStore
+from app import auth_utils, build_views, db_context, upload_gc, usage_reconcile
+from db.db_utils import pool_stats
+from utils.catalog_cache import catalog_cache
 
 ENV_PATH = Path(__file__).with_name(".env")
 load_dotenv(dotenv_path=ENV_PATH)
@@ -21,7 +25,31 @@ app.secret_key = require_env("FLASK_SECRET_KEY")
 app.config.update(
     SESSION_COOKIE_SAMESITE="Lax",
     SESSION_COOKIE_SECURE=False,  # set True behind HTTPS
+    USE_X_SENDFILE=os.getenv("USE_X_SENDFILE") == "1",  # Apache/lighttpd sendfile offload
 )
+db_context.init_app(app)
+auth_utils.init_app(app)
+
+# Background threads belong to the serving process only: they start on the
+# first request (so only the reloader's serving child runs them), never at
+# import, since derivative workers may re-import this module.
+_jobs_lock = threading.Lock()
+_jobs_started = False
+
+def start_background_jobs() -> None:
+    global _jobs_started
+    with _jobs_lock:
+        if _jobs_started:
+            return
+        _jobs_started = True
+    upload_gc.start_scheduler()  # no-op unless UPLOAD_GC_INTERVAL is set
+    usage_reconcile.start_scheduler()  # no-op unless PART_USAGE_RECONCILE_INTERVAL is set
+    build_views.start_flusher()  # batches feed view counts; BUILD_VIEWS_FLUSH_INTERVAL=0 writes through
+
+@app.before_request
+def _ensure_background_jobs():
+    if not _jobs_started:
+        start_background_jobs()
 
 USER_DB_PATH = os.getenv("USER_DB_PATH", "./data/users.json")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://127.0.0.1:5173")
@@ -83,31 +111,51 @@ def auth_logout():
 # -------------------- API --------------------
 api = Api(app, prefix="/api")
 
-from app.resources.parts import PartsList, PartById, PartsCreate, PartsMine
-from app.resources.builds import BuildList, BuildItem, PublishBuild
+from app.resources.parts import PartsList, PartById, PartsCreate, PartsMine, PartsSearch, PartsBatch, PartsExport, PartCompatible
+from app.resources.builds import BuildList, BuildItem, PublishBuild, BuildConfigurator, BuildQuote, BuildFeed
 from app.resources.users import Me, Profile
-from app.resources.uploads import PresignUpload, PutUpload, ServeUpload
+from app.resources.admin import AdminImport
+from app.resources.uploads import (
+    PresignUpload, PutUpload, ServeUpload,
+    UploadSessionCreate, UploadSessionItem, UploadSessionChunk, UploadSessionComplete,
+)
 
 api.add_resource(PresignUpload, "/uploads/presign")
 api.add_resource(PutUpload, "/uploads/put")
+api.add_resource(UploadSessionCreate, "/uploads/sessions")
+api.add_resource(UploadSessionItem, "/uploads/sessions/<string:upload_id>")
+api.add_resource(UploadSessionChunk, "/uploads/sessions/<string:upload_id>/chunks/<int:index>")
+api.add_resource(UploadSessionComplete, "/uploads/sessions/<string:upload_id>/complete")
 api.add_resource(ServeUpload, "/uploads/file/<path:key>")
 
+api.add_resource(AdminImport, "/admin/import/<string:part_type>")     # POST CSV/NDJSON feed (ADMIN_EMAILS)
+
 api.add_resource(Me, "/me")
 api.add_resource(Profile, "/profile")
 
 api.add_resource(PartsCreate, "/parts")                                # POST (create)
 api.add_resource(PartsMine, "/parts/mine")                             # GET current user's parts
+api.add_resource(PartsSearch, "/parts/search")                         # GET ?q= (public)
+api.add_resource(PartsBatch, "/parts/batch")                           # GET ?ids=type:id,... (public)
 api.add_resource(PartsList, "/parts/<string:part_type>")               # GET list (public)
+api.add_resource(PartsExport, "/parts/<string:part_type>/export")       # GET streamed JSON/NDJSON (public)
 api.add_resource(PartById, "/parts/<string:part_type>/<int:part_id>")  # GET (public), PATCH/DELETE (auth+owner)
+api.add_resource(PartCompatible, "/parts/<string:part_type>/<int:part_id>/compatible")  # GET ?types= (public)
 
 api.add_resource(BuildList, "/builds")
-api.add_resource(BuildItem, "/builds/<int:build_id>")
+api.add_resource(BuildConfigurator, "/builds/configure")                # GET ?budget=&k=&<type>.<filter>= (public)
+api.add_resource(BuildQuote, "/builds/quote")                            # POST batch pricing, nothing saved (public)
+api.add_resource(BuildFeed, "/builds/feed")                              # GET published builds ?sort=&brand=&cursor= (public)
+api.add_resource(BuildItem, "/builds/<int:build_id>")                   # GET (owner or published), DELETE (owner)
 api.add_resource(PublishBuild, "/builds/<int:build_id>/publish")
 
 @app.get("/api/health")
 def api_health():
-    return jsonify({"ok": True})
+    return jsonify({"ok": True, "db_pool": pool_stats(), "catalog_cache": catalog_cache.stats()})
 
-if __name__ == "__main__":
+def main() -> None:
     # Keep 127.0.0.1 if your Vite proxy expects that, otherwise 0.0.0.0 for LAN
     app.run(host="127.0.0.1", port=5000, debug=True)
+
+if __name__ == "__main__":
+    main()
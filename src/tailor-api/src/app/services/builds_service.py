@@ -1,32 +1,197 @@
-from typing import Dict, Any, List
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Any, List, Optional
 from utils.tailor_utils import (
-    get_user_by_google_id,
     create_build,
     get_user_builds,
+    get_build_detail,
     delete_build_for_user,
-    publish_build_for_user
+    publish_build_for_user,
+    get_price_candidates,
+    get_parts_batch,
+    get_part_prices,
+    query_build_feed,
+    FEED_SORTS,
 )
+from utils.configurator import PriceGroups, top_k_builds
+from .parts_service import part_filters, encode_cursor, decode_cursor
+from .. import build_views
 
-def create_build_for_user(google_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    user = get_user_by_google_id(google_id)
-    if not user:
+BUILD_PART_TYPES = ("movements", "cases", "dials", "straps", "hands", "crowns")
+
+def create_build_for_user(user_id: Optional[int], payload: Dict[str, Any],
+                          allow_incompatible: bool = False) -> Dict[str, Any]:
+    if user_id is None:
         raise ValueError("user_not_found")
-    return create_build(user["id"], payload)
+    return create_build(user_id, payload, allow_incompatible=allow_incompatible)
 
-def list_user_builds(google_id: str) -> List[Dict[str, Any]]:
-    user = get_user_by_google_id(google_id)
-    if not user:
+def list_user_builds(user_id: Optional[int], expand: bool = False) -> List[Dict[str, Any]]:
+    if user_id is None:
         return []
-    return get_user_builds(user["id"])
+    return get_user_builds(user_id, expand=expand)
+
+def get_build(viewer_id: Optional[int], build_id: int) -> Optional[Dict[str, Any]]:
+    build = get_build_detail(build_id, viewer_id)
+    if build and build["published"] and build["user_id"] != viewer_id:
+        build_views.record(build_id)
+    return build
 
-def delete_user_build(google_id: str, build_id: int) -> bool:
-    user = get_user_by_google_id(google_id)
-    if not user:
+def delete_user_build(user_id: Optional[int], build_id: int) -> bool:
+    if user_id is None:
         return False
-    return delete_build_for_user(user["id"], build_id)
+    return delete_build_for_user(user_id, build_id)
 
-def publish_build(google_id: str, build_id: int) -> bool:
-    user = get_user_by_google_id(google_id)
-    if not user:
+def publish_build(user_id: Optional[int], build_id: int) -> bool:
+    if user_id is None:
         return False
-    return publish_build_for_user(user["id"], build_id, True)
+    return publish_build_for_user(user_id, build_id, True)
+
+# ---------- Configurator ----------
+CONFIGURE_DEFAULT_K = 10
+CONFIGURE_MAX_K = 50
+_MAX_BUDGET = Decimal("100000000")
+
+class _Prefixed:
+    """View of request args under "<part_type>." so part filters parse unchanged."""
+    def __init__(self, args, prefix: str):
+        self._args = args
+        self._prefix = prefix
+
+    def get(self, name, default=None):
+        return self._args.get(self._prefix + name, default)
+
+    def getlist(self, name):
+        return self._args.getlist(self._prefix + name)
+
+def configure(args) -> Dict[str, Any]:
+    """
+    Top-k complete builds (one part of each type) within ?budget=, cheapest
+    first (sort=price_asc) or closest to the budget (sort=price_desc).
+    Per-type filters use the catalog list params prefixed with the type, e.g.
+    movements.movement_type=Automatic&cases.material=steel&straps.max_width_mm=20.
+    Raises ValueError("invalid_*"/"missing_budget").
+    """
+    raw = args.get("budget")
+    if not raw:
+        raise ValueError("missing_budget")
+    try:
+        budget = Decimal(raw)
+    except InvalidOperation:
+        raise ValueError("invalid_budget")
+    if not budget.is_finite() or budget <= 0 or budget > _MAX_BUDGET:
+        raise ValueError("invalid_budget")
+
+    sort = args.get("sort") or "price_asc"
+    if sort not in ("price_asc", "price_desc"):
+        raise ValueError("invalid_sort")
+    try:
+        k = int(args.get("k") or CONFIGURE_DEFAULT_K)
+    except ValueError:
+        raise ValueError("invalid_k")
+    k = max(1, min(k, CONFIGURE_MAX_K))
+
+    groups = []
+    for t in BUILD_PART_TYPES:
+        text_filters, ranges, compat = part_filters(t, _Prefixed(args, f"{t}."))
+        groups.append(PriceGroups(t, get_price_candidates(t, text_filters, ranges, max_price=budget, compat=compat)))
+    result = top_k_builds(groups, int(budget * 100), k=k, maximize=sort == "price_desc")
+
+    refs = {(t, pid) for b in result["builds"] for t, pid in b["parts"].items()}
+    parts = {(r["part_type"], r["id"]): r["part"] for r in get_parts_batch(sorted(refs))} if refs else {}
+    return {
+        "budget": budget,
+        "sort": sort,
+        "exhaustive": result["exhaustive"],
+        "builds": [
+            {
+                "total_price": Decimal(b["total"]) / 100,
+                **{f"{t}_id": b["parts"][t] for t in BUILD_PART_TYPES},
+                "parts": {t: parts.get((t, b["parts"][t])) for t in BUILD_PART_TYPES},
+            }
+            for b in result["builds"]
+        ],
+    }
+
+# ---------- Quotes ----------
+QUOTE_MAX_BUILDS = 500
+
+def quote_builds(payload: Any) -> Dict[str, Any]:
+    """
+    Price candidate builds without saving anything. `payload` is
+    {"builds": [{"movements_id": 1, "cases_id": 4, ...}, ...]} (or the bare
+    list); every referenced part is priced by one batched lookup. Each quote
+    has total_price (unpriced parts count as 0, as in create_build), per-type
+    prices, and `missing` for ids that don't exist.
+    Raises ValueError("invalid_builds"/"too_many_builds"/"invalid_<type>_id").
+    """
+    builds = payload.get("builds") if isinstance(payload, dict) else payload
+    if not isinstance(builds, list) or not builds:
+        raise ValueError("invalid_builds")
+    if len(builds) > QUOTE_MAX_BUILDS:
+        raise ValueError("too_many_builds")
+
+    selections = []
+    for b in builds:
+        if not isinstance(b, dict):
+            raise ValueError("invalid_builds")
+        chosen = {}
+        for t in BUILD_PART_TYPES:
+            pid = b.get(f"{t}_id")
+            if pid is None:
+                continue
+            if isinstance(pid, bool) or not isinstance(pid, int) or pid <= 0:
+                raise ValueError(f"invalid_{t}_id")
+            chosen[t] = pid
+        selections.append(chosen)
+
+    prices = get_part_prices([(t, pid) for chosen in selections for t, pid in chosen.items()])
+    quotes = []
+    for chosen in selections:
+        total = Decimal(0)
+        part_prices, missing = {}, []
+        for t, pid in chosen.items():
+            if (t, pid) not in prices:
+                missing.append(t)
+                continue
+            price = prices[(t, pid)]
+            part_prices[t] = price
+            total += price or 0
+        quotes.append({
+            **{f"{t}_id": chosen.get(t) for t in BUILD_PART_TYPES},
+            "total_price": total,
+            "prices": part_prices,
+            "missing": missing,
+        })
+    return {"quotes": quotes}
+
+# ---------- Published feed ----------
+FEED_CURSOR_KEYS = {"newest": "timestamp", "cheapest": "decimal", "popular": "int"}
+FEED_PAGE_SIZE = 20
+FEED_PAGE_MAX = 100
+
+def feed_page(args):
+    """
+    ?sort=newest|cheapest|popular[&brand=][&limit=][&cursor=] -> (rows, next_cursor).
+    Raises ValueError("invalid_sort"/"invalid_limit"/"invalid_cursor").
+    """
+    sort = args.get("sort") or "newest"
+    if sort not in FEED_SORTS:
+        raise ValueError("invalid_sort")
+    try:
+        limit = int(args.get("limit") or FEED_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("invalid_limit")
+    limit = max(1, min(limit, FEED_PAGE_MAX))
+    brand = (args.get("brand") or "").strip() or None
+    cursor = args.get("cursor")
+    after = decode_cursor(cursor, sort, FEED_CURSOR_KEYS[sort]) if cursor else None
+
+    rows = query_build_feed(sort, brand=brand, limit=limit + 1, after=after)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        key = last["_sort_key"]
+        next_cursor = encode_cursor(sort, key.isoformat() if sort == "newest" else key, last["id"])
+    for r in rows:
+        r.pop("_sort_key", None)
+    return rows, next_cursor
@@ -1,8 +1,22 @@
-from typing import List, Dict, Any, Optional
-from utils.tailor_utils import get_all_parts, get_parts_by_id
+import base64
+import binascii
+import json
+import os
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import List, Dict, Any, Optional, Tuple
+from utils.tailor_utils import (
+    get_all_parts, get_parts_by_id, query_parts, search_parts, get_parts_batch, stream_parts,
+    PART_TEXT_FILTERS, PART_RANGE_FILTERS, PART_SORTS,
+)
+from utils.compat import compat_ranges, compatible_ids
 
 _ALLOWED = {"movements","cases","dials","straps","hands","crowns"}
 
+DEFAULT_PAGE_SIZE = int(os.getenv("PARTS_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("PARTS_PAGE_MAX", "200"))
+
 def is_allowed(part_type: str) -> bool:
     return part_type in _ALLOWED
 
@@ -15,3 +29,220 @@ def get_part(part_type: str, part_id: int) -> Optional[Dict[str, Any]]:
     if not is_allowed(part_type):
         return None
     return get_parts_by_id(part_type, part_id)
+
+# ---------- Keyset pagination ----------
+def _json_key(v):
+    return str(v) if isinstance(v, Decimal) else v
+
+def encode_cursor(sort: str, sort_key: Any, last_id: int) -> str:
+    raw = json.dumps({"s": sort, "k": _json_key(sort_key), "i": last_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+# Type of the sort key a cursor carries, per list sort. None of the keys is
+# nullable (the SQL expressions COALESCE), so null is always rejected.
+PART_CURSOR_KEYS = {
+    "newest": "int", "oldest": "int", "price_asc": "decimal", "price_desc": "decimal",
+    "brand": "text", "popular": "int",
+}
+
+def _is_int(v) -> bool:
+    return isinstance(v, int) and not isinstance(v, bool)
+
+def _cursor_key(k: Any, kind: str) -> Any:
+    """Check a decoded sort key against the column type it will be compared with."""
+    if kind == "int":
+        if not _is_int(k):
+            raise ValueError
+        return k
+    if kind == "decimal":
+        if not (_is_int(k) or isinstance(k, str)):
+            raise ValueError
+        try:
+            d = Decimal(str(k))
+        except InvalidOperation:
+            raise ValueError
+        if not d.is_finite():
+            raise ValueError
+        return d
+    if kind == "text":
+        if not isinstance(k, str):
+            raise ValueError
+        return k
+    if kind == "timestamp":
+        if not isinstance(k, str):
+            raise ValueError
+        datetime.fromisoformat(k)
+        return k
+    raise ValueError
+
+def decode_cursor(cursor: str, sort: str, kind: str) -> Tuple[Any, int]:
+    """(sort_key, last_id) from a cursor made for `sort`; the key must be of `kind`."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(data, dict) or data["s"] != sort or not _is_int(data["i"]):
+            raise ValueError
+        return _cursor_key(data["k"], kind), data["i"]
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise ValueError("invalid_cursor")
+
+def _parse_number(raw: Optional[str]) -> Optional[Decimal]:
+    if raw is None or raw == "":
+        return None
+    try:
+        n = Decimal(raw)
+    except InvalidOperation:
+        raise ValueError("invalid_filter")
+    if not n.is_finite():
+        raise ValueError("invalid_filter")
+    return n
+
+def _parse_refs(raw: str, error: str) -> List[Tuple[str, int]]:
+    """"movements:1,cases:4" -> [("movements", 1), ("cases", 4)]."""
+    refs = []
+    for token in raw.split(","):
+        token = token.strip()
+        if not token:
+            continue
+        t, sep, pid = token.partition(":")
+        if not sep or t not in _ALLOWED or not pid.isdigit():
+            raise ValueError(error)
+        refs.append((t, int(pid)))
+    return refs
+
+def _parse_filters(part_type: str, args) -> Tuple[str, Dict[str, List[str]], Dict[str, tuple], list]:
+    sort = args.get("sort") or "newest"
+    if sort not in PART_SORTS:
+        raise ValueError("invalid_sort")
+
+    text_filters = {}
+    for name in PART_TEXT_FILTERS[part_type]:
+        values = [v.strip() for raw in args.getlist(name) for v in raw.split(",") if v.strip()]
+        if values:
+            text_filters[name] = values
+
+    ranges = {}
+    for col in PART_RANGE_FILTERS[part_type]:
+        lo = _parse_number(args.get(f"min_{col}"))
+        hi = _parse_number(args.get(f"max_{col}"))
+        if lo is not None or hi is not None:
+            ranges[col] = (lo, hi)
+
+    # compatible_with=cases:12[,straps:3]: only parts that fit all of them
+    refs = _parse_refs(",".join(args.getlist("compatible_with")), "invalid_compatible_with")
+    compat = compat_ranges(part_type, refs) if refs else []
+    return sort, text_filters, ranges, compat
+
+def part_filters(part_type: str, args) -> Tuple[Dict[str, List[str]], Dict[str, tuple], list]:
+    """Text, range and compatibility filters for `part_type` from query params (sort is ignored)."""
+    _, text_filters, ranges, compat = _parse_filters(part_type, args)
+    return text_filters, ranges, compat
+
+def list_parts_page(part_type: str, args) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Parse list query params (filters, sort, limit, cursor) and return
+    (rows, next_cursor). `args` is request.args (or any mapping with getlist).
+    Raises ValueError("invalid_*") for bad input.
+    """
+    sort, text_filters, ranges, compat = _parse_filters(part_type, args)
+
+    try:
+        limit = int(args.get("limit") or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("invalid_limit")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    cursor = args.get("cursor")
+    after = decode_cursor(cursor, sort, PART_CURSOR_KEYS[sort]) if cursor else None
+
+    rows = query_parts(part_type, text_filters, ranges, sort=sort, limit=limit + 1, after=after, compat=compat)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, last["_sort_key"], last["id"])
+    for r in rows:
+        r.pop("_sort_key", None)
+    return rows, next_cursor
+
+def export_parts(part_type: str, args):
+    """Unpaginated, filtered catalog as a lazy row iterator (server-side cursor)."""
+    sort, text_filters, ranges, compat = _parse_filters(part_type, args)
+    return stream_parts(part_type, text_filters, ranges, sort=sort, compat=compat)
+
+# ---------- Search ----------
+SEARCH_MAX_LIMIT = 50
+SEARCH_MAX_OFFSET = 1000
+# One- and two-letter prefixes match most of the catalog; collect at most this
+# many hits per type for them instead of ranking and counting every row.
+SEARCH_SHORT_QUERY_HITS = int(os.getenv("SEARCH_SHORT_QUERY_HITS", "1000"))
+_MAX_TERMS = 8
+
+def search(args) -> Dict[str, Any]:
+    """
+    Parse /api/parts/search params (q, types, limit, offset) into a prefix
+    tsquery plus a trigram needle. Raises ValueError("invalid_*"/"missing_query").
+    """
+    terms = re.findall(r"[^\W_]+", (args.get("q") or "").lower())[:_MAX_TERMS]
+    if not terms:
+        raise ValueError("missing_query")
+    tsquery = " & ".join(f"{t}:*" for t in terms)
+    raw = " ".join(terms)
+
+    requested = [t.strip() for t in (args.get("types") or "").split(",") if t.strip()]
+    if any(t not in _ALLOWED for t in requested):
+        raise ValueError("invalid_part_type")
+    types = requested or sorted(_ALLOWED)
+
+    try:
+        limit = int(args.get("limit") or 20)
+        offset = int(args.get("offset") or 0)
+    except ValueError:
+        raise ValueError("invalid_limit")
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    offset = max(0, min(offset, SEARCH_MAX_OFFSET))
+
+    # Trigrams are meaningless below three characters; stick to (capped) prefix matching.
+    short = len(raw) < 3
+    result = search_parts(tsquery, raw, types, limit=limit, offset=offset, fuzzy=not short,
+                          max_hits=SEARCH_SHORT_QUERY_HITS if short else None)
+    result["query"] = raw
+    return result
+
+# ---------- Batch hydration ----------
+BATCH_MAX_IDS = 200
+
+def batch(args) -> Dict[str, Any]:
+    """
+    Parse ids=movements:1,cases:4,... and hydrate them in one query.
+    Returns {"items": [{"part_type", "id", "part"}, ...], "missing": ["cases:4", ...]}.
+    """
+    refs = _parse_refs(args.get("ids") or "", "invalid_ids")
+    if not refs:
+        raise ValueError("missing_ids")
+    refs = list(dict.fromkeys(refs))
+    if len(refs) > BATCH_MAX_IDS:
+        raise ValueError("too_many_ids")
+
+    rows = get_parts_batch(refs)
+    found = {(r["part_type"], r["id"]) for r in rows}
+    return {
+        "items": rows,
+        "missing": [f"{t}:{pid}" for t, pid in refs if (t, pid) not in found],
+    }
+
+# ---------- Compatibility ----------
+def compatible_parts(part_type: str, part_id: int, args) -> Dict[str, List[int]]:
+    """
+    Ids of parts of each requested type (?types=, default: every related
+    type) that fit the given part. Types without a fit rule are omitted.
+    """
+    requested = [t.strip() for t in (args.get("types") or "").split(",") if t.strip()]
+    if any(t not in _ALLOWED for t in requested):
+        raise ValueError("invalid_part_type")
+    out = {}
+    for t in requested or sorted(_ALLOWED - {part_type}):
+        ids = compatible_ids(t, part_type, part_id)
+        if ids is not None:
+            out[t] = ids
+    return out
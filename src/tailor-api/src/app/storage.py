@@ -1,9 +1,20 @@
 import os
+import io
 import re
+import shutil
+import stat
+import hashlib
 import mimetypes
 import pathlib
+import tempfile
 import uuid
 from pathlib import Path
+from typing import BinaryIO, NamedTuple
+
+from utils.catalog_cache import CatalogCache
+from app.derivatives import (
+    pipeline as derivative_pipeline, derived_key, pick_width, DERIVED_PREFIX, DERIVATIVE_WIDTHS,
+)
 
 # ---------- Config ----------
 # Switchable later to "s3" without changing the front-end
@@ -15,6 +26,134 @@ LOCAL_STORAGE_DIR_ABS = str(Path(LOCAL_STORAGE_DIR).resolve())
 
 ALLOWED_MIME = {"image/png", "image/jpeg", "image/webp"}
 MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))  # 10 MB
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+# "plain": every key is its own file. "cas": content-addressed blobs under
+# blobs/<aa>/<bb>/<sha256>; keys are hard links to them (st_nlink - 1 = refcount).
+LOCAL_STORAGE_MODE = os.getenv("LOCAL_STORAGE_MODE", "plain")  # "plain" | "cas"
+BLOB_PREFIX = "blobs"
+
+# Serving: small files are kept in memory, metadata for all recently served keys.
+SERVE_CACHE_MAX_BYTES = int(os.getenv("SERVE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+SERVE_CACHE_FILE_MAX = int(os.getenv("SERVE_CACHE_FILE_MAX", str(256 * 1024)))
+SERVE_CACHE_TTL = float(os.getenv("SERVE_CACHE_TTL", "300"))
+# Stat results (hits and misses) are only trusted briefly: that bounds how long
+# a delete made by another worker goes unnoticed.
+SERVE_META_TTL = float(os.getenv("SERVE_META_TTL", "5"))
+
+# Keys are write-once (handle_put_stream refuses existing targets, PutUpload only
+# takes the caller's own parts/ keys; blobs are named by hash), so responses for
+# the keys we mint can be cached forever.
+IMMUTABLE_KEY_RE = re.compile(
+    r"^(?:derived/)?(parts/[^/]+/[0-9a-f]{32}\.[A-Za-z0-9]+)(?:/w\d+\.webp)?$"
+    r"|^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}$"
+)
+
+# S3-compatible backend (AWS, MinIO, R2, ...). Only read when STORAGE_BACKEND=s3.
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None     # e.g. http://127.0.0.1:9000 for MinIO
+S3_REGION = os.getenv("S3_REGION") or None
+S3_PUBLIC_BASE_URL = os.getenv("S3_PUBLIC_BASE_URL", "")    # CDN / public bucket URL; empty = presigned GETs
+S3_PRESIGN_TTL = int(os.getenv("S3_PRESIGN_TTL", "900"))    # seconds
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNK = int(os.getenv("S3_MULTIPART_CHUNK", str(8 * 1024 * 1024)))
+
+# Leading bytes that identify each allowed image type
+_MAGIC_PREFIX = {
+    "image/png": b"\x89PNG\r\n\x1a\n",
+    "image/jpeg": b"\xff\xd8\xff",
+}
+_SNIFF_BYTES = 12
+
+
+def sniff_matches(content_type: str, head: bytes) -> bool:
+    """True if the first bytes of a file look like `content_type`."""
+    if content_type == "image/webp":
+        return head[:4] == b"RIFF" and head[8:12] == b"WEBP"
+    prefix = _MAGIC_PREFIX.get(content_type)
+    return prefix is not None and head.startswith(prefix)
+
+
+class FileMeta(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    mimetype: str
+    etag: str
+
+
+_serve_cache = CatalogCache(max_bytes=SERVE_CACHE_MAX_BYTES, ttl=SERVE_CACHE_TTL)  # bytes, keyed by etag
+_serve_meta = CatalogCache(max_bytes=4 * 1024 * 1024, ttl=SERVE_META_TTL)
+
+
+def upload_key_owner(key: str) -> str | None:
+    """Owner segment of a key minted by generate_put (parts/<owner>/<file>), else None."""
+    parts = key.split("/")
+    if len(parts) == 3 and parts[0] == "parts" and parts[1] and parts[2]:
+        return parts[1]
+    return None
+
+
+class UploadGuard:
+    """
+    File-like wrapper over an upload stream that counts, hashes and sniffs
+    bytes as they are read, raising ValueError("too_large") the moment
+    MAX_UPLOAD_BYTES is crossed. Call verify() after the last read.
+    """
+
+    def __init__(self, stream: BinaryIO, content_type: str, max_bytes: int = MAX_UPLOAD_BYTES):
+        if content_type not in ALLOWED_MIME:
+            raise ValueError("unsupported_file_type")
+        self._stream = stream
+        self._digest = hashlib.sha256()
+        self.content_type = content_type
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.head = b""
+
+    def read(self, n: int = -1) -> bytes:
+        chunk = self._stream.read(UPLOAD_CHUNK_BYTES if n is None or n < 0 else n)
+        if not chunk:
+            return b""
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise ValueError("too_large")
+        if len(self.head) < _SNIFF_BYTES:
+            self.head += chunk[:_SNIFF_BYTES - len(self.head)]
+        self._digest.update(chunk)
+        return chunk
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def verify(self) -> None:
+        if not sniff_matches(self.content_type, self.head):
+            raise ValueError("content_type_mismatch")
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _publish_new(src: str, path: Path) -> None:
+    """Move `src` to `path` unless something is already there (keys are write-once)."""
+    try:
+        os.link(src, path)
+    except FileExistsError:
+        raise ValueError("key_exists")
+    except OSError:
+        # Filesystem without hard links: best effort check-then-rename.
+        if path.exists():
+            raise ValueError("key_exists")
+        os.replace(src, path)
+        return
+    os.unlink(src)
 
 
 def _sanitize_filename(name: str) -> str:
@@ -23,57 +162,321 @@ def _sanitize_filename(name: str) -> str:
 
 
 class Storage:
-    """Interface; we implement LocalStorage now.
-    Later you can add S3Storage with the same methods.
-    """
+    """Interface implemented by LocalStorage and S3Storage (STORAGE_BACKEND)."""
 
-    def generate_put(self, user_id: str, filename: str, content_type: str) -> dict:
+    def generate_put(self, user_id: str, filename: str, content_type: str, size: int | None = None) -> dict:
         ...
 
     def handle_put(self, key: str, data: bytes, content_type: str) -> bool:
         ...
 
-    def public_url(self, key: str) -> str:
+    def handle_put_stream(self, key: str, stream: BinaryIO, content_type: str) -> dict:
+        """Store bytes read incrementally from `stream`; returns {"size", "sha256"}."""
         ...
 
+    def delete(self, key: str) -> bool:
+        """Remove a key; returns False if it did not exist."""
+        ...
+
+    def public_url(self, key: str, width: int | None = None) -> str:
+        """URL for `key`; with `width`, one that resolves to a resized variant when available."""
+        ...
+
+    def variant_key(self, key: str, width: int) -> str:
+        """Key of the best stored variant for `width`, or `key` itself."""
+        return key
+
+    def download_url(self, key: str) -> str | None:
+        """Short-lived direct URL for the bytes, or None if served by this app."""
+        return None
+
 
 class LocalStorage(Storage):
-    def __init__(self):
+    def __init__(self, mode: str = LOCAL_STORAGE_MODE):
         # Use an absolute base so send_from_directory is unambiguous on all OSes
         self.base = Path(LOCAL_STORAGE_DIR_ABS)
         self.base.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
 
     def _make_key(self, user_id: str, filename: str, content_type: str) -> str:
-        ext = mimetypes.guess_extension(content_type) or pathlib.Path(filename).suffix or ".bin"
-        return f"parts/{user_id}/{uuid.uuid4().hex}{ext}"
+        return _make_upload_key(user_id, filename, content_type)
 
-    def _path_for(self, key: str) -> Path:
-        # Prevent path escapes
-        if ".." in key or key.startswith("/"):
+    def _resolve(self, key: str) -> Path:
+        # Prevent path escapes and reaching internal files: any dot segment
+        # (.., .sessions, .blobs, in-flight .upload-* / .derive-* temp files).
+        if not key or key.startswith("/") or any(part.startswith(".") for part in key.split("/")):
             raise ValueError("invalid_key")
-        p = self.base.joinpath(key)
+        return self.base.joinpath(key)
+
+    def _path_for(self, key: str) -> Path:
+        """Path to write `key` to; creates its parent. Read paths use _resolve."""
+        p = self._resolve(key)
         p.parent.mkdir(parents=True, exist_ok=True)
         return p
 
-    def generate_put(self, user_id: str, filename: str, content_type: str) -> dict:
+    def _blob_file(self, sha256: str) -> Path:
+        return self.base / BLOB_PREFIX / sha256[:2] / sha256[2:4] / sha256
+
+    def _blob_path(self, sha256: str) -> Path:
+        p = self._blob_file(sha256)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        return p
+
+    def blob_refcount(self, sha256: str) -> int:
+        """Number of keys sharing the blob (cas mode), 0 if it doesn't exist."""
+        try:
+            return max(0, self._blob_file(sha256).stat().st_nlink - 1)
+        except FileNotFoundError:
+            return 0
+
+    def _link_to_blob(self, tmp: str, path: Path, sha256: str) -> None:
+        """
+        Dedup on write: point `path` at the blob for `sha256`, promoting the
+        freshly written temp file to be that blob only if none exists yet.
+        """
+        blob = self._blob_path(sha256)
+        try:
+            try:
+                os.link(blob, path)
+            except FileNotFoundError:
+                # First copy of this content (or the blob was just collected).
+                # Publish by link, never os.replace: a concurrent upload may
+                # have created the blob meanwhile, and its keys must keep
+                # sharing it.
+                try:
+                    os.link(tmp, blob)
+                except FileExistsError:
+                    os.link(blob, path)  # lost that race: share the winner's blob
+                else:
+                    os.link(tmp, path)
+        except FileExistsError:
+            raise ValueError("key_exists")
+        except OSError:
+            # Filesystem without hard links: keep a private copy, no dedup.
+            _publish_new(tmp, path)
+            return
+        os.unlink(tmp)  # the blob (and now the key) hold the content
+
+    def generate_put(self, user_id: str, filename: str, content_type: str, size: int | None = None) -> dict:
         filename = _sanitize_filename(filename)
         key = self._make_key(user_id, filename, content_type)
         # Mirror S3 presign shape: a single-use PUT endpoint and a key
         return {"key": key, "uploadUrl": f"/api/uploads/put?key={key}"}
 
     def handle_put(self, key: str, data: bytes, content_type: str) -> bool:
-        if len(data or b"") > MAX_UPLOAD_BYTES:
-            raise ValueError("too_large")
+        self.handle_put_stream(key, io.BytesIO(data or b""), content_type)
+        return True
+
+    def handle_put_stream(self, key: str, stream: BinaryIO, content_type: str,
+                          expected_sha256: str | None = None) -> dict:
+        """
+        Copy `stream` to a temp file next to the target in UPLOAD_CHUNK_BYTES
+        pieces, aborting as soon as MAX_UPLOAD_BYTES is crossed, hashing as we
+        go and checking the magic bytes against `content_type` (and the digest
+        against `expected_sha256`, if given). The temp file is moved into
+        place only once everything checks out, and never over an existing
+        key: ValueError("key_exists").
+        """
         path = self._path_for(key)
-        with open(path, "wb") as f:
-            f.write(data)
+        if path.exists():
+            raise ValueError("key_exists")  # cheap early reject; _publish_new is the real guard
+        guard = UploadGuard(stream, content_type)
+        fd, tmp = tempfile.mkstemp(prefix=".upload-", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: guard.read(UPLOAD_CHUNK_BYTES), b""):
+                    f.write(chunk)
+            guard.verify()
+            if expected_sha256 is not None and guard.sha256 != expected_sha256:
+                raise ValueError("checksum_mismatch")
+            if self.mode == "cas":
+                self._link_to_blob(tmp, path, guard.sha256)
+            else:
+                _publish_new(tmp, path)
+            self._forget(key)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        if not key.startswith(DERIVED_PREFIX + "/"):
+            self._drop_derivatives(key)
+            derivative_pipeline.submit(str(path), str(self.base), key, guard.sha256)
+        return {"size": guard.size, "sha256": guard.sha256}
+
+    # --- serving ---
+    def _load_meta(self, key: str) -> FileMeta | None:
+        path = self._resolve(key)
+        try:
+            st = path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None  # cached too, for SERVE_META_TTL
+        if not stat.S_ISREG(st.st_mode):
+            return None  # e.g. parts/<uid>: a directory, not an upload
+        mimetype = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        return FileMeta(str(path), st.st_size, st.st_mtime, mimetype, f"{st.st_mtime_ns:x}-{st.st_size:x}")
+
+    def file_meta(self, key: str) -> FileMeta:
+        """Cached stat + MIME type for a key; raises FileNotFoundError."""
+        meta = _serve_meta.get_or_load("meta", key, lambda: self._load_meta(key))
+        if meta is None:
+            raise FileNotFoundError(key)
+        return meta
+
+    def hot_bytes(self, key: str, meta: FileMeta) -> bytes | None:
+        """Contents of small files from the in-memory LRU; None for large ones."""
+        if meta.size > SERVE_CACHE_FILE_MAX:
+            return None
+        # Keyed by etag: bytes never outlive the (short-lived) metadata they match.
+        return _serve_cache.get_or_load("bytes", (key, meta.etag), lambda: Path(meta.path).read_bytes())
+
+    def _forget(self, key: str) -> None:
+        _serve_meta.discard("meta", key)
+
+    def _drop_derivatives(self, key: str) -> None:
+        for w in DERIVATIVE_WIDTHS:
+            self._forget(derived_key(key, w))
+        shutil.rmtree(self.base / DERIVED_PREFIX / key, ignore_errors=True)
+
+    def variant_key(self, key: str, width: int) -> str:
+        w = pick_width(width)
+        if w is None:
+            return key
+        candidate = derived_key(key, w)
+        try:
+            self.file_meta(candidate)
+            return candidate
+        except (FileNotFoundError, ValueError):
+            return key  # not rendered yet (or image narrower than w)
+
+    def delete(self, key: str) -> bool:
+        path = self._resolve(key)
+        self._forget(key)
+        self._drop_derivatives(key)
+        try:
+            st = path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+        if self.mode == "cas" and st.st_nlink == 2:
+            # Last key referencing its blob: drop the blob too. Hash to find it.
+            blob = self._blob_file(_sha256_file(path))
+            try:
+                if os.path.samefile(blob, path):
+                    os.unlink(blob)
+            except FileNotFoundError:
+                pass
+        path.unlink(missing_ok=True)
         return True
 
-    def public_url(self, key: str) -> str:
+    def public_url(self, key: str, width: int | None = None) -> str:
         # Served via Flask so it works behind your Vite proxy
+        if width:
+            return f"/api/uploads/file/{key}?w={int(width)}"
+        return f"/api/uploads/file/{key}"
+
+
+def _make_upload_key(user_id: str, filename: str, content_type: str) -> str:
+    ext = mimetypes.guess_extension(content_type) or pathlib.Path(filename).suffix or ".bin"
+    return f"parts/{user_id}/{uuid.uuid4().hex}{ext}"
+
+
+class S3Storage(Storage):
+    """
+    S3-compatible backend. Clients PUT/GET bytes directly against presigned
+    URLs, so image traffic bypasses Flask. handle_put_stream remains for
+    uploads proxied through the API and goes through boto3's managed
+    multipart transfer. One boto3 client (thread-safe, pooled HTTP
+    connections) is shared per process.
+    """
+
+    def __init__(self):
+        # Optional dependency: only needed when STORAGE_BACKEND=s3
+        import boto3
+        from botocore.config import Config
+        from boto3.s3.transfer import TransferConfig
+
+        if not S3_BUCKET:
+            raise RuntimeError("Missing env var: S3_BUCKET")
+        self.bucket = S3_BUCKET
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=S3_ENDPOINT_URL,
+            region_name=S3_REGION,
+            config=Config(
+                signature_version="s3v4",
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                retries={"max_attempts": 3, "mode": "standard"},
+                s3={"addressing_style": "path" if S3_ENDPOINT_URL else "auto"},
+            ),
+        )
+        self.transfer = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNK,
+            max_concurrency=4,
+        )
+
+    @staticmethod
+    def _check_key(key: str) -> str:
+        if not key or ".." in key or key.startswith("/"):
+            raise ValueError("invalid_key")
+        return key
+
+    def generate_put(self, user_id: str, filename: str, content_type: str, size: int | None = None) -> dict:
+        key = _make_upload_key(user_id, _sanitize_filename(filename), content_type)
+        # The bytes never pass through us, so the size cap has to be in the
+        # signature: Content-Length is a signed header and S3 rejects any other.
+        if size is None:
+            raise ValueError("size_required")
+        if size > MAX_UPLOAD_BYTES:
+            raise ValueError("too_large")
+        params = {"Bucket": self.bucket, "Key": key, "ContentType": content_type, "ContentLength": size}
+        url = self.client.generate_presigned_url(
+            "put_object", Params=params, ExpiresIn=S3_PRESIGN_TTL, HttpMethod="PUT"
+        )
+        return {"key": key, "uploadUrl": url}
+
+    def handle_put(self, key: str, data: bytes, content_type: str) -> bool:
+        self.handle_put_stream(key, io.BytesIO(data or b""), content_type)
+        return True
+
+    def handle_put_stream(self, key: str, stream: BinaryIO, content_type: str) -> dict:
+        key = self._check_key(key)
+        guard = UploadGuard(stream, content_type)
+        # upload_fileobj switches to multipart above S3_MULTIPART_THRESHOLD and
+        # aborts the multipart upload if the guard raises mid-stream.
+        self.client.upload_fileobj(
+            guard, self.bucket, key,
+            ExtraArgs={"ContentType": content_type},
+            Config=self.transfer,
+        )
+        try:
+            guard.verify()
+        except ValueError:
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+            raise
+        return {"size": guard.size, "sha256": guard.sha256}
+
+    def delete(self, key: str) -> bool:
+        self.client.delete_object(Bucket=self.bucket, Key=self._check_key(key))
+        return True
+
+    def public_url(self, key: str, width: int | None = None) -> str:
+        # Stable URL to persist in image_url; presigned URLs expire.
+        # No derivative pipeline for S3 yet: `width` is ignored.
+        if S3_PUBLIC_BASE_URL:
+            return f"{S3_PUBLIC_BASE_URL.rstrip('/')}/{key}"
         return f"/api/uploads/file/{key}"
 
+    def download_url(self, key: str) -> str | None:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._check_key(key)},
+            ExpiresIn=S3_PRESIGN_TTL,
+        )
+
 
 def get_storage() -> Storage:
-    # For now we only return LocalStorage; later add S3Storage and switch via env.
+    if STORAGE_BACKEND == "s3":
+        return S3Storage()
     return LocalStorage()
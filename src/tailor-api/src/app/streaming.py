@@ -0,0 +1,79 @@
+# app/streaming.py
+#
+# Incremental JSON encoding for large result sets. Rows come from a generator
+# (typically db_utils.exec_stream_dict) and are written out as they arrive, so
+# the first byte leaves before the query finishes and memory stays flat.
+from __future__ import annotations
+
+import datetime
+import decimal
+import json
+import uuid
+from typing import Any, Iterable, Iterator
+
+from flask import Response, request
+from werkzeug.http import http_date
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Coalesce small rows into larger writes; the WSGI server sends each chunk.
+_CHUNK_BYTES = 64 * 1024
+
+
+def _default(o: Any):
+    # Same conversions as Flask's default JSON provider, so streamed and
+    # jsonify'd responses serialize rows identically.
+    if isinstance(o, datetime.date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _encode(row: Any) -> str:
+    return json.dumps(row, default=_default, separators=(",", ":"))
+
+
+def _buffered(pieces: Iterable[str]) -> Iterator[bytes]:
+    buf, size = [], 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= _CHUNK_BYTES:
+            yield "".join(buf).encode("utf-8")
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+
+def _json_array(rows: Iterable[Any]) -> Iterator[str]:
+    yield "["
+    first = True
+    for row in rows:
+        yield _encode(row) if first else "," + _encode(row)
+        first = False
+    yield "]"
+
+
+def _ndjson(rows: Iterable[Any]) -> Iterator[str]:
+    for row in rows:
+        yield _encode(row) + "\n"
+
+
+def wants_ndjson() -> bool:
+    if request.args.get("format") == "ndjson":
+        return True
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def stream_rows(rows: Iterable[Any], ndjson: bool | None = None) -> Response:
+    """Chunked response over `rows`: a JSON array, or NDJSON when requested."""
+    if ndjson is None:
+        ndjson = wants_ndjson()
+    body = _ndjson(rows) if ndjson else _json_array(rows)
+    resp = Response(_buffered(body), mimetype=NDJSON_MIMETYPE if ndjson else "application/json")
+    # Let reverse proxies pass chunks through instead of buffering the body.
+    resp.headers["X-Accel-Buffering"] = "no"
+    resp.vary.add("Accept")
+    return resp
@@ -0,0 +1,255 @@
+# app/upload_gc.py
+#
+# Garbage collection for LocalStorage. Keys that no part (or avatar) refers to
+# -- presigned but never attached, replaced by update_part, left behind by
+# delete_part -- plus stray temp files and unreferenced CAS blobs are deleted
+# or moved to a quarantine directory once they are older than a grace period.
+#
+# Both sides are streamed in the same (byte) order and merge-joined: the
+# storage tree one directory listing at a time, the referenced keys through a
+# server-side cursor, so memory stays flat however large either side grows.
+#
+#   python -m app.upload_gc [--dry-run] [--quarantine] [--grace-hours 24]
+#
+# or set UPLOAD_GC_INTERVAL to run it periodically inside the app; a Postgres
+# advisory lock keeps concurrent workers/hosts from running it at once.
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from db.db_utils import pooled_connection
+from utils.tailor_utils import stream_upload_refs, referenced_upload_keys
+from app.storage import LocalStorage, get_storage, BLOB_PREFIX
+from app.derivatives import DERIVED_PREFIX
+from app.upload_sessions import SESSIONS_DIR
+
+log = logging.getLogger(__name__)
+
+UPLOAD_GC_GRACE_HOURS = float(os.getenv("UPLOAD_GC_GRACE_HOURS", "24"))
+UPLOAD_GC_BATCH = int(os.getenv("UPLOAD_GC_BATCH", "500"))
+UPLOAD_GC_MODE = os.getenv("UPLOAD_GC_MODE", "delete")  # "delete" | "quarantine"
+UPLOAD_GC_QUARANTINE_DAYS = float(os.getenv("UPLOAD_GC_QUARANTINE_DAYS", "7"))
+UPLOAD_GC_INTERVAL = float(os.getenv("UPLOAD_GC_INTERVAL", "0"))  # seconds; 0 = no in-app schedule
+
+QUARANTINE_DIR = ".quarantine"
+# Trees that are not plain keys: derivatives go with their original, sessions
+# expire on their own, and quarantine is purged by age.
+_SKIP_TOP = {DERIVED_PREFIX, SESSIONS_DIR, QUARANTINE_DIR}
+
+_LOCK_ID = 0x7461696C  # pg advisory lock key shared by every GC runner
+
+
+def _walk(root: Path, prefix: str = "") -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Files under `root` as (key, stat) in byte order of the full key. Sorting
+    directories as "name/" makes depth-first order match plain string order
+    ("a-b/x" < "a/x"), which is what the merge with ORDER BY ... COLLATE "C" needs.
+    """
+    try:
+        entries = list(os.scandir(root))
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    dirs = {e.name for e in entries if e.is_dir(follow_symlinks=False)}
+    for e in sorted(entries, key=lambda e: e.name + "/" if e.name in dirs else e.name):
+        if e.name in dirs:
+            if not prefix and e.name in _SKIP_TOP:
+                continue
+            yield from _walk(Path(e.path), f"{prefix}{e.name}/")
+        elif e.is_file(follow_symlinks=False):
+            try:
+                yield prefix + e.name, e.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                pass
+
+
+class UploadGC:
+    def __init__(self, storage: LocalStorage, grace_hours: float = UPLOAD_GC_GRACE_HOURS,
+                 batch_size: int = UPLOAD_GC_BATCH, mode: str = UPLOAD_GC_MODE,
+                 dry_run: bool = False, quarantine_days: float = UPLOAD_GC_QUARANTINE_DAYS):
+        if mode not in ("delete", "quarantine"):
+            raise ValueError("invalid_gc_mode")
+        self.storage = storage
+        self.grace = grace_hours * 3600
+        self.batch_size = max(1, batch_size)
+        self.mode = mode
+        self.dry_run = dry_run
+        self.quarantine_days = quarantine_days
+
+    def _reclaimable(self, key: str, st: os.stat_result) -> int:
+        """Bytes actually freed by removing `key` (shared CAS content frees nothing)."""
+        if key.startswith(BLOB_PREFIX + "/"):
+            return st.st_size
+        if self.storage.mode == "cas" and st.st_nlink > 2:
+            return 0
+        return st.st_size
+
+    def _remove(self, key: str, quarantine_root: Path) -> None:
+        if self.mode == "quarantine":
+            dest = quarantine_root / key
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self.storage.base / key, dest)
+            self.storage._forget(key)
+            self.storage._drop_derivatives(key)
+        elif key.startswith(BLOB_PREFIX + "/"):
+            os.unlink(self.storage.base / key)
+        else:
+            self.storage.delete(key)
+
+    def _flush(self, batch: List[Tuple[str, os.stat_result]], report: Dict, quarantine_root: Path) -> None:
+        # Re-check just before removing: a part may have been pointed at one of
+        # these keys while the scan was running.
+        now_referenced = referenced_upload_keys([k for k, _ in batch if not k.startswith(BLOB_PREFIX + "/")])
+        for key, st in batch:
+            if key in now_referenced:
+                report["referenced"] += 1
+                continue
+            if key.startswith(BLOB_PREFIX + "/"):
+                try:
+                    if (self.storage.base / key).stat().st_nlink != 1:
+                        continue  # a key linked to it since the scan
+                except FileNotFoundError:
+                    continue
+            freed = self._reclaimable(key, st)
+            if not self.dry_run:
+                try:
+                    self._remove(key, quarantine_root)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    log.warning("upload gc: could not remove %s: %s", key, e)
+                    report["errors"] += 1
+                    continue
+            report["removed"] += 1
+            report["bytes_reclaimed"] += freed
+        batch.clear()
+
+    def purge_quarantine(self) -> int:
+        """Delete quarantine days older than `quarantine_days`; returns bytes freed."""
+        root = self.storage.base / QUARANTINE_DIR
+        cutoff = time.time() - self.quarantine_days * 86400
+        freed = 0
+        for day in sorted(root.iterdir()) if root.is_dir() else []:
+            if day.stat().st_mtime >= cutoff:
+                continue
+            freed += sum(st.st_size for _, st in _walk(day))
+            if not self.dry_run:
+                shutil.rmtree(day, ignore_errors=True)
+        return freed
+
+    def run(self) -> Dict:
+        started = time.time()
+        cutoff = started - self.grace
+        quarantine_root = self.storage.base / QUARANTINE_DIR / time.strftime("%Y%m%d", time.gmtime(started))
+        report = {
+            "mode": "dry-run" if self.dry_run else self.mode,
+            "scanned": 0, "referenced": 0, "too_recent": 0,
+            "removed": 0, "bytes_reclaimed": 0, "errors": 0,
+        }
+
+        refs = stream_upload_refs()
+        ref = next(refs, None)
+        batch: List[Tuple[str, os.stat_result]] = []
+        try:
+            for key, st in _walk(self.storage.base):
+                report["scanned"] += 1
+                if key.startswith(BLOB_PREFIX + "/"):
+                    # CAS blob: referenced through hard links, not by the DB.
+                    if st.st_nlink > 1:
+                        report["referenced"] += 1
+                        continue
+                else:
+                    while ref is not None and ref < key:
+                        ref = next(refs, None)
+                    if ref == key:
+                        report["referenced"] += 1
+                        continue
+                if st.st_mtime > cutoff:
+                    report["too_recent"] += 1
+                    continue
+                batch.append((key, st))
+                if len(batch) >= self.batch_size:
+                    self._flush(batch, report, quarantine_root)
+            if batch:
+                self._flush(batch, report, quarantine_root)
+        finally:
+            refs.close()
+
+        if self.mode == "quarantine":
+            report["quarantine_purged_bytes"] = self.purge_quarantine()
+        report["seconds"] = round(time.time() - started, 3)
+        return report
+
+
+def run_locked(**options) -> Optional[Dict]:
+    """Run one GC pass unless another process holds the lock; None if skipped."""
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage):
+        raise RuntimeError("upload GC only applies to STORAGE_BACKEND=local (use bucket lifecycle rules for s3)")
+    with pooled_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (_LOCK_ID,))
+            if not cur.fetchone()[0]:
+                return None
+        try:
+            return UploadGC(storage, **options).run()
+        finally:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_ID,))
+
+
+_scheduler: Optional[threading.Thread] = None
+
+
+def start_scheduler(interval: float = UPLOAD_GC_INTERVAL) -> Optional[threading.Thread]:
+    """Run the GC every `interval` seconds (jittered) on a daemon thread."""
+    global _scheduler
+    if interval <= 0 or _scheduler is not None:
+        return _scheduler
+
+    def _loop():
+        while True:
+            time.sleep(interval * random.uniform(0.9, 1.1))
+            try:
+                report = run_locked()
+                if report is not None:
+                    log.info("upload gc: %s", report)
+            except Exception:
+                log.exception("upload gc failed")
+
+    _scheduler = threading.Thread(target=_loop, name="upload-gc", daemon=True)
+    _scheduler.start()
+    return _scheduler
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Delete or quarantine unreferenced uploads.")
+    p.add_argument("--dry-run", action="store_true", help="report only; remove nothing")
+    p.add_argument("--quarantine", action="store_true", help="move orphans to .quarantine/ instead of deleting")
+    p.add_argument("--grace-hours", type=float, default=UPLOAD_GC_GRACE_HOURS)
+    p.add_argument("--batch", type=int, default=UPLOAD_GC_BATCH)
+    args = p.parse_args(argv)
+
+    report = run_locked(
+        grace_hours=args.grace_hours,
+        batch_size=args.batch,
+        mode="quarantine" if args.quarantine else UPLOAD_GC_MODE,
+        dry_run=args.dry_run,
+    )
+    if report is None:
+        print("another upload GC run holds the lock; skipped")
+        return 1
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
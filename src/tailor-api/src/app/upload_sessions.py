@@ -0,0 +1,249 @@
+# app/upload_sessions.py
+#
+# Resumable, chunked uploads for LocalStorage. A session reserves a key and a
+# fixed chunk layout; chunks are PUT independently (in any order, in parallel,
+# retried freely) into their own files under <base>/.sessions/<id>/, and
+# completion streams them back-to-back through the normal handle_put_stream
+# path, so size limits, magic-byte checks, CAS dedup and derivatives apply
+# exactly as for a single PUT.
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional
+
+from app.storage import (
+    LocalStorage,
+    ALLOWED_MIME,
+    MAX_UPLOAD_BYTES,
+    UPLOAD_CHUNK_BYTES,
+    sniff_matches,
+    _SNIFF_BYTES,
+    _sanitize_filename,
+)
+
+UPLOAD_SESSION_CHUNK_BYTES = int(os.getenv("UPLOAD_SESSION_CHUNK_BYTES", str(1024 * 1024)))  # 1 MB
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))  # seconds
+SESSIONS_DIR = ".sessions"
+
+_SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class _ChunkReader:
+    """Read-only file-like view of the chunk files concatenated in order."""
+
+    def __init__(self, paths: List[Path]):
+        self._paths = iter(paths)
+        self._current: Optional[BinaryIO] = None
+
+    def read(self, n: int = -1) -> bytes:
+        n = UPLOAD_CHUNK_BYTES if n is None or n < 0 else n
+        while True:
+            if self._current is None:
+                nxt = next(self._paths, None)
+                if nxt is None:
+                    return b""
+                self._current = open(nxt, "rb")
+            data = self._current.read(n)
+            if data:
+                return data
+            self._current.close()
+            self._current = None
+
+    def close(self) -> None:
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+
+class UploadSessions:
+    """
+    Session state is plain files, so any worker can serve any chunk:
+      session.json   key, owner, content type, size, chunk layout, checksum
+      <n>.part       chunk n, renamed into place only once complete
+      .complete      O_EXCL lock taken while assembling
+    """
+
+    def __init__(self, storage: LocalStorage, chunk_bytes: int = UPLOAD_SESSION_CHUNK_BYTES,
+                 ttl: int = UPLOAD_SESSION_TTL):
+        self.storage = storage
+        self.root = storage.base / SESSIONS_DIR
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.chunk_bytes = chunk_bytes
+        self.ttl = ttl
+
+    # --- internals ---
+    def _dir(self, upload_id: str) -> Path:
+        if not _SESSION_ID_RE.match(upload_id or ""):
+            raise ValueError("upload_session_not_found")
+        return self.root / upload_id
+
+    def _load(self, upload_id: str, owner: str) -> dict:
+        try:
+            with open(self._dir(upload_id) / "session.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+            raise ValueError("upload_session_not_found")
+        # Other users' sessions are indistinguishable from missing ones.
+        if meta["owner"] != owner or meta["created"] + self.ttl < time.time():
+            raise ValueError("upload_session_not_found")
+        return meta
+
+    def _chunk_length(self, meta: dict, index: int) -> int:
+        if index == meta["chunks"] - 1:
+            return meta["size"] - index * meta["chunk_size"]
+        return meta["chunk_size"]
+
+    def _received(self, upload_id: str, meta: dict) -> List[int]:
+        d = self._dir(upload_id)
+        return [i for i in range(meta["chunks"]) if (d / f"{i}.part").is_file()]
+
+    def purge_expired(self) -> int:
+        """Remove abandoned sessions older than the TTL; returns how many."""
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for d in self.root.iterdir():
+            try:
+                if d.stat().st_mtime < cutoff:
+                    shutil.rmtree(d, ignore_errors=True)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    # --- protocol ---
+    def create(self, owner: str, filename: str, content_type: str, size: int,
+               sha256: Optional[str] = None) -> dict:
+        if content_type not in ALLOWED_MIME:
+            raise ValueError("unsupported_file_type")
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            raise ValueError("invalid_size")
+        if size > MAX_UPLOAD_BYTES:
+            raise ValueError("too_large")
+        if sha256 is not None and not _SHA256_RE.match(sha256):
+            raise ValueError("invalid_checksum")
+        self.purge_expired()
+
+        upload_id = uuid.uuid4().hex
+        meta = {
+            "id": upload_id,
+            "key": self.storage._make_key(owner, _sanitize_filename(filename), content_type),
+            "owner": owner,
+            "content_type": content_type,
+            "size": size,
+            "chunk_size": self.chunk_bytes,
+            "chunks": -(-size // self.chunk_bytes),
+            "sha256": sha256,
+            "created": time.time(),
+        }
+        d = self._dir(upload_id)
+        d.mkdir(parents=True)
+        fd, tmp = tempfile.mkstemp(prefix=".session-", dir=d)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, d / "session.json")
+        return meta
+
+    def status(self, upload_id: str, owner: str) -> dict:
+        meta = self._load(upload_id, owner)
+        received = self._received(upload_id, meta)
+        # Bytes available from the start without gaps: where a sequential client resumes.
+        contiguous = 0
+        while contiguous < meta["chunks"] and contiguous in received:
+            contiguous += 1
+        return {
+            **meta,
+            "received": received,
+            "missing": [i for i in range(meta["chunks"]) if i not in set(received)],
+            "offset": min(meta["size"], contiguous * meta["chunk_size"]),
+        }
+
+    def put_chunk(self, upload_id: str, owner: str, index: int, stream: BinaryIO,
+                  sha256: Optional[str] = None) -> dict:
+        """
+        Store chunk `index` from `stream`. The chunk must be exactly its slot's
+        length; it becomes visible (atomically) only after it checks out, so a
+        dropped connection leaves nothing behind and the client simply retries.
+        """
+        meta = self._load(upload_id, owner)
+        if not 0 <= index < meta["chunks"]:
+            raise ValueError("invalid_chunk_index")
+        expected = self._chunk_length(meta, index)
+
+        d = self._dir(upload_id)
+        digest = hashlib.sha256()
+        written = 0
+        head: Optional[bytes] = b"" if index == 0 else None
+        fd, tmp = tempfile.mkstemp(prefix=f".{index}-", dir=d)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    data = stream.read(min(UPLOAD_CHUNK_BYTES, expected - written + 1))
+                    if not data:
+                        break
+                    written += len(data)
+                    if written > expected:
+                        raise ValueError("chunk_size_mismatch")
+                    if head is not None:
+                        # Fail fast on the first chunk, once the signature
+                        # (or the whole chunk, if shorter) has arrived.
+                        head += data[:_SNIFF_BYTES - len(head)]
+                        if len(head) == _SNIFF_BYTES or written == expected:
+                            if not sniff_matches(meta["content_type"], head):
+                                raise ValueError("content_type_mismatch")
+                            head = None
+                    digest.update(data)
+                    f.write(data)
+            if written != expected:
+                raise ValueError("chunk_size_mismatch")
+            if sha256 is not None and digest.hexdigest() != sha256.lower():
+                raise ValueError("chunk_checksum_mismatch")
+            os.replace(tmp, d / f"{index}.part")
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return {"index": index, "size": written, "sha256": digest.hexdigest()}
+
+    def complete(self, upload_id: str, owner: str, sha256: Optional[str] = None) -> dict:
+        """
+        Assemble the chunks into the session's key and drop the session.
+        `sha256` (or the one given at create) is checked against the whole file
+        before it becomes visible.
+        """
+        meta = self._load(upload_id, owner)
+        expected = (sha256 or meta["sha256"] or "").lower() or None
+        if expected is not None and not _SHA256_RE.match(expected):
+            raise ValueError("invalid_checksum")
+        d = self._dir(upload_id)
+        if len(self._received(upload_id, meta)) != meta["chunks"]:
+            raise ValueError("incomplete_upload")
+
+        try:
+            lock = os.open(d / ".complete", os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise ValueError("upload_session_busy")
+        os.close(lock)
+        reader = _ChunkReader([d / f"{i}.part" for i in range(meta["chunks"])])
+        try:
+            info = self.storage.handle_put_stream(
+                meta["key"], reader, meta["content_type"], expected_sha256=expected
+            )
+        except BaseException:
+            os.unlink(d / ".complete")
+            raise
+        finally:
+            reader.close()
+        shutil.rmtree(d, ignore_errors=True)
+        return {"key": meta["key"], **info}
+
+    def abort(self, upload_id: str, owner: str) -> None:
+        self._load(upload_id, owner)
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
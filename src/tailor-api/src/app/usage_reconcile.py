@@ -0,0 +1,82 @@
+# app/usage_reconcile.py
+#
+# Drift repair for the part_usage counters (db/sql/tables.sql). The triggers
+# keep them exact, so this is a safety net for manual SQL, restores and
+# trigger changes: recount from builds and fix whatever differs.
+#
+#   python -m app.usage_reconcile
+#
+# or set PART_USAGE_RECONCILE_INTERVAL to run it periodically inside the app;
+# a Postgres advisory lock keeps concurrent workers/hosts from running it at once.
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+from db.db_utils import pooled_connection
+from utils.tailor_utils import reconcile_part_usage
+
+log = logging.getLogger(__name__)
+
+PART_USAGE_RECONCILE_INTERVAL = float(os.getenv("PART_USAGE_RECONCILE_INTERVAL", "0"))  # seconds; 0 = off
+
+_LOCK_ID = 0x75736167  # pg advisory lock key shared by every reconcile runner
+
+
+def run_locked() -> Optional[Dict]:
+    """Reconcile once unless another process holds the lock; None if skipped."""
+    with pooled_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (_LOCK_ID,))
+            if not cur.fetchone()[0]:
+                return None
+        try:
+            started = time.time()
+            report = reconcile_part_usage()
+            report["seconds"] = round(time.time() - started, 3)
+            return report
+        finally:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_ID,))
+
+
+_scheduler: Optional[threading.Thread] = None
+
+
+def start_scheduler(interval: float = PART_USAGE_RECONCILE_INTERVAL) -> Optional[threading.Thread]:
+    """Reconcile every `interval` seconds (jittered) on a daemon thread."""
+    global _scheduler
+    if interval <= 0 or _scheduler is not None:
+        return _scheduler
+
+    def _loop():
+        while True:
+            time.sleep(interval * random.uniform(0.9, 1.1))
+            try:
+                report = run_locked()
+                if report is not None and (report["repaired"] or report["removed"]):
+                    log.warning("part usage drift repaired: %s", report)
+            except Exception:
+                log.exception("part usage reconcile failed")
+
+    _scheduler = threading.Thread(target=_loop, name="part-usage-reconcile", daemon=True)
+    _scheduler.start()
+    return _scheduler
+
+
+def main(argv=None):
+    report = run_locked()
+    if report is None:
+        print("another reconcile run holds the lock; skipped")
+        return 1
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
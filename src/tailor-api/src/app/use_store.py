@@ -1,9 +1,21 @@
 import json, os
+import logging
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Dict, Optional, Any
+from typing import Dict, Optional, Any, Tuple
 from db.db_utils import exec_get_one_dict, exec_commit
 
+try:
+    import fcntl  # POSIX; elsewhere only threads within one process are serialized
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
 @dataclass
 class User:
     google_id: str
@@ -36,69 +48,223 @@ class UserStore:
     def create_or_update_from_google(self, google_profile: Dict[str, Any]) -> User: ...
     def update_profile(self, google_sub: str, display_name: str, bio: str) -> User: ...
 
-# -------- JSON store (legacy; kept for dev fallback) --------
+# -------- JSON store (dev fallback) --------
+# Append-only log: one JSON line {"k": google_id, "v": row} per write, with an
+# in-memory index google_id -> (offset, length) pointing at the latest line.
+# Lookups are one seek+read, writes one append; dead lines are dropped by
+# compaction once they dominate the file. Processes sharing the file
+# coordinate through flock on a side lock file and pick up each other's
+# appends (or a compacted replacement) by re-scanning only what changed.
+USER_STORE_FSYNC = os.getenv("USER_STORE_FSYNC", "interval")  # "always" | "interval" | "never"
+USER_STORE_FSYNC_INTERVAL = float(os.getenv("USER_STORE_FSYNC_INTERVAL", "1.0"))  # seconds
+USER_STORE_COMPACT_MIN_BYTES = int(os.getenv("USER_STORE_COMPACT_MIN_BYTES", str(1024 * 1024)))
+USER_STORE_COMPACT_RATIO = float(os.getenv("USER_STORE_COMPACT_RATIO", "0.5"))  # max dead/total
+
 class JSONUserStore(UserStore):
-    def __init__(self, path: str):
-        self.path = path
+    def __init__(self, path: str, fsync: str = USER_STORE_FSYNC,
+                 compact_min_bytes: int = USER_STORE_COMPACT_MIN_BYTES,
+                 compact_ratio: float = USER_STORE_COMPACT_RATIO):
+        if fsync not in ("always", "interval", "never"):
+            raise ValueError(f"Invalid fsync policy: {fsync}")
+        # users.json keeps its name for the (read-once) legacy document; the log sits next to it.
+        self.legacy_path = path
+        self.path = os.path.splitext(path)[0] + ".jsonl"
+        self.fsync = fsync
+        self.compact_min_bytes = compact_min_bytes
+        self.compact_ratio = compact_ratio
+        self._mutex = threading.RLock()
+        self._lock_fd = None
+        self._fh = None
+        self._ino = None
+        self._scanned = 0          # bytes of the log covered by the index
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._live = 0             # bytes of lines the index points at
+        self._last_fsync = 0.0
         self._ensure_file()
 
+    # --- files & locking ---
     def _ensure_file(self):
-        os.makedirs(os.path.dirname(self.path), exist_ok=True)
-        if not os.path.exists(self.path):
-            with open(self.path, "w", encoding="utf-8") as f:
-                json.dump({"users": {}, "meta": {"version": 1}}, f, indent=2)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked(exclusive=True):
+            if not os.path.exists(self.path):
+                self._import_legacy()
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with self._mutex:
+            if fcntl is not None:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                self._refresh()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _open(self):
+        if self._fh is not None:
+            self._fh.close()
+        self._fh = open(self.path, "a+b")
+        self._ino = os.fstat(self._fh.fileno()).st_ino
+        self._index, self._scanned, self._live = {}, 0, 0
+
+    def _refresh(self):
+        """Catch up with appends (or a compaction) made by other processes."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return  # only before the first write; _import_legacy creates it
+        if self._fh is None or st.st_ino != self._ino:
+            self._open()
+        if st.st_size > self._scanned:
+            self._scan()
+
+    def _scan(self):
+        self._fh.seek(self._scanned)
+        offset = self._scanned
+        for line in self._fh:
+            if not line.endswith(b"\n"):
+                break  # torn tail of an interrupted append; truncated by the next writer
+            try:
+                rec = json.loads(line)
+                self._point(rec["k"], offset, len(line))
+            except (ValueError, KeyError, TypeError):
+                log.warning("skipping corrupt record at %s:%d", self.path, offset)
+            offset += len(line)
+        self._scanned = offset
+
+    def _point(self, key: str, offset: int, length: int):
+        old = self._index.get(key)
+        if old is not None:
+            self._live -= old[1]
+        self._index[key] = (offset, length)
+        self._live += length
+
+    def _sync(self, force: bool = False):
+        now = time.monotonic()
+        if force or self.fsync == "always" or (
+            self.fsync == "interval" and now - self._last_fsync >= USER_STORE_FSYNC_INTERVAL
+        ):
+            os.fsync(self._fh.fileno())
+            self._last_fsync = now
 
-    def _load(self) -> Dict[str, Any]:
-        with open(self.path, "r", encoding="utf-8") as f:
-            return json.load(f)
+    # --- records ---
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        loc = self._index.get(key)
+        if loc is None:
+            return None
+        self._fh.seek(loc[0])
+        return json.loads(self._fh.read(loc[1]))["v"]
 
-    def _save(self, data: Dict[str, Any]):
-        with open(self.path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+    def _append(self, key: str, row: Dict[str, Any]):
+        """Caller holds the exclusive lock (and has refreshed)."""
+        line = (json.dumps({"k": key, "v": row}, separators=(",", ":")) + "\n").encode("utf-8")
+        self._fh.seek(0, os.SEEK_END)
+        end = self._fh.tell()
+        if end != self._scanned:
+            self._fh.truncate(self._scanned)  # drop a torn tail so this line stays parseable
+        self._fh.write(line)
+        self._fh.flush()
+        self._sync()
+        self._point(key, self._scanned, len(line))
+        self._scanned += len(line)
+        self._maybe_compact()
 
+    def _maybe_compact(self):
+        dead = self._scanned - self._live
+        if self._scanned >= self.compact_min_bytes and dead > self._scanned * self.compact_ratio:
+            self._compact()
+
+    def _write_log(self, rows: Dict[str, Dict[str, Any]]):
+        """Atomically replace the log with one line per row (exclusive lock held)."""
+        fd, tmp = tempfile.mkstemp(prefix=".users-", dir=os.path.dirname(self.path) or ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for key, row in rows.items():
+                    f.write((json.dumps({"k": key, "v": row}, separators=(",", ":")) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        if hasattr(os, "O_DIRECTORY"):
+            dfd = os.open(os.path.dirname(self.path) or ".", os.O_DIRECTORY)
+            try:
+                os.fsync(dfd)
+            finally:
+                os.close(dfd)
+        self._open()
+        self._scan()
+
+    def _import_legacy(self):
+        rows = {}
+        if os.path.exists(self.legacy_path):
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                rows = json.load(f).get("users", {})
+        self._write_log(rows)
+
+    def _compact(self):
+        self._write_log({key: self._read(key) for key in self._index})
+
+    def compact(self):
+        """Rewrite the log with only the latest record per user."""
+        with self._locked(exclusive=True):
+            self._compact()
+
+    # --- UserStore ---
     def get_by_google_id(self, google_sub: str) -> Optional[User]:
-        row = self._load().get("users", {}).get(google_sub)
+        with self._locked(exclusive=False):
+            row = self._read(google_sub)
         return User.from_dict(row) if row else None
 
     def create_or_update_from_google(self, profile: Dict[str, Any]) -> User:
         sub = profile["sub"]
-        data = self._load()
-        users = data.setdefault("users", {})
         now = datetime.now(timezone.utc).isoformat()
-        row = users.get(sub)
-        if row:
-            row["email"] = profile.get("email", row.get("email", ""))
-            row["avatar_url"] = profile.get("picture", row.get("avatar_url", ""))
-            if not row.get("display_name"):
-                row["display_name"] = profile.get("name", "")
-            row["updated_at"] = now
-        else:
-            row = {
-                "google_id": sub,
-                "email": profile.get("email", ""),
-                "display_name": profile.get("name", ""),
-                "avatar_url": profile.get("picture", ""),
-                "bio": "",
-                "created_at": now,
-                "updated_at": now,
-            }
-            users[sub] = row
-        self._save(data)
+        with self._locked(exclusive=True):
+            row = self._read(sub)
+            if row:
+                row["email"] = profile.get("email", row.get("email", ""))
+                row["avatar_url"] = profile.get("picture", row.get("avatar_url", ""))
+                if not row.get("display_name"):
+                    row["display_name"] = profile.get("name", "")
+                row["updated_at"] = now
+            else:
+                row = {
+                    "google_id": sub,
+                    "email": profile.get("email", ""),
+                    "display_name": profile.get("name", ""),
+                    "avatar_url": profile.get("picture", ""),
+                    "bio": "",
+                    "created_at": now,
+                    "updated_at": now,
+                }
+            self._append(sub, row)
         return User.from_dict(row)
 
     def update_profile(self, google_sub: str, display_name: str, bio: str) -> User:
-        data = self._load()
-        users = data.setdefault("users", {})
-        row = users.get(google_sub)
-        if not row:
-            raise KeyError("User not found")
-        row["display_name"] = display_name
-        row["bio"] = bio
-        row["updated_at"] = datetime.now(timezone.utc).isoformat()
-        users[google_sub] = row
-        self._save(data)
+        with self._locked(exclusive=True):
+            row = self._read(google_sub)
+            if not row:
+                raise KeyError("User not found")
+            row["display_name"] = display_name
+            row["bio"] = bio
+            row["updated_at"] = datetime.now(timezone.utc).isoformat()
+            self._append(google_sub, row)
         return User.from_dict(row)
 
+    def close(self):
+        with self._mutex:
+            if self._fh is not None:
+                self._sync(force=self.fsync != "never")
+                self._fh.close()
+                self._fh = None
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
 # -------- Postgres store (use this) --------
 class PostgresUserStore(UserStore):
     def get_by_google_id(self, google_sub: str) -> Optional[User]:
@@ -1,27 +1,57 @@
 # db/db_utils.py
+import atexit
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Any, Callable, Optional
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import yaml
 
+from db.pool import ConnectionPool, PoolTimeout  # noqa: F401 (re-exported)
+
+log = logging.getLogger(__name__)
+
 # --- config loading ---
 def _config_path() -> Path:
     # .../src/db/db_utils.py -> .../src/config/db.yml
     return Path(__file__).resolve().parent.parent.parent.parent.parent / "config" / "db.yml"
 
+_CONFIG: dict | None = None
+_CONFIG_LOCK = threading.Lock()
+
 def _load_config() -> dict:
-    with _config_path().open("r", encoding="utf-8") as f:
-        cfg = yaml.safe_load(f) or {}
-    # Normalize types
-    if "port" in cfg:
-        try:
-            cfg["port"] = int(cfg["port"])
-        except Exception:
-            pass
-    return cfg
+    """Parse config/db.yml once per process; later calls reuse the cached dict."""
+    global _CONFIG
+    if _CONFIG is not None:
+        return _CONFIG
+    with _CONFIG_LOCK:
+        if _CONFIG is None:
+            with _config_path().open("r", encoding="utf-8") as f:
+                cfg = yaml.safe_load(f) or {}
+            # Normalize types
+            if "port" in cfg:
+                try:
+                    cfg["port"] = int(cfg["port"])
+                except Exception:
+                    pass
+            _CONFIG = cfg
+    return _CONFIG
+
+def _pool_setting(cfg: dict, key: str, env: str, default, cast):
+    # env wins over db.yml `pool:` section, which wins over the default
+    raw = os.getenv(env, (cfg.get("pool") or {}).get(key, default))
+    try:
+        return cast(raw)
+    except (TypeError, ValueError):
+        return default
 
 # --- connection helper ---
 def connect(dict_cursor: bool = False):
+    """Open a dedicated (non-pooled) connection, e.g. for schema scripts."""
     cfg = _load_config()
     return psycopg2.connect(
         dbname=cfg["database"],
@@ -32,6 +62,115 @@ def connect(dict_cursor: bool = False):
         cursor_factory=(RealDictCursor if dict_cursor else None),
     )
 
+# Rows per round-trip for server-side (named) cursors
+STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", "1000"))
+
+# --- pool ---
+_POOL: ConnectionPool | None = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _POOL
+    if _POOL is not None:
+        return _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            cfg = _load_config()
+            _POOL = ConnectionPool(
+                factory=connect,
+                minconn=_pool_setting(cfg, "min", "DB_POOL_MIN", 1, int),
+                maxconn=_pool_setting(cfg, "max", "DB_POOL_MAX", 10, int),
+                timeout=_pool_setting(cfg, "timeout", "DB_POOL_TIMEOUT", 10.0, float),
+                max_lifetime=_pool_setting(cfg, "max_lifetime", "DB_POOL_MAX_LIFETIME", 1800.0, float),
+                health_check_after=_pool_setting(cfg, "health_check_after", "DB_POOL_HEALTH_CHECK_AFTER", 30.0, float),
+            )
+            atexit.register(_POOL.close)
+    return _POOL
+
+def pool_stats() -> dict:
+    return get_pool().stats() if _POOL is not None else {}
+
+@contextmanager
+def pooled_connection():
+    """Check a connection out of the pool; broken connections are discarded on release."""
+    pool = get_pool()
+    conn = pool.acquire()
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        pool.release(conn, discard=discard)
+
+# --- scoped connections ---
+# Optional hook returning a connection the caller has already checked out
+# (e.g. one bound to the current Flask request) or None to use the pool.
+_scope_getter: Optional[Callable[[], Any]] = None
+# Optional hook that queues a callback until the scoped transaction commits;
+# returns False when there is no open scoped transaction.
+_scope_defer: Optional[Callable[[Callable[[], None]], bool]] = None
+
+def set_connection_scope(getter: Optional[Callable[[], Any]],
+                         defer: Optional[Callable[[Callable[[], None]], bool]] = None) -> None:
+    global _scope_getter, _scope_defer
+    _scope_getter = getter
+    _scope_defer = defer
+
+def after_commit(fn: Callable[[], None]) -> None:
+    """Run `fn` once the current scoped transaction commits (now, if there is none)."""
+    if _scope_defer is not None and _scope_defer(fn):
+        return
+    fn()
+
+@contextmanager
+def _connection():
+    conn = _scope_getter() if _scope_getter is not None else None
+    if conn is not None:
+        yield conn
+        return
+    with pooled_connection() as conn:
+        yield conn
+
+@contextmanager
+def _cursor(dict_cursor: bool = False):
+    with _connection() as conn:
+        with conn.cursor(cursor_factory=(RealDictCursor if dict_cursor else None)) as cur:
+            yield cur
+
+# --- table version stamps ---
+def defer_version_bumps(conn) -> None:
+    """
+    Make this transaction collect its table_versions bumps instead of taking
+    the stamp rows' locks (see db/sql/tables.sql); call at transaction start
+    and finish with commit_transaction().
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT set_config('tailor.defer_versions', 'on', true)")
+
+def commit_transaction(conn) -> None:
+    """COMMIT, then apply the deferred version bumps as their own autocommit statement."""
+    pending = None
+    if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+        with conn.cursor() as cur:
+            cur.execute("SELECT current_setting('tailor.pending_versions', true)")
+            pending = cur.fetchone()[0]
+    conn.commit()
+    if not pending or pending == "{}":
+        return
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT bump_versions(%s::text[])", (pending,))
+        if not conn.autocommit:
+            conn.commit()
+    except psycopg2.Error:
+        # The data is committed; stale stamps only delay cache invalidation
+        # until the next write to these tables.
+        log.exception("table version bump failed for %s", pending)
+        if not conn.closed and not conn.autocommit:
+            conn.rollback()
+
 # --- helpers ---
 def exec_sql_file(path_relative_to_db_dir: str):
     # Example: "sql/tables.sql" or "sql/seeds.sql"
@@ -47,47 +186,53 @@ def exec_sql_file(path_relative_to_db_dir: str):
         conn.close()
 
 def exec_get_one(sql: str, args=()):
-    conn = connect()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(sql, args)
-            return cur.fetchone()
-    finally:
-        conn.close()
+    with _cursor() as cur:
+        cur.execute(sql, args)
+        return cur.fetchone()
 
 def exec_get_all(sql: str, args=()):
-    conn = connect()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(sql, args)
-            return cur.fetchall()
-    finally:
-        conn.close()
+    with _cursor() as cur:
+        cur.execute(sql, args)
+        return cur.fetchall()
 
 def exec_get_one_dict(sql: str, args=()):
-    conn = connect(dict_cursor=True)
-    try:
-        with conn.cursor() as cur:
-            cur.execute(sql, args)
-            return cur.fetchone()
-    finally:
-        conn.close()
+    with _cursor(dict_cursor=True) as cur:
+        cur.execute(sql, args)
+        return cur.fetchone()
 
 def exec_get_all_dict(sql: str, args=()):
-    conn = connect(dict_cursor=True)
-    try:
-        with conn.cursor() as cur:
-            cur.execute(sql, args)
-            return cur.fetchall()
-    finally:
-        conn.close()
+    with _cursor(dict_cursor=True) as cur:
+        cur.execute(sql, args)
+        return cur.fetchall()
 
 def exec_commit(sql: str, args=()):
-    conn = connect()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(sql, args)
-        conn.commit()
+    # Pooled connections run in autocommit, so the statement is durable on return;
+    # inside a request scope it becomes part of the request's transaction.
+    with _cursor() as cur:
+        cur.execute(sql, args)
         return cur.rowcount
-    finally:
-        conn.close()
+
+def exec_stream_dict(sql: str, args=(), batch_size: int = STREAM_BATCH_SIZE):
+    """
+    Generator over dict rows fetched `batch_size` at a time through a named
+    (server-side) cursor, so memory stays flat for any result size.
+
+    Uses its own pooled connection inside a read-only transaction (named
+    cursors need one); it is released when the generator is exhausted or
+    closed, which may be after the request that created it has finished.
+    """
+    with pooled_connection() as conn:
+        conn.autocommit = False
+        conn.set_session(readonly=True)
+        try:
+            with conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor) as cur:
+                cur.itersize = batch_size
+                cur.execute(sql, args)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+        finally:
+            conn.rollback()
+            conn.set_session(readonly="DEFAULT")
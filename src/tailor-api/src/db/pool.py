@@ -0,0 +1,249 @@
+# db/pool.py
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+import psycopg2
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class _Slot:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Thread-safe, bounded pool of psycopg2 connections.
+
+    - keeps at least `minconn` connections open once warmed up, never more than `maxconn`
+    - checkout validates the connection (closed / idle-too-long -> SELECT 1)
+    - connections older than `max_lifetime` seconds are recycled on checkout/return
+    - `acquire()` blocks up to `timeout` seconds, then raises PoolTimeout
+    Connections are handed out in autocommit mode; callers that want a
+    transaction flip `conn.autocommit = False` and the pool resets it on release.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        minconn: int = 1,
+        maxconn: int = 10,
+        timeout: float = 10.0,
+        max_lifetime: float = 1800.0,
+        health_check_after: float = 30.0,
+    ):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("invalid pool bounds")
+        self._factory = factory
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+
+        self._cond = threading.Condition()
+        self._idle: Deque[_Slot] = deque()
+        self._in_use: Dict[int, _Slot] = {}
+        self._opening = 0
+        self._closed = False
+        self._pid = os.getpid()
+        self._stats = {
+            "created": 0,
+            "recycled": 0,
+            "health_check_failures": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+        }
+
+    # --- internals ---
+    def _size(self) -> int:
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _open(self) -> _Slot:
+        conn = self._factory()
+        conn.autocommit = True
+        self._stats["created"] += 1
+        return _Slot(conn)
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, slot: _Slot, now: float) -> bool:
+        return bool(self.max_lifetime) and now - slot.created_at >= self.max_lifetime
+
+    def _healthy(self, slot: _Slot, now: float) -> bool:
+        conn = slot.conn
+        if conn.closed:
+            return False
+        if now - slot.last_used < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reset_after_fork(self) -> None:
+        # Connections must never be shared across processes (e.g. gunicorn --preload).
+        if self._pid != os.getpid():
+            self._idle.clear()
+            self._in_use.clear()
+            self._opening = 0
+            self._pid = os.getpid()
+
+    def _warm_up(self) -> None:
+        # Reserve the missing slots under the lock, connect outside it.
+        with self._cond:
+            missing = self.minconn - self._size()
+            if missing <= 0:
+                return
+            self._opening += missing
+        for i in range(missing):
+            try:
+                slot = self._open()
+            except Exception:
+                # Give back this slot and every one we never got to.
+                with self._cond:
+                    self._opening -= missing - i
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                self._opening -= 1
+                self._idle.append(slot)
+                self._cond.notify()
+
+    # --- public API ---
+    def acquire(self, timeout: Optional[float] = None):
+        """
+        Check out a connection. The lock only guards the bookkeeping: health
+        checks and new connections run outside it, so one slow or half-dead
+        server can't stall every other acquire/release in the process.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("pool is closed")
+            self._reset_after_fork()
+        self._warm_up()
+
+        waited = False
+        while True:
+            slot = None
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("pool is closed")
+                while True:
+                    now = time.monotonic()
+                    if self._idle:
+                        slot = self._idle.pop()  # LIFO keeps a small hot set warm
+                        if self._expired(slot, now):
+                            self._stats["recycled"] += 1
+                            self._close_quietly(slot.conn)
+                            slot = None
+                            continue
+                        # Reserved while it's validated, so _size() stays exact.
+                        self._in_use[id(slot.conn)] = slot
+                        break
+                    if self._size() < self.maxconn:
+                        self._opening += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"no database connection available within {timeout:.1f}s")
+                    if not waited:
+                        self._stats["waits"] += 1
+                        waited = True
+                    self._cond.wait(remaining)
+
+            if slot is None:
+                # Open outside the lock so slow handshakes don't block other releases.
+                try:
+                    slot = self._open()
+                except Exception:
+                    with self._cond:
+                        self._opening -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._opening -= 1
+                    return self._checkout(slot)
+
+            if self._healthy(slot, time.monotonic()):
+                with self._cond:
+                    self._stats["checkouts"] += 1
+                return slot.conn
+            self._close_quietly(slot.conn)
+            with self._cond:
+                self._in_use.pop(id(slot.conn), None)
+                self._stats["health_check_failures"] += 1
+                self._cond.notify()
+
+    def _checkout(self, slot: _Slot):
+        self._in_use[id(slot.conn)] = slot
+        self._stats["checkouts"] += 1
+        return slot.conn
+
+    def release(self, conn, discard: bool = False) -> None:
+        # Reset the session before taking the lock (it may round-trip to the server).
+        if not discard and not conn.closed:
+            try:
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+                if not conn.autocommit:
+                    conn.autocommit = True
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            slot = self._in_use.pop(id(conn), None)
+            if slot is None:
+                # Not ours (or checked out before a fork); just drop it.
+                self._close_quietly(conn)
+                return
+            now = time.monotonic()
+            if discard or conn.closed or self._closed or self._expired(slot, now):
+                if not discard and self._expired(slot, now):
+                    self._stats["recycled"] += 1
+                self._close_quietly(conn)
+            else:
+                slot.last_used = now
+                self._idle.append(slot)
+            self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._close_quietly(self._idle.pop().conn)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "size": self._size(),
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                **self._stats,
+            }
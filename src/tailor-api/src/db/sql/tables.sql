@@ -5,6 +5,21 @@ CREATE SCHEMA public;
 GRANT ALL ON SCHEMA public TO PUBLIC;
 SET search_path TO public;
 
+-- trigram matching for fuzzy part search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- =========================
+-- APP META
+-- =========================
+-- schema_epoch changes on every reset; sessions cache users.id against it.
+CREATE TABLE app_meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+INSERT INTO app_meta (key, value)
+VALUES ('schema_epoch', md5(random()::text || clock_timestamp()::text));
+
 -- =========================
 -- USERS
 -- =========================
@@ -132,6 +147,82 @@ CREATE TABLE crowns (
     created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
+-- =========================
+-- CATALOG INDEXES (keyset pagination / filters in query_parts)
+-- =========================
+-- Sort keys: expressions must match PART_SORTS in utils/tailor_utils.py
+CREATE INDEX idx_movements_price_id ON movements ((COALESCE(price, 0)), id);
+CREATE INDEX idx_movements_brand_id ON movements ((COALESCE(lower(brand), '')), id);
+CREATE INDEX idx_cases_price_id ON cases ((COALESCE(price, 0)), id);
+CREATE INDEX idx_cases_brand_id ON cases ((COALESCE(lower(brand), '')), id);
+CREATE INDEX idx_dials_price_id ON dials ((COALESCE(price, 0)), id);
+CREATE INDEX idx_dials_brand_id ON dials ((COALESCE(lower(brand), '')), id);
+CREATE INDEX idx_straps_price_id ON straps ((COALESCE(price, 0)), id);
+CREATE INDEX idx_straps_brand_id ON straps ((COALESCE(lower(brand), '')), id);
+CREATE INDEX idx_hands_price_id ON hands ((COALESCE(price, 0)), id);
+CREATE INDEX idx_hands_brand_id ON hands ((COALESCE(lower(brand), '')), id);
+CREATE INDEX idx_crowns_price_id ON crowns ((COALESCE(price, 0)), id);
+CREATE INDEX idx_crowns_brand_id ON crowns ((COALESCE(lower(brand), '')), id);
+
+-- Filters
+CREATE INDEX idx_movements_brand_lower ON movements (lower(brand));
+CREATE INDEX idx_cases_brand_lower ON cases (lower(brand));
+CREATE INDEX idx_dials_brand_lower ON dials (lower(brand));
+CREATE INDEX idx_straps_brand_lower ON straps (lower(brand));
+CREATE INDEX idx_hands_brand_lower ON hands (lower(brand));
+CREATE INDEX idx_crowns_brand_lower ON crowns (lower(brand));
+CREATE INDEX idx_cases_material_lower ON cases (lower(material));
+CREATE INDEX idx_dials_material_lower ON dials (lower(material));
+CREATE INDEX idx_straps_material_lower ON straps (lower(material));
+CREATE INDEX idx_hands_material_lower ON hands (lower(material));
+CREATE INDEX idx_crowns_material_lower ON crowns (lower(material));
+CREATE INDEX idx_dials_color_lower ON dials (lower(color));
+CREATE INDEX idx_straps_color_lower ON straps (lower(color));
+CREATE INDEX idx_hands_color_lower ON hands (lower(color));
+CREATE INDEX idx_crowns_color_lower ON crowns (lower(color));
+CREATE INDEX idx_movements_user_id ON movements (user_id, id DESC);
+CREATE INDEX idx_cases_user_id ON cases (user_id, id DESC);
+CREATE INDEX idx_dials_user_id ON dials (user_id, id DESC);
+CREATE INDEX idx_straps_user_id ON straps (user_id, id DESC);
+CREATE INDEX idx_hands_user_id ON hands (user_id, id DESC);
+CREATE INDEX idx_crowns_user_id ON crowns (user_id, id DESC);
+CREATE INDEX idx_movements_type ON movements(movement_type_id);
+CREATE INDEX idx_cases_dimension1 ON cases(dimension1);
+CREATE INDEX idx_dials_diameter ON dials(diameter_mm);
+CREATE INDEX idx_straps_width ON straps(width_mm);
+
+-- =========================
+-- SEARCH (GET /api/parts/search)
+-- =========================
+-- Index expressions are wrapped in IMMUTABLE functions so search_parts() in
+-- utils/tailor_utils.py can repeat them exactly and hit the indexes. Every
+-- field uses the 'simple' config, the same one the prefix tsquery is parsed
+-- with: stemmed lexemes ("automat") would never match the user's words.
+CREATE FUNCTION part_search_doc(brand TEXT, model TEXT, description TEXT) RETURNS tsvector
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT setweight(to_tsvector('simple'::regconfig, coalesce(brand, '')), 'A')
+        || setweight(to_tsvector('simple'::regconfig, coalesce(model, '')), 'A')
+        || setweight(to_tsvector('simple'::regconfig, coalesce(description, '')), 'C')
+$$;
+
+CREATE FUNCTION part_search_text(brand TEXT, model TEXT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT lower(coalesce(brand, '') || ' ' || coalesce(model, ''))
+$$;
+
+CREATE INDEX idx_movements_search_doc ON movements USING gin (part_search_doc(brand, model, description));
+CREATE INDEX idx_movements_search_trgm ON movements USING gin (part_search_text(brand, model) gin_trgm_ops);
+CREATE INDEX idx_cases_search_doc ON cases USING gin (part_search_doc(brand, model, description));
+CREATE INDEX idx_cases_search_trgm ON cases USING gin (part_search_text(brand, model) gin_trgm_ops);
+CREATE INDEX idx_dials_search_doc ON dials USING gin (part_search_doc(brand, model, description));
+CREATE INDEX idx_dials_search_trgm ON dials USING gin (part_search_text(brand, model) gin_trgm_ops);
+CREATE INDEX idx_straps_search_doc ON straps USING gin (part_search_doc(brand, model, description));
+CREATE INDEX idx_straps_search_trgm ON straps USING gin (part_search_text(brand, model) gin_trgm_ops);
+CREATE INDEX idx_hands_search_doc ON hands USING gin (part_search_doc(brand, model, description));
+CREATE INDEX idx_hands_search_trgm ON hands USING gin (part_search_text(brand, model) gin_trgm_ops);
+CREATE INDEX idx_crowns_search_doc ON crowns USING gin (part_search_doc(brand, model, description));
+CREATE INDEX idx_crowns_search_trgm ON crowns USING gin (part_search_text(brand, model) gin_trgm_ops);
+
 -- =========================
 -- BUILDS
 -- =========================
@@ -151,6 +242,326 @@ CREATE TABLE builds (
 );
 
 CREATE INDEX idx_builds_user ON builds(user_id);
+-- Reverse lookups part -> builds (repricing fan-out, ON DELETE SET NULL)
+CREATE INDEX idx_builds_movements ON builds(movements_id) WHERE movements_id IS NOT NULL;
+CREATE INDEX idx_builds_cases ON builds(cases_id) WHERE cases_id IS NOT NULL;
+CREATE INDEX idx_builds_dials ON builds(dials_id) WHERE dials_id IS NOT NULL;
+CREATE INDEX idx_builds_straps ON builds(straps_id) WHERE straps_id IS NOT NULL;
+CREATE INDEX idx_builds_hands ON builds(hands_id) WHERE hands_id IS NOT NULL;
+CREATE INDEX idx_builds_crowns ON builds(crowns_id) WHERE crowns_id IS NOT NULL;
+
+-- =========================
+-- BUILD REPRICING
+-- =========================
+-- builds.total_price is the sum of its parts' prices. Price changes are
+-- applied as deltas: one UPDATE of all affected builds per writing statement
+-- (update_part, bulk import, ...), however many parts it touched.
+CREATE FUNCTION reprice_builds_after_update() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format(
+        'UPDATE builds b SET total_price = b.total_price + d.delta '
+        'FROM (SELECT n.id, COALESCE(n.price, 0) - COALESCE(o.price, 0) AS delta '
+        '      FROM new_rows n JOIN old_rows o ON o.id = n.id '
+        '      WHERE n.price IS DISTINCT FROM o.price) d '
+        'WHERE b.%I = d.id', TG_TABLE_NAME || '_id');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Runs before ON DELETE SET NULL detaches the part, while builds still point at it.
+CREATE FUNCTION reprice_builds_before_delete() RETURNS trigger AS $$
+BEGIN
+    IF OLD.price IS NOT NULL AND OLD.price <> 0 THEN
+        EXECUTE format('UPDATE builds SET total_price = total_price - $1 WHERE %I = $2', TG_TABLE_NAME || '_id')
+        USING OLD.price, OLD.id;
+    END IF;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['movements','cases','dials','straps','hands','crowns'] LOOP
+        EXECUTE format(
+            'CREATE TRIGGER trg_%1$s_reprice AFTER UPDATE ON %1$I '
+            'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION reprice_builds_after_update()', t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%1$s_reprice_delete BEFORE DELETE ON %1$I '
+            'FOR EACH ROW EXECUTE FUNCTION reprice_builds_before_delete()', t);
+    END LOOP;
+END;
+$$;
+
+-- =========================
+-- PART USAGE COUNTERS
+-- =========================
+-- How many builds (and published builds) use each part, maintained as
+-- per-statement deltas so reads are a primary-key lookup instead of a
+-- COUNT(*) over builds. Each statement that moves a counter also bumps the
+-- '<part_type>_usage' version stamp (ETags / catalog cache).
+-- reconcile_part_usage() in utils/tailor_utils.py repairs any drift.
+CREATE TABLE part_usage (
+    part_type  TEXT NOT NULL,
+    part_id    INT  NOT NULL,
+    builds     INT  NOT NULL DEFAULT 0,
+    published  INT  NOT NULL DEFAULT 0,
+    PRIMARY KEY (part_type, part_id)
+);
+
+CREATE FUNCTION part_usage_on_builds() RETURNS trigger AS $$
+DECLARE src TEXT; touched TEXT[];
+BEGIN
+    src := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT n.*, 1 AS sign FROM new_rows n'
+        WHEN 'DELETE' THEN 'SELECT o.*, -1 AS sign FROM old_rows o'
+        ELSE 'SELECT n.*, 1 AS sign FROM new_rows n UNION ALL SELECT o.*, -1 FROM old_rows o'
+    END;
+    -- Rows whose parts and published flag didn't change (e.g. repricing) net to zero.
+    EXECUTE format($q$
+        WITH r AS (%s),
+        d AS (
+            SELECT x.part_type, x.part_id, sum(r.sign)::int AS builds,
+                   sum(CASE WHEN r.published THEN r.sign ELSE 0 END)::int AS published
+            FROM r CROSS JOIN LATERAL (VALUES
+                ('movements', r.movements_id), ('cases', r.cases_id), ('dials', r.dials_id),
+                ('straps', r.straps_id), ('hands', r.hands_id), ('crowns', r.crowns_id)
+            ) x(part_type, part_id)
+            WHERE x.part_id IS NOT NULL
+            GROUP BY 1, 2
+        ),
+        up AS (
+            INSERT INTO part_usage AS u (part_type, part_id, builds, published)
+            SELECT part_type, part_id, builds, published FROM d
+            WHERE builds <> 0 OR published <> 0
+            ORDER BY 1, 2  -- fixed lock order across concurrent writers
+            ON CONFLICT (part_type, part_id) DO UPDATE
+                SET builds = u.builds + EXCLUDED.builds, published = u.published + EXCLUDED.published
+            RETURNING u.part_type
+        )
+        SELECT ARRAY(SELECT DISTINCT part_type || '_usage' FROM up)
+    $q$, src) INTO touched;
+    PERFORM bump_versions(touched);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_builds_usage_insert AFTER INSERT ON builds
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION part_usage_on_builds();
+CREATE TRIGGER trg_builds_usage_update AFTER UPDATE ON builds
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION part_usage_on_builds();
+CREATE TRIGGER trg_builds_usage_delete AFTER DELETE ON builds
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION part_usage_on_builds();
+
+-- =========================
+-- PUBLISHED BUILD FEED (read model)
+-- =========================
+-- One denormalized row per published build (owner name, part summaries,
+-- thumbnail), kept current by the triggers below on publish/unpublish, build
+-- edits, repricing, part edits and profile renames, so a feed page is one
+-- index range scan. The app never writes it.
+CREATE TABLE build_feed (
+    build_id      INT PRIMARY KEY REFERENCES builds(id) ON DELETE CASCADE,
+    user_id       INT NOT NULL,
+    owner_name    TEXT NOT NULL,
+    brand_key     TEXT NOT NULL,            -- lower(brand) of the case, else dial, else movement
+    total_price   NUMERIC(100,2) NOT NULL,
+    thumbnail_url TEXT,                     -- case image, else the first part image
+    parts         JSONB NOT NULL,           -- {type: {id, brand, model, price, image_url} | null}
+    published_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX idx_build_feed_newest  ON build_feed (published_at DESC, build_id DESC);
+CREATE INDEX idx_build_feed_price   ON build_feed (total_price, build_id);
+CREATE INDEX idx_build_feed_brand   ON build_feed (brand_key, published_at DESC, build_id DESC);
+
+-- View counts (feed sort=popular), one row per build that has been published.
+-- Deliberately outside build_feed and without a table_versions stamp: views
+-- must not invalidate cached feed pages or take the feed's row locks. The app
+-- buffers views and adds them in batches (app/build_views.py).
+CREATE TABLE build_views (
+    build_id INT PRIMARY KEY REFERENCES builds(id) ON DELETE CASCADE,
+    views    BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX idx_build_views_popular ON build_views (views DESC, build_id DESC);
+
+CREATE FUNCTION feed_part(INT, TEXT, TEXT, NUMERIC, TEXT) RETURNS jsonb AS $$
+    SELECT CASE WHEN $1 IS NULL THEN NULL
+                ELSE jsonb_build_object('id', $1, 'brand', $2, 'model', $3, 'price', $4, 'image_url', $5) END
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Re-derive the feed rows of `ids`: upsert the published ones, drop the rest.
+CREATE FUNCTION refresh_build_feed(ids INT[]) RETURNS void AS $$
+BEGIN
+    IF ids IS NULL OR cardinality(ids) = 0 THEN
+        RETURN;
+    END IF;
+
+    DELETE FROM build_feed f
+    WHERE f.build_id = ANY(ids)
+      AND NOT EXISTS (SELECT 1 FROM builds b WHERE b.id = f.build_id AND b.published);
+
+    INSERT INTO build_feed AS f (build_id, user_id, owner_name, brand_key, total_price, thumbnail_url, parts)
+    SELECT b.id, b.user_id, u.display_name,
+           lower(COALESCE(c.brand, d.brand, m.brand, '')),
+           b.total_price,
+           COALESCE(c.image_url, d.image_url, m.image_url, s.image_url, h.image_url, cr.image_url),
+           jsonb_build_object(
+               'movements', feed_part(m.id,  m.brand,  m.model,  m.price,  m.image_url),
+               'cases',     feed_part(c.id,  c.brand,  c.model,  c.price,  c.image_url),
+               'dials',     feed_part(d.id,  d.brand,  d.model,  d.price,  d.image_url),
+               'straps',    feed_part(s.id,  s.brand,  s.model,  s.price,  s.image_url),
+               'hands',     feed_part(h.id,  h.brand,  h.model,  h.price,  h.image_url),
+               'crowns',    feed_part(cr.id, cr.brand, cr.model, cr.price, cr.image_url)
+           )
+    FROM builds b
+        JOIN users u ON u.id = b.user_id
+        LEFT JOIN movements m ON m.id  = b.movements_id
+        LEFT JOIN cases     c ON c.id  = b.cases_id
+        LEFT JOIN dials     d ON d.id  = b.dials_id
+        LEFT JOIN straps    s ON s.id  = b.straps_id
+        LEFT JOIN hands     h ON h.id  = b.hands_id
+        LEFT JOIN crowns    cr ON cr.id = b.crowns_id
+    WHERE b.id = ANY(ids) AND b.published
+    ON CONFLICT (build_id) DO UPDATE SET
+        user_id = EXCLUDED.user_id,
+        owner_name = EXCLUDED.owner_name,
+        brand_key = EXCLUDED.brand_key,
+        total_price = EXCLUDED.total_price,
+        thumbnail_url = EXCLUDED.thumbnail_url,
+        parts = EXCLUDED.parts
+    WHERE (f.user_id, f.owner_name, f.brand_key, f.total_price, f.thumbnail_url, f.parts)
+          IS DISTINCT FROM (EXCLUDED.user_id, EXCLUDED.owner_name, EXCLUDED.brand_key,
+                            EXCLUDED.total_price, EXCLUDED.thumbnail_url, EXCLUDED.parts);
+
+    -- Counter rows outlive unpublishing, so a republished build keeps its views.
+    INSERT INTO build_views (build_id)
+    SELECT b.id FROM builds b WHERE b.id = ANY(ids) AND b.published
+    ON CONFLICT (build_id) DO NOTHING;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Builds: anything that is or was published. Deletes cascade via the FK.
+CREATE FUNCTION build_feed_on_builds() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_build_feed(ARRAY(SELECT id FROM new_rows WHERE published));
+    ELSE
+        PERFORM refresh_build_feed(ARRAY(
+            SELECT n.id FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE n.published OR o.published));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_builds_feed_insert AFTER INSERT ON builds
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION build_feed_on_builds();
+CREATE TRIGGER trg_builds_feed_update AFTER UPDATE ON builds
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION build_feed_on_builds();
+
+-- Parts: summary fields changed. Deleted parts reach the feed through
+-- ON DELETE SET NULL on builds, and price changes also through repricing.
+CREATE FUNCTION build_feed_on_part_update() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format(
+        'SELECT refresh_build_feed(ARRAY('
+        '  SELECT b.id FROM new_rows n JOIN old_rows o ON o.id = n.id JOIN builds b ON b.%I = n.id '
+        '  WHERE b.published '
+        '    AND (n.brand, n.model, n.price, n.image_url) IS DISTINCT FROM (o.brand, o.model, o.price, o.image_url)))',
+        TG_TABLE_NAME || '_id');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['movements','cases','dials','straps','hands','crowns'] LOOP
+        EXECUTE format(
+            'CREATE TRIGGER trg_%1$s_feed AFTER UPDATE ON %1$I '
+            'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION build_feed_on_part_update()', t);
+    END LOOP;
+END;
+$$;
+
+-- Owners: display name shown on the feed.
+CREATE FUNCTION build_feed_on_user_rename() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_build_feed(ARRAY(SELECT id FROM builds WHERE user_id = NEW.id AND published));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_users_feed AFTER UPDATE OF display_name ON users
+    FOR EACH ROW WHEN (OLD.display_name IS DISTINCT FROM NEW.display_name)
+    EXECUTE FUNCTION build_feed_on_user_rename();
+
+-- =========================
+-- TABLE VERSION STAMPS (ETags)
+-- =========================
+-- Bumped once per writing statement; app/http_cache.py derives ETags from these
+-- instead of hashing response bodies.
+--
+-- Every writer of a table bumps the same row, so a bump must not hold that
+-- row lock for a whole request. Transactions that set tailor.defer_versions
+-- (request transactions, see db_utils.defer_version_bumps) only collect the
+-- table names in tailor.pending_versions; db_utils.commit_transaction bumps
+-- them in a separate autocommit statement right after COMMIT. Until then the
+-- stamp is older than the data, which only costs readers one cache miss.
+CREATE TABLE table_versions (
+    table_name TEXT PRIMARY KEY,
+    version    BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE FUNCTION bump_versions(names TEXT[]) RETURNS void AS $$
+DECLARE pending TEXT[];
+BEGIN
+    IF names IS NULL OR cardinality(names) = 0 THEN
+        RETURN;
+    END IF;
+    IF current_setting('tailor.defer_versions', true) = 'on' THEN
+        pending := COALESCE(NULLIF(current_setting('tailor.pending_versions', true), ''), '{}')::text[];
+        PERFORM set_config('tailor.pending_versions',
+                           ARRAY(SELECT DISTINCT n FROM unnest(pending || names) n ORDER BY 1)::text, true);
+        RETURN;
+    END IF;
+    -- Sorted, so concurrent multi-table bumps lock rows in the same order.
+    INSERT INTO table_versions (table_name, version)
+    SELECT n, 1 FROM unnest(names) n GROUP BY n ORDER BY n
+    ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    PERFORM bump_versions(ARRAY[TG_TABLE_NAME::text]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['movement_types','movements','cases','dials','straps','hands','crowns','builds','build_feed'] LOOP
+        INSERT INTO table_versions (table_name) VALUES (t);
+        EXECUTE format(
+            'CREATE TRIGGER trg_%1$s_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %1$I '
+            'FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()', t);
+    END LOOP;
+    -- Bumped (via bump_versions) per part type whose counters moved.
+    INSERT INTO table_versions (table_name)
+    SELECT p || '_usage' FROM unnest(ARRAY['movements','cases','dials','straps','hands','crowns']) p;
+END;
+$$;
 
 -- =========================
 -- SEEDS
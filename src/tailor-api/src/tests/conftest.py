@@ -0,0 +1,55 @@
+# tests/conftest.py
+#
+# Run from src/tailor-api/src:  pip install -r requirements-dev.txt && python -m pytest -q
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Module-level config is read at import time: keep uploads out of the tree and
+# never talk to real AWS.
+os.environ.setdefault("LOCAL_STORAGE_DIR", tempfile.mkdtemp(prefix="tailor-uploads-"))
+os.environ.setdefault("DERIVATIVE_WORKERS", "0")
+os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
+
+
+# Database tests need a scratch Postgres with db/sql/tables.sql applied, e.g.
+#   TAILOR_TEST_DB="dbname=tailor_test user=postgres host=localhost"
+# They are skipped when it is unset.
+TAILOR_TEST_DB = os.getenv("TAILOR_TEST_DB")
+
+_PART_TABLES = ("movements", "cases", "dials", "straps", "hands", "crowns")
+
+
+@pytest.fixture
+def db():
+    """Point db_utils at TAILOR_TEST_DB, emptied of users, parts and builds."""
+    if not TAILOR_TEST_DB:
+        pytest.skip("TAILOR_TEST_DB not set")
+    import psycopg2
+    from psycopg2.extensions import parse_dsn
+    from db import db_utils
+    from utils.catalog_cache import catalog_cache
+
+    dsn = parse_dsn(TAILOR_TEST_DB)
+    db_utils._CONFIG = {
+        "database": dsn["dbname"], "user": dsn.get("user", "postgres"), "password": dsn.get("password", ""),
+        "host": dsn.get("host", "localhost"), "port": int(dsn.get("port", 5432)),
+    }
+    db_utils._POOL = None
+    conn = psycopg2.connect(TAILOR_TEST_DB)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"TRUNCATE builds, part_usage, {', '.join(_PART_TABLES)}, users RESTART IDENTITY CASCADE")
+    catalog_cache.clear()
+    yield conn
+    conn.close()
+    if db_utils._POOL is not None:
+        db_utils._POOL.close()
+        db_utils._POOL = None
@@ -0,0 +1,75 @@
+# tests/test_build_feed.py
+#
+# Feed views: counted off the request path and kept out of the feed's
+# version stamp (needs TAILOR_TEST_DB, see conftest).
+import pytest
+
+from app import build_views
+from app.services import builds_service
+from utils import tailor_utils
+
+
+@pytest.fixture
+def feed(db, monkeypatch):
+    monkeypatch.setattr(build_views, "BUILD_VIEWS_FLUSH_INTERVAL", 10.0)
+    build_views.flush()
+    owner = tailor_utils.get_or_create_user_from_session({"google_id": "g-owner", "display_name": "Owner"})["id"]
+    viewer = tailor_utils.get_or_create_user_from_session({"google_id": "g-viewer"})["id"]
+    case = tailor_utils.create_part("cases", {"brand": "Acme", "model": "C1", "price": "100.00"}, user_id=owner)
+    ids = []
+    for _ in range(3):
+        b = tailor_utils.create_build(owner, {"cases_id": case["id"]})
+        assert tailor_utils.publish_build_for_user(owner, b["id"], True)
+        ids.append(b["id"])
+    return owner, viewer, ids
+
+
+def _feed_stamp():
+    return tailor_utils.get_table_versions(["build_feed"])["build_feed"]
+
+
+def test_views_do_not_touch_the_feed_stamp(db, feed):
+    owner, viewer, ids = feed
+    stamp = _feed_stamp()
+    for _ in range(3):
+        assert builds_service.get_build(viewer, ids[1])["id"] == ids[1]
+    builds_service.get_build(owner, ids[2])  # owners' own views don't count
+    assert build_views.flush() == 3
+    assert _feed_stamp() == stamp
+
+    rows, _ = builds_service.feed_page({"sort": "popular"})
+    assert [r["id"] for r in rows][0] == ids[1]
+    assert {r["id"]: r["views"] for r in rows} == {ids[0]: 0, ids[1]: 3, ids[2]: 0}
+
+
+def test_views_are_buffered_until_flush(db, feed):
+    _, viewer, ids = feed
+    builds_service.get_build(viewer, ids[0])
+    rows, _ = builds_service.feed_page({"sort": "popular"})
+    assert all(r["views"] == 0 for r in rows)
+    assert build_views.flush() == 1
+    rows, _ = builds_service.feed_page({"sort": "popular"})
+    assert rows[0]["id"] == ids[0] and rows[0]["views"] == 1
+
+
+def test_popular_pages_by_cursor(db, feed):
+    _, viewer, ids = feed
+    for n, build_id in enumerate(ids):
+        for _ in range(n + 1):
+            builds_service.get_build(viewer, build_id)
+    build_views.flush()
+    first, cursor = builds_service.feed_page({"sort": "popular", "limit": "2"})
+    rest, end = builds_service.feed_page({"sort": "popular", "limit": "2", "cursor": cursor})
+    assert [r["id"] for r in first + rest] == list(reversed(ids))
+    assert end is None
+
+
+def test_republished_build_keeps_its_views(db, feed):
+    owner, viewer, ids = feed
+    builds_service.get_build(viewer, ids[0])
+    build_views.flush()
+    assert tailor_utils.publish_build_for_user(owner, ids[0], False)
+    assert ids[0] not in [r["id"] for r in builds_service.feed_page({})[0]]
+    assert tailor_utils.publish_build_for_user(owner, ids[0], True)
+    rows = {r["id"]: r["views"] for r in builds_service.feed_page({})[0]}
+    assert rows[ids[0]] == 1
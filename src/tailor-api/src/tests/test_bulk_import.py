@@ -0,0 +1,26 @@
+# tests/test_bulk_import.py
+import csv
+import io
+
+import pytest
+
+from utils import bulk_import
+from utils.bulk_import import InvalidCSV, import_parts
+
+BIG = "x" * (csv.field_size_limit() + 1)
+
+
+def test_unparseable_csv_reports_the_line():
+    with pytest.raises(InvalidCSV) as exc:
+        list(bulk_import._read_csv(io.StringIO(f"brand,model\nA,B\nA,B\nA,{BIG}\n")))
+    assert str(exc.value) == "invalid_csv" and exc.value.line == 4
+
+
+def test_unparseable_csv_imports_nothing(db):
+    feed = f"brand,model,price\nAcme,C1,100.00\nAcme,{BIG},90.00\n"
+    with pytest.raises(InvalidCSV) as exc:
+        import_parts("cases", io.StringIO(feed))
+    assert exc.value.line == 3
+    with db.cursor() as cur:
+        cur.execute("SELECT count(*) FROM cases")
+        assert cur.fetchone()[0] == 0
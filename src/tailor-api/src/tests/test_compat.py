@@ -0,0 +1,84 @@
+# tests/test_compat.py
+import re
+
+import pytest
+
+from utils import compat
+from utils.catalog_cache import catalog_cache
+
+TABLES = {
+    ("cases", "dimension1"): [(1, 40), (2, 36), (3, None)],
+    ("dials", "diameter_mm"): [(10, 33), (11, 30), (12, 20), (13, None)],
+    ("straps", "width_mm"): [(20, 20), (21, 14)],
+}
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    calls = []
+
+    def fake_exec_get_all(sql, args=()):
+        point = re.match(r"SELECT (\w+) FROM (\w+) WHERE id = %s$", sql)
+        if point:
+            col, table = point.groups()
+            calls.append((table, col, args[0]))
+            return [(v,) for pid, v in TABLES[(table, col)] if pid == args[0]]
+        col, table = re.match(r"SELECT id, (\w+) FROM (\w+)$", sql).groups()
+        calls.append((table, col))
+        return list(TABLES[(table, col)])
+
+    monkeypatch.setattr(compat, "exec_get_all", fake_exec_get_all)
+    compat._memo.clear()
+    return calls
+
+
+def test_index_is_memoized_regardless_of_cache_budget(scans, monkeypatch):
+    monkeypatch.setattr(catalog_cache, "max_bytes", 1)  # nothing fits in the catalog cache
+    assert compat.compatible_ids("dials", "cases", 1) == [10, 11, 13]
+    assert compat.compatible_ids("dials", "cases", 1) == [10, 11, 13]
+    assert compat.compatible_ids("dials", "cases", 2) == [10, 11, 13]
+    assert sorted(set(scans)) == [("cases", "dimension1"), ("dials", "diameter_mm")]
+    assert len(scans) == 2
+
+
+def test_version_bump_rebuilds_the_index(scans):
+    compat.compatible_ids("dials", "cases", 1)
+    catalog_cache.bump("dials")
+    TABLES[("dials", "diameter_mm")].append((14, 34))
+    try:
+        assert compat.compatible_ids("dials", "cases", 1) == [10, 11, 13, 14]
+    finally:
+        TABLES[("dials", "diameter_mm")].pop()
+    assert scans.count(("dials", "diameter_mm")) == 2
+
+
+def test_build_conflicts_reports_violations(scans):
+    assert compat.build_conflicts({"cases": 1, "dials": 10, "straps": 20}) == []
+    conflicts = compat.build_conflicts({"cases": 1, "dials": 12, "straps": 21})
+    assert {tuple(sorted(c["parts"])) for c in conflicts} == {("cases", "dials"), ("cases", "straps")}
+
+
+def test_build_conflicts_rejects_unknown_ids(scans):
+    with pytest.raises(ValueError, match="invalid_dials_id"):
+        compat.build_conflicts({"cases": 1, "dials": 999})
+    with pytest.raises(ValueError, match="invalid_cases_id"):
+        compat.build_conflicts({"cases": "x", "dials": 10})
+    # misses are settled by a point read; the index is scanned once
+    assert scans.count(("dials", "diameter_mm")) == 1
+    assert ("dials", "diameter_mm", 999) in scans
+
+
+def test_part_created_after_the_index_is_found_without_a_rescan(scans):
+    compat.build_conflicts({"cases": 1, "dials": 10})
+    TABLES[("dials", "diameter_mm")].append((15, 20))
+    try:
+        conflicts = compat.build_conflicts({"cases": 1, "dials": 15})
+    finally:
+        TABLES[("dials", "diameter_mm")].pop()
+    assert [c["actual"] for c in conflicts] == [20.0]
+    assert scans.count(("dials", "diameter_mm")) == 1
+
+
+def test_unknown_dimensions_are_compatible(scans):
+    assert compat.build_conflicts({"cases": 3, "dials": 12}) == []
+    assert compat.build_conflicts({"cases": "1", "dials": 13}) == []
@@ -0,0 +1,101 @@
+# tests/test_derivatives.py
+import hashlib
+import io
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image  # noqa: E402
+
+from app import derivatives  # noqa: E402
+from app.derivatives import DerivativePipeline, derived_key, render_variants  # noqa: E402
+
+KEY = "parts/g-123/a.png"
+
+
+def _png(width: int) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (width, width // 2), (200, 30, 30)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path / KEY
+    path.parent.mkdir(parents=True)
+    path.write_bytes(_png(600))
+    return path
+
+
+def test_renders_widths_narrower_than_the_source(tmp_path, src):
+    sha = hashlib.sha256(src.read_bytes()).hexdigest()
+    assert render_variants(str(src), str(tmp_path), KEY, [160, 480, 960], 80, sha) == [160, 480]
+    with Image.open(tmp_path / derived_key(KEY, 160)) as im:
+        assert im.size == (160, 80)
+
+
+def test_discards_jobs_for_replaced_bytes(tmp_path, src):
+    stale = hashlib.sha256(b"previous upload").hexdigest()
+    assert render_variants(str(src), str(tmp_path), KEY, [160], 80, stale) == []
+    assert not (tmp_path / derived_key(KEY, 160)).exists()
+
+
+def test_discards_output_when_source_changes_mid_render(tmp_path, src, monkeypatch):
+    sha = hashlib.sha256(src.read_bytes()).hexdigest()
+    real_identity = derivatives._identity
+    calls = []
+
+    def identity(path):
+        calls.append(path)
+        if len(calls) > 1:  # the check after rendering: key was deleted + re-uploaded
+            src.unlink()
+            src.write_bytes(_png(700))
+        return real_identity(path)
+
+    monkeypatch.setattr(derivatives, "_identity", identity)
+    assert render_variants(str(src), str(tmp_path), KEY, [160, 480], 80, sha) == []
+    assert not (tmp_path / derived_key(KEY, 160)).exists()
+    assert not (tmp_path / derived_key(KEY, 480)).exists()
+
+
+def test_pool_renders_out_of_process(tmp_path, src):
+    pipeline = DerivativePipeline(workers=1)
+    pipeline.enabled = True
+    try:
+        fut = pipeline.submit(str(src), str(tmp_path), KEY, hashlib.sha256(src.read_bytes()).hexdigest())
+        assert fut.result(timeout=60) == [w for w in derivatives.DERIVATIVE_WIDTHS if w < 600]
+        assert pipeline._executor._mp_context.get_start_method() in ("forkserver", "spawn")
+    finally:
+        pipeline.shutdown()
+
+
+def test_workers_do_not_reimport_a_package_main(tmp_path, src):
+    pkg = tmp_path / "entry"
+    pkg.mkdir()
+    (pkg / "__init__.py").write_text("")
+    (pkg / "__main__.py").write_text(
+        "import hashlib, os, sys\n"
+        "with open(os.environ['IMPORTS'], 'a') as f:\n"
+        "    f.write(__name__ + '\\n')\n"
+        "from app.derivatives import DerivativePipeline\n"
+        "if __name__ == '__main__':\n"
+        "    p = DerivativePipeline(workers=1)\n"
+        "    p.enabled = True\n"
+        "    src = sys.argv[1]\n"
+        "    sha = hashlib.sha256(open(src, 'rb').read()).hexdigest()\n"
+        "    print(p.submit(src, sys.argv[2], sys.argv[3], sha).result(timeout=60))\n"
+        "    p.shutdown()\n"
+    )
+    imports = tmp_path / "imports.log"
+    src_root = Path(derivatives.__file__).resolve().parents[1]
+    env = dict(os.environ, IMPORTS=str(imports), PYTHONPATH=os.pathsep.join([str(tmp_path), str(src_root)]))
+    out = subprocess.run(
+        [sys.executable, "-m", "entry", str(src), str(tmp_path), KEY],
+        env=env, capture_output=True, text=True, timeout=120, check=True,
+    ).stdout
+    assert out.strip() == "[160, 480]"
+    assert imports.read_text().split() == ["__main__"]
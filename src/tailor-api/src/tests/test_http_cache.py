@@ -0,0 +1,23 @@
+# tests/test_http_cache.py
+from flask import Flask
+
+from app.http_cache import catalog_list_tables, catalog_tables, compatible_tables
+
+app = Flask(__name__)
+
+
+def test_compatible_with_adds_the_referenced_types():
+    with app.test_request_context("/api/parts/dials?compatible_with=cases:12,straps:3&compatible_with=bogus:1"):
+        assert catalog_list_tables(part_type="dials") == [
+            "dials", "dials_usage", "cases", "cases_usage", "straps", "straps_usage",
+        ]
+    with app.test_request_context("/api/parts/dials"):
+        assert catalog_list_tables(part_type="dials") == catalog_tables("dials")
+
+
+def test_compatible_covers_every_related_type():
+    assert compatible_tables(part_type="cases", part_id=12) == [
+        "cases", "cases_usage", "dials", "dials_usage", "straps", "straps_usage",
+    ]
+    assert compatible_tables(part_type="dials", part_id=1) == ["dials", "dials_usage", "cases", "cases_usage"]
+    assert compatible_tables(part_type="hands", part_id=1) == ["hands", "hands_usage"]
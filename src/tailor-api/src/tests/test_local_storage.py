@@ -0,0 +1,121 @@
+# tests/test_local_storage.py
+#
+# LocalStorage write-once keys, read paths that never touch the tree, and the
+# PutUpload key checks.
+import hashlib
+import io
+import os
+
+import pytest
+from flask import Flask
+from flask_restful import Api
+
+from app import auth_utils, storage as storage_mod
+from app.resources import uploads
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 200
+
+
+@pytest.fixture(params=["plain", "cas"])
+def local(tmp_path, monkeypatch, request):
+    monkeypatch.setattr(storage_mod, "LOCAL_STORAGE_DIR_ABS", str(tmp_path))
+    monkeypatch.setattr(storage_mod.derivative_pipeline, "enabled", False)
+    storage_mod._serve_meta.clear()
+    storage_mod._serve_cache.clear()
+    return storage_mod.LocalStorage(mode=request.param)
+
+
+@pytest.fixture
+def client(local, monkeypatch):
+    monkeypatch.setattr(uploads, "storage", local)
+    monkeypatch.setattr(auth_utils, "current_user_id", lambda: 1)
+    app = Flask(__name__)
+    app.secret_key = "test"
+    api = Api(app, prefix="/api")
+    api.add_resource(uploads.PutUpload, "/uploads/put")
+    api.add_resource(uploads.ServeUpload, "/uploads/file/<path:key>")
+    c = app.test_client()
+    with c.session_transaction() as sess:
+        sess["user"] = {"google_id": "g-123"}
+    return c
+
+
+def test_keys_are_write_once(local):
+    local.handle_put_stream("parts/g-123/a.png", io.BytesIO(PNG), "image/png")
+    with pytest.raises(ValueError, match="key_exists"):
+        local.handle_put_stream("parts/g-123/a.png", io.BytesIO(PNG + b"x"), "image/png")
+    assert (local.base / "parts/g-123/a.png").read_bytes() == PNG
+    assert not [p for p in (local.base / "parts/g-123").iterdir() if p.name.startswith(".upload-")]
+
+
+def test_reads_do_not_create_directories(local):
+    with pytest.raises(FileNotFoundError):
+        local.file_meta("a/b/c/d.png")
+    assert local.variant_key("x/y/z.png", 100) == "x/y/z.png"
+    assert local.delete("q/r/s.png") is False
+    assert sorted(p.name for p in local.base.iterdir()) == []
+
+
+def test_misses_are_cached_and_forgotten_on_put(local):
+    with pytest.raises(FileNotFoundError):
+        local.file_meta("parts/g-123/b.png")
+    local.handle_put_stream("parts/g-123/b.png", io.BytesIO(PNG), "image/png")
+    assert local.file_meta("parts/g-123/b.png").size == len(PNG)
+
+
+def test_hot_bytes_follow_the_etag(local):
+    local.handle_put_stream("parts/g-123/c.png", io.BytesIO(PNG), "image/png")
+    meta = local.file_meta("parts/g-123/c.png")
+    assert local.hot_bytes("parts/g-123/c.png", meta) == PNG
+    assert local.delete("parts/g-123/c.png") is True
+    local.handle_put_stream("parts/g-123/c.png", io.BytesIO(PNG + b"new"), "image/png")
+    fresh = local.file_meta("parts/g-123/c.png")
+    assert fresh.etag != meta.etag
+    assert local.hot_bytes("parts/g-123/c.png", fresh) == PNG + b"new"
+
+
+def test_put_upload_checks_key_owner(client):
+    for key in ("parts/someone-else/a.png", "blobs/aa/bb/" + "0" * 64, "derived/parts/g-123/a.png/w160.webp"):
+        resp = client.put(f"/api/uploads/put?key={key}", data=PNG, content_type="image/png")
+        assert resp.status_code == 403, key
+    resp = client.put("/api/uploads/put?key=parts/g-123/mine.png", data=PNG, content_type="image/png")
+    assert resp.status_code == 200
+    resp = client.put("/api/uploads/put?key=parts/g-123/mine.png", data=PNG, content_type="image/png")
+    assert resp.status_code == 409
+    assert client.get("/api/uploads/file/parts/g-123/mine.png").data == PNG
+
+
+def test_directories_and_dot_segments_are_not_served(client, local):
+    local.handle_put_stream("parts/g-123/d.png", io.BytesIO(PNG), "image/png")
+    (local.base / "parts/g-123/.upload-inflight").write_bytes(PNG)
+    for key in ("parts", "parts/g-123", "parts/g-123/.upload-inflight", ".sessions/x"):
+        assert client.get(f"/api/uploads/file/{key}").status_code == 404, key
+    with pytest.raises(ValueError, match="invalid_key"):
+        local.file_meta("parts/g-123/.upload-inflight")
+    with pytest.raises(FileNotFoundError):
+        local.file_meta("parts/g-123")
+
+
+def test_cas_publish_keeps_a_concurrently_created_blob(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage_mod, "LOCAL_STORAGE_DIR_ABS", str(tmp_path))
+    monkeypatch.setattr(storage_mod.derivative_pipeline, "enabled", False)
+    local = storage_mod.LocalStorage(mode="cas")
+    real_link = os.link
+    blob = local._blob_file(hashlib.sha256(PNG).hexdigest())
+    other = local._path_for("parts/g-456/a.png")
+
+    def racing_link(src, dst):
+        try:
+            return real_link(src, dst)
+        except FileNotFoundError:
+            # Another upload of the same bytes publishes the blob right after our miss.
+            blob.write_bytes(PNG)
+            real_link(blob, other)
+            raise
+
+    monkeypatch.setattr(storage_mod.os, "link", racing_link)
+    local.handle_put_stream("parts/g-123/a.png", io.BytesIO(PNG), "image/png")
+    mine = local.base / "parts/g-123/a.png"
+    assert os.path.samefile(mine, blob) and os.path.samefile(other, blob)
+    assert local.blob_refcount(hashlib.sha256(PNG).hexdigest()) == 2
+    assert not [p for p in mine.parent.iterdir() if p.name.startswith(".upload-")]
@@ -0,0 +1,63 @@
+# tests/test_part_usage.py
+#
+# part_usage counters: kept by the builds triggers, repaired by
+# reconcile_part_usage (needs TAILOR_TEST_DB, see conftest).
+from app import usage_reconcile
+from utils import tailor_utils
+
+
+def _usage(db):
+    with db.cursor() as cur:
+        cur.execute("SELECT part_type, part_id, builds, published FROM part_usage ORDER BY 1, 2")
+        return cur.fetchall()
+
+
+def _stamps(*tables):
+    return tailor_utils.get_table_versions(list(tables))
+
+
+def _catalog(db):
+    uid = tailor_utils.get_or_create_user_from_session({"google_id": "g-1"})["id"]
+    case = tailor_utils.create_part("cases", {"brand": "A", "model": "C1", "price": "100.00"}, user_id=uid)
+    strap = tailor_utils.create_part("straps", {"brand": "A", "model": "S1", "price": "20.00"}, user_id=uid)
+    b1 = tailor_utils.create_build(uid, {"cases_id": case["id"], "straps_id": strap["id"]})
+    tailor_utils.create_build(uid, {"cases_id": case["id"]})
+    assert tailor_utils.publish_build_for_user(uid, b1["id"], True)
+    return case["id"], strap["id"]
+
+
+def test_triggers_keep_counts(db):
+    case_id, strap_id = _catalog(db)
+    assert _usage(db) == [("cases", case_id, 2, 1), ("straps", strap_id, 1, 1)]
+
+
+def test_reconcile_is_a_no_op_without_drift(db):
+    _catalog(db)
+    before = _stamps("cases_usage", "straps_usage")
+    assert tailor_utils.reconcile_part_usage() == {"repaired": 0, "removed": 0}
+    assert _stamps("cases_usage", "straps_usage") == before
+
+
+def test_reconcile_repairs_corrupt_missing_and_orphaned_rows(db):
+    case_id, strap_id = _catalog(db)
+    with db.cursor() as cur:
+        cur.execute("UPDATE part_usage SET builds = 7, published = 0 WHERE part_type = 'cases'")
+        cur.execute("DELETE FROM part_usage WHERE part_type = 'straps'")
+        cur.execute("INSERT INTO part_usage VALUES ('dials', 424242, 3, 1), ('hands', 99, 0, 0)")
+    before = _stamps("cases_usage", "straps_usage", "dials_usage", "hands_usage", "movements_usage")
+
+    # corrupted cases + missing straps + orphaned dials (nonzero); the zero hands row is only removed
+    assert tailor_utils.reconcile_part_usage() == {"repaired": 3, "removed": 2}
+    assert _usage(db) == [("cases", case_id, 2, 1), ("straps", strap_id, 1, 1)]
+
+    after = _stamps("cases_usage", "straps_usage", "dials_usage", "hands_usage", "movements_usage")
+    for t in ("cases_usage", "straps_usage", "dials_usage"):
+        assert int(after[t]) > int(before[t]), t
+    for t in ("hands_usage", "movements_usage"):
+        assert after[t] == before[t], t
+
+
+def test_run_locked_reports_timing(db):
+    _catalog(db)
+    report = usage_reconcile.run_locked()
+    assert report["repaired"] == 0 and report["removed"] == 0 and report["seconds"] >= 0
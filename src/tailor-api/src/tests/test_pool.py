@@ -0,0 +1,50 @@
+# tests/test_pool.py
+import psycopg2
+import pytest
+
+from db.pool import ConnectionPool
+
+
+class FakeConn:
+    closed = 0
+    autocommit = True
+    status = psycopg2.extensions.STATUS_READY
+
+    def close(self):
+        self.closed = 1
+
+
+class FlakyFactory:
+    """Opens connections, except that calls listed in `fail_on` (1-based) raise."""
+
+    def __init__(self, fail_on=()):
+        self.calls = 0
+        self.fail_on = set(fail_on)
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls in self.fail_on:
+            raise psycopg2.OperationalError("server unavailable")
+        return FakeConn()
+
+
+def test_failed_warm_up_releases_every_reservation():
+    pool = ConnectionPool(FlakyFactory(fail_on={2}), minconn=4, maxconn=4, timeout=0.1)
+    with pytest.raises(psycopg2.OperationalError):
+        pool.acquire()
+    assert pool._opening == 0
+    assert pool._size() == 1  # the one connection opened before the failure
+
+    # Capacity is intact once the server is back: all four slots can be used.
+    conns = [pool.acquire() for _ in range(4)]
+    assert len({id(c) for c in conns}) == 4
+    for c in conns:
+        pool.release(c)
+    assert pool._size() == 4
+
+
+def test_failed_first_connect_leaves_no_reservation():
+    pool = ConnectionPool(FlakyFactory(fail_on={1}), minconn=3, maxconn=3, timeout=0.1)
+    with pytest.raises(psycopg2.OperationalError):
+        pool.acquire()
+    assert pool._size() == 0
@@ -0,0 +1,48 @@
+# tests/test_repricing.py
+#
+# Part price edits through update_part reach builds.total_price via the
+# statement-level reprice triggers (needs TAILOR_TEST_DB, see conftest).
+from decimal import Decimal
+
+from utils import tailor_utils
+
+
+def _user(google_id="g-1"):
+    return tailor_utils.get_or_create_user_from_session({"google_id": google_id, "email": "a@example.com"})["id"]
+
+
+def _build_total(db, build_id):
+    with db.cursor() as cur:
+        cur.execute("SELECT total_price FROM builds WHERE id = %s", (build_id,))
+        return cur.fetchone()[0]
+
+
+def test_price_patch_reprices_builds(db):
+    uid = _user()
+    case = tailor_utils.create_part("cases", {"brand": "A", "model": "C1", "price": "100.00"}, user_id=uid)
+    strap = tailor_utils.create_part("straps", {"brand": "A", "model": "S1", "price": "20.00"}, user_id=uid)
+    b1 = tailor_utils.create_build(uid, {"cases_id": case["id"], "straps_id": strap["id"]})
+    b2 = tailor_utils.create_build(uid, {"cases_id": case["id"]})
+    assert _build_total(db, b1["id"]) == Decimal("120.00")
+
+    row = tailor_utils.update_part("cases", case["id"], {"price": "150.50"}, uid)
+    assert row["price"] == Decimal("150.50")
+    assert _build_total(db, b1["id"]) == Decimal("170.50")
+    assert _build_total(db, b2["id"]) == Decimal("150.50")
+
+
+def test_non_price_patch_leaves_totals(db):
+    uid = _user()
+    case = tailor_utils.create_part("cases", {"brand": "A", "model": "C1", "price": "100.00"}, user_id=uid)
+    b = tailor_utils.create_build(uid, {"cases_id": case["id"]})
+    assert tailor_utils.update_part("cases", case["id"], {"material": "Titanium"}, uid)["material"] == "Titanium"
+    assert _build_total(db, b["id"]) == Decimal("100.00")
+
+
+def test_deleting_a_part_reprices_builds(db):
+    uid = _user()
+    case = tailor_utils.create_part("cases", {"brand": "A", "model": "C1", "price": "100.00"}, user_id=uid)
+    strap = tailor_utils.create_part("straps", {"brand": "A", "model": "S1", "price": "20.00"}, user_id=uid)
+    b = tailor_utils.create_build(uid, {"cases_id": case["id"], "straps_id": strap["id"]})
+    assert tailor_utils.delete_part("straps", strap["id"], uid)
+    assert _build_total(db, b["id"]) == Decimal("100.00")
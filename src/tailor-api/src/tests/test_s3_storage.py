@@ -0,0 +1,136 @@
+# tests/test_s3_storage.py
+#
+# S3Storage against moto's in-process S3: presign, proxied put, serve redirect
+# and delete.
+import io
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+from botocore.exceptions import ClientError
+from flask import Flask
+from flask_restful import Api
+from moto import mock_aws
+
+from app import auth_utils, storage as storage_mod
+from app.resources import uploads
+
+BUCKET = "tailor-test-uploads"
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 200
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    with mock_aws():
+        monkeypatch.setattr(storage_mod, "S3_BUCKET", BUCKET)
+        monkeypatch.setattr(storage_mod, "S3_ENDPOINT_URL", None)
+        monkeypatch.setattr(storage_mod, "S3_REGION", "us-east-1")
+        backend = storage_mod.S3Storage()
+        backend.client.create_bucket(Bucket=BUCKET)
+        yield backend
+
+
+@pytest.fixture
+def client(s3, monkeypatch):
+    monkeypatch.setattr(uploads, "storage", s3)
+    monkeypatch.setattr(auth_utils, "current_user_id", lambda: 1)
+    app = Flask(__name__)
+    app.secret_key = "test"
+    api = Api(app, prefix="/api")
+    api.add_resource(uploads.PresignUpload, "/uploads/presign")
+    api.add_resource(uploads.ServeUpload, "/uploads/file/<path:key>")
+    c = app.test_client()
+    with c.session_transaction() as sess:
+        sess["user"] = {"google_id": "g-123"}
+    return c
+
+
+def _exists(s3, key):
+    try:
+        s3.client.head_object(Bucket=BUCKET, Key=key)
+        return True
+    except ClientError as e:
+        assert e.response["Error"]["Code"] in ("404", "NoSuchKey")
+        return False
+
+
+# --- presign ---
+
+def test_presign_requires_size(s3):
+    with pytest.raises(ValueError, match="size_required"):
+        s3.generate_put("g-123", "a.png", "image/png")
+
+
+def test_presign_rejects_oversize(s3):
+    with pytest.raises(ValueError, match="too_large"):
+        s3.generate_put("g-123", "a.png", "image/png", size=storage_mod.MAX_UPLOAD_BYTES + 1)
+
+
+def test_presign_signs_content_length_and_accepts_put(s3):
+    presign = s3.generate_put("g-123", "a.png", "image/png", size=len(PNG))
+    assert presign["key"].startswith("parts/g-123/") and presign["key"].endswith(".png")
+    query = parse_qs(urlsplit(presign["uploadUrl"]).query)
+    assert "content-length" in query["X-Amz-SignedHeaders"][0].split(";")
+
+    resp = requests.put(presign["uploadUrl"], data=PNG, headers={"Content-Type": "image/png"})
+    assert resp.status_code == 200
+    head = s3.client.head_object(Bucket=BUCKET, Key=presign["key"])
+    assert head["ContentLength"] == len(PNG)
+
+
+def test_presign_endpoint_requires_size_for_s3(client):
+    resp = client.post("/api/uploads/presign", json={"filename": "a.png", "contentType": "image/png"})
+    assert resp.status_code == 400
+    assert resp.get_json()["error"] == "size_required"
+
+    resp = client.post("/api/uploads/presign",
+                       json={"filename": "a.png", "contentType": "image/png", "size": len(PNG)})
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body["uploadUrl"].startswith("https://")
+    assert body["cdnUrl"] == f"/api/uploads/file/{body['key']}"
+
+
+# --- proxied put ---
+
+def test_put_stream_stores_object(s3):
+    info = s3.handle_put_stream("parts/g-123/x.png", io.BytesIO(PNG), "image/png")
+    assert info["size"] == len(PNG)
+    obj = s3.client.get_object(Bucket=BUCKET, Key="parts/g-123/x.png")
+    assert obj["Body"].read() == PNG
+    assert obj["ContentType"] == "image/png"
+
+
+def test_put_stream_rejects_wrong_magic_bytes(s3):
+    with pytest.raises(ValueError, match="content_type_mismatch"):
+        s3.handle_put_stream("parts/g-123/y.png", io.BytesIO(b"GIF89a" + b"\x00" * 64), "image/png")
+    assert not _exists(s3, "parts/g-123/y.png")
+
+
+def test_put_stream_rejects_bad_key(s3):
+    with pytest.raises(ValueError, match="invalid_key"):
+        s3.handle_put_stream("../etc/passwd", io.BytesIO(PNG), "image/png")
+
+
+# --- serve ---
+
+def test_serve_redirects_to_presigned_get(s3, client):
+    s3.handle_put_stream("parts/g-123/z.png", io.BytesIO(PNG), "image/png")
+    resp = client.get("/api/uploads/file/parts/g-123/z.png")
+    assert resp.status_code == 302
+    location = resp.headers["Location"]
+    assert urlsplit(location).path.endswith("/parts/g-123/z.png")
+    assert "X-Amz-Signature" in parse_qs(urlsplit(location).query)
+    assert requests.get(location).content == PNG
+
+
+def test_serve_rejects_path_escape(client):
+    assert client.get("/api/uploads/file/parts/../secret.png").status_code in (400, 404)
+
+
+# --- delete ---
+
+def test_delete_removes_object(s3):
+    s3.handle_put_stream("parts/g-123/d.png", io.BytesIO(PNG), "image/png")
+    assert s3.delete("parts/g-123/d.png") is True
+    assert not _exists(s3, "parts/g-123/d.png")
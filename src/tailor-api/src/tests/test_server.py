@@ -0,0 +1,28 @@
+# tests/test_server.py
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1]
+
+PROBE = """
+import threading
+import app.server as server
+names = lambda: sorted(t.name for t in threading.enumerate() if t is not threading.main_thread())
+print(names())
+server.app.test_client().get("/nope")
+print(names())
+"""
+
+
+def test_background_jobs_start_on_first_request_not_import():
+    env = dict(
+        os.environ,
+        FLASK_SECRET_KEY="test", GOOGLE_CLIENT_ID="test", GOOGLE_CLIENT_SECRET="test",
+        UPLOAD_GC_INTERVAL="3600", PART_USAGE_RECONCILE_INTERVAL="3600", BUILD_VIEWS_FLUSH_INTERVAL="10",
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=SRC, env=env, capture_output=True, text=True, timeout=60, check=True,
+    ).stdout.splitlines()
+    assert out == ["[]", "['build-views-flush', 'part-usage-reconcile', 'upload-gc']"]
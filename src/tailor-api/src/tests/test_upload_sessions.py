@@ -0,0 +1,51 @@
+# tests/test_upload_sessions.py
+import io
+
+import pytest
+
+from app import storage as storage_mod
+from app.upload_sessions import UploadSessions
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 200
+
+
+class Trickle(io.BytesIO):
+    """A request stream that hands out at most `step` bytes per read, like a slow client."""
+
+    def __init__(self, data: bytes, step: int):
+        super().__init__(data)
+        self.step = step
+
+    def read(self, n: int = -1) -> bytes:
+        return super().read(self.step if n is None or n < 0 else min(n, self.step))
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage_mod, "LOCAL_STORAGE_DIR_ABS", str(tmp_path))
+    monkeypatch.setattr(storage_mod.derivative_pipeline, "enabled", False)
+    return UploadSessions(storage_mod.LocalStorage(), chunk_bytes=64)
+
+
+def test_first_chunk_is_sniffed_across_short_reads(sessions):
+    s = sessions.create("g-123", "a.png", "image/png", len(PNG))
+    assert sessions.put_chunk(s["id"], "g-123", 0, Trickle(PNG[:64], 3))["size"] == 64
+    for i in range(1, s["chunks"]):
+        sessions.put_chunk(s["id"], "g-123", i, io.BytesIO(PNG[i * 64:(i + 1) * 64]))
+    sessions.complete(s["id"], "g-123")
+    assert (sessions.storage.base / s["key"]).read_bytes() == PNG
+
+
+def test_first_chunk_mismatch_fails_fast(sessions):
+    s = sessions.create("g-123", "a.png", "image/png", len(PNG))
+    with pytest.raises(ValueError, match="content_type_mismatch"):
+        sessions.put_chunk(s["id"], "g-123", 0, Trickle(b"GIF89a" + b"\x00" * 58, 5))
+    assert sessions.status(s["id"], "g-123")["received"] == []
+
+
+def test_short_only_chunk_is_sniffed_whole(sessions):
+    s = sessions.create("g-123", "a.jpg", "image/jpeg", 4)
+    sessions.put_chunk(s["id"], "g-123", 0, Trickle(b"\xff\xd8\xff\xe0", 1))
+    t = sessions.create("g-123", "b.jpg", "image/jpeg", 4)
+    with pytest.raises(ValueError, match="content_type_mismatch"):
+        sessions.put_chunk(t["id"], "g-123", 0, Trickle(b"\x00\xd8\xff\xe0", 1))
@@ -0,0 +1,315 @@
+# utils/bulk_import.py
+#
+# Bulk catalog import: CSV or NDJSON rows for one part type are validated with
+# the same column rules as create_part, movement type names are resolved a
+# batch at a time (one statement per batch, cached for the run), and valid
+# rows are COPYed into a temp staging table. Staged rows whose foreign keys
+# don't resolve are rejected by line number; one merge then updates existing
+# parts (same owner, brand and model, case-insensitive) and inserts the rest,
+# all in a single transaction.
+#
+#   python -m utils.bulk_import movements feed.csv [--format ndjson] [--user-id 1] [--insert-only]
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from db.db_utils import pooled_connection, defer_version_bumps, commit_transaction
+from utils.tailor_utils import (
+    PART_COLUMNS, PART_REQUIRED, PART_JSON_COLS, ensure_valid_part_type, normalize_keys, invalidate_catalog,
+)
+
+IMPORT_BATCH_ROWS = int(os.getenv("IMPORT_BATCH_ROWS", "5000"))
+IMPORT_MAX_REJECTS = int(os.getenv("IMPORT_MAX_REJECTS", "100"))  # reported individually
+
+_NUMERIC_COLS = {"price", "dimension1", "dimension2", "dimension3", "diameter_mm", "width_mm", "length_mm"}
+_INT_COLS = {"movement_type_id"}
+_MAX_NUMERIC = Decimal("99999999.99")  # NUMERIC(10,2)
+
+
+class InvalidCSV(ValueError):
+    """Raised by import_parts when the CSV can't be parsed at all; `line` is where the reader stopped."""
+
+    def __init__(self, line: int, detail: str):
+        super().__init__("invalid_csv")
+        self.line = line
+        self.detail = detail
+
+
+def _read_csv(f: TextIO) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    reader = csv.DictReader(f)
+    try:
+        for row in reader:
+            yield reader.line_num, {k.strip(): v for k, v in row.items() if k}
+    except csv.Error as e:  # NUL byte (before 3.11), field over csv.field_size_limit(), ...
+        # DictReader.line_num only moves after a good row; the inner reader's is current.
+        raise InvalidCSV(reader.reader.line_num, str(e)) from None
+
+
+def _read_ndjson(f: TextIO) -> Iterator[Tuple[int, Any]]:
+    for n, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield n, json.loads(line)
+        except ValueError:
+            yield n, None
+
+
+class CatalogImport:
+    def __init__(self, part_type: str, user_id: Optional[int] = None, upsert: bool = True,
+                 batch_rows: int = IMPORT_BATCH_ROWS):
+        ensure_valid_part_type(part_type)
+        self.part_type = part_type
+        self.user_id = user_id
+        self.upsert = upsert
+        self.batch_rows = max(1, batch_rows)
+        self._movement_types: Dict[str, int] = {}  # type_name -> id, for this run
+        self.report = {
+            "part_type": part_type, "rows_read": 0, "rows_valid": 0,
+            "inserted": 0, "updated": 0, "rejected": 0, "rejects": [],
+        }
+
+    # --- validation ---
+    def _reject(self, line: int, error: str) -> None:
+        self.report["rejected"] += 1
+        if len(self.report["rejects"]) < IMPORT_MAX_REJECTS:
+            self.report["rejects"].append({"line": line, "error": error})
+
+    def _clean(self, raw: Any, columns: List[str]) -> Dict[str, Any]:
+        """One input record -> {column: value} for `columns`; raises ValueError(reason)."""
+        if not isinstance(raw, dict):
+            raise ValueError("invalid_record")
+        data = normalize_keys(raw)
+        data.pop("user_id", None)  # ownership comes from the importer, never the feed
+        row = {}
+        for col in columns:
+            v = data.get(col)
+            if isinstance(v, str):
+                v = v.strip()
+            if v is None or v == "":
+                continue
+            if col in _NUMERIC_COLS:
+                try:
+                    v = Decimal(str(v))
+                except InvalidOperation:
+                    raise ValueError(f"invalid_{col}")
+                if not v.is_finite() or v < 0 or v > _MAX_NUMERIC:
+                    raise ValueError(f"invalid_{col}")
+            elif col in _INT_COLS:
+                try:
+                    v = int(v)
+                except (TypeError, ValueError):
+                    raise ValueError(f"invalid_{col}")
+            elif col in PART_JSON_COLS:
+                if isinstance(v, str):
+                    try:
+                        v = json.loads(v)
+                    except ValueError:
+                        raise ValueError(f"invalid_{col}")
+                v = json.dumps(v)
+            elif not isinstance(v, str):
+                v = str(v)
+            row[col] = v
+        if self.part_type == "movements" and "movement_type_id" not in row:
+            name = data.get("type_") or data.get("movement_type")
+            if isinstance(name, str) and name.strip():
+                row["_type_name"] = name.strip()
+        for req in PART_REQUIRED:
+            if req not in row:
+                raise ValueError(f"missing_{req}")
+        return row
+
+    # --- movement types ---
+    def _resolve_movement_types(self, cur, batch: List[Dict[str, Any]]) -> None:
+        """Fill movement_type_id for the batch with at most one statement."""
+        wanted = sorted({r["_type_name"] for r in batch if "_type_name" in r} - self._movement_types.keys())
+        if wanted:
+            # The final SELECT can't see rows inserted by the CTE (same snapshot), hence the UNION.
+            cur.execute(
+                """
+                WITH wanted(type_name) AS (SELECT unnest(%s::text[])),
+                ins AS (
+                    INSERT INTO movement_types (type_name)
+                    SELECT type_name FROM wanted
+                    ON CONFLICT (type_name) DO NOTHING
+                    RETURNING id, type_name
+                )
+                SELECT id, type_name FROM ins
+                UNION ALL
+                SELECT m.id, m.type_name FROM movement_types m JOIN wanted w USING (type_name)
+                """,
+                (wanted,),
+            )
+            for tid, name in cur.fetchall():
+                self._movement_types[name] = tid
+        for r in batch:
+            name = r.pop("_type_name", None)
+            if name is not None:
+                r["movement_type_id"] = self._movement_types.get(name)
+
+    # --- loading ---
+    def _table_columns(self, cur) -> List[str]:
+        # Intersect the create_part rules with what the table really has.
+        cur.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = %s",
+            (self.part_type,),
+        )
+        present = {r[0] for r in cur.fetchall()}
+        return sorted((PART_COLUMNS[self.part_type] - {"user_id"}) & present)
+
+    def _copy_batch(self, cur, columns: List[str], batch: List[Tuple[int, Dict[str, Any]]]) -> None:
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        for line, r in batch:
+            w.writerow([line] + [r.get(c) for c in columns])
+        buf.seek(0)
+        cur.copy_expert(
+            f"COPY import_stage (_line, {', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf
+        )
+
+    def _check_owner(self, cur) -> None:
+        if self.user_id is not None:
+            cur.execute("SELECT 1 FROM users WHERE id = %s", (self.user_id,))
+            if cur.fetchone() is None:
+                raise ValueError("unknown_user")
+
+    def _reject_dangling(self, cur, columns: List[str]) -> None:
+        """Drop staged rows whose foreign keys don't resolve, reporting them as rejects."""
+        if "movement_type_id" not in columns:
+            return
+        cur.execute(
+            """
+            DELETE FROM import_stage s
+            WHERE s.movement_type_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM movement_types m WHERE m.id = s.movement_type_id)
+            RETURNING s._line
+            """
+        )
+        lines = sorted(r[0] for r in cur.fetchall())
+        for line in lines:
+            self._reject(line, "unknown_movement_type_id")
+        self.report["rows_valid"] -= len(lines)
+
+    def _merge(self, cur, columns: List[str]) -> None:
+        t = self.part_type
+        cols = ", ".join(columns)
+        # Last occurrence of a (brand, model) in the feed wins.
+        cur.execute(
+            f"""
+            CREATE TEMP TABLE import_merge ON COMMIT DROP AS
+            SELECT DISTINCT ON (lower(brand), lower(model)) {cols}
+            FROM import_stage
+            ORDER BY lower(brand), lower(model), _line DESC
+            """
+        )
+        cur.execute("ANALYZE import_merge")
+        # Keeps concurrent imports (and their NOT EXISTS checks) from interleaving.
+        cur.execute(f"LOCK TABLE {t} IN SHARE ROW EXCLUSIVE MODE")
+        match = "p.user_id IS NOT DISTINCT FROM %(uid)s AND lower(p.brand) = lower(s.brand) AND lower(p.model) = lower(s.model)"
+        if self.upsert:
+            # Columns the feed leaves empty keep their current values.
+            sets = ", ".join(f"{c} = COALESCE(s.{c}, p.{c})" for c in columns if c not in ("brand", "model"))
+            cur.execute(f"UPDATE {t} p SET {sets} FROM import_merge s WHERE {match}", {"uid": self.user_id})
+            self.report["updated"] = cur.rowcount
+            src = f"import_merge s WHERE NOT EXISTS (SELECT 1 FROM {t} p WHERE {match})"
+        else:
+            src = "import_stage s"
+        cur.execute(
+            f"INSERT INTO {t} ({cols}, user_id) SELECT {', '.join('s.' + c for c in columns)}, %(uid)s FROM {src}",
+            {"uid": self.user_id},
+        )
+        self.report["inserted"] = cur.rowcount
+
+    def run(self, records: Iterable[Tuple[int, Any]]) -> Dict[str, Any]:
+        started = time.monotonic()
+        with pooled_connection() as conn:
+            conn.autocommit = False
+            try:
+                defer_version_bumps(conn)
+                with conn.cursor() as cur:
+                    columns = self._table_columns(cur)
+                    self._check_owner(cur)
+                    cur.execute(
+                        f"CREATE TEMP TABLE import_stage ON COMMIT DROP AS "
+                        f"SELECT {', '.join(columns)} FROM {self.part_type} WITH NO DATA"
+                    )
+                    cur.execute("ALTER TABLE import_stage ADD COLUMN _line INT")
+
+                    batch: List[Tuple[int, Dict[str, Any]]] = []
+
+                    def flush():
+                        if self.part_type == "movements":
+                            self._resolve_movement_types(cur, [r for _, r in batch])
+                        self._copy_batch(cur, columns, batch)
+                        self.report["rows_valid"] += len(batch)
+                        batch.clear()
+
+                    for line, raw in records:
+                        self.report["rows_read"] += 1
+                        try:
+                            batch.append((line, self._clean(raw, columns)))
+                        except ValueError as e:
+                            self._reject(line, str(e))
+                            continue
+                        if len(batch) >= self.batch_rows:
+                            flush()
+                    if batch:
+                        flush()
+                    if self.report["rows_valid"]:
+                        self._reject_dangling(cur, columns)
+                    if self.report["rows_valid"]:
+                        self._merge(cur, columns)
+                commit_transaction(conn)
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                conn.autocommit = True
+        if self.report["inserted"] or self.report["updated"]:
+            invalidate_catalog(self.part_type)
+
+        seconds = time.monotonic() - started
+        self.report["seconds"] = round(seconds, 3)
+        self.report["rows_per_sec"] = round(self.report["rows_read"] / seconds, 1) if seconds > 0 else None
+        return self.report
+
+
+def import_parts(part_type: str, f: TextIO, fmt: str = "csv", user_id: Optional[int] = None,
+                 upsert: bool = True) -> Dict[str, Any]:
+    """Import a CSV/NDJSON text stream of `part_type` rows; returns the run report."""
+    if fmt not in ("csv", "ndjson"):
+        raise ValueError("invalid_format")
+    records = _read_csv(f) if fmt == "csv" else _read_ndjson(f)
+    return CatalogImport(part_type, user_id=user_id, upsert=upsert).run(records)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Bulk-load parts from CSV or NDJSON.")
+    p.add_argument("part_type", choices=sorted(PART_COLUMNS))
+    p.add_argument("path", help="input file, or - for stdin")
+    p.add_argument("--format", choices=("csv", "ndjson"), help="default: from the file extension")
+    p.add_argument("--user-id", type=int, help="owner of the imported parts (default: none)")
+    p.add_argument("--insert-only", action="store_true", help="append rows instead of upserting")
+    args = p.parse_args(argv)
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    if args.path == "-":
+        report = import_parts(args.part_type, sys.stdin, fmt, args.user_id, not args.insert_only)
+    else:
+        with open(args.path, "r", encoding="utf-8", newline="") as f:
+            report = import_parts(args.part_type, f, fmt, args.user_id, not args.insert_only)
+    print(json.dumps(report, indent=2))
+    return 0 if not report["rejected"] else 2
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
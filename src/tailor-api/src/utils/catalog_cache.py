@@ -0,0 +1,166 @@
+# utils/catalog_cache.py
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def _approx_size(obj: Any) -> int:
+    """Rough retained size of query results (lists of dict rows) in bytes."""
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(_approx_size(k) + _approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(_approx_size(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class CatalogCache:
+    """
+    In-process read-through cache for catalog queries.
+
+    - bounded by approximate bytes; least recently used entries are evicted first
+    - entries expire after `ttl` seconds (bounds staleness across workers)
+    - every key is scoped to a namespace (part type) whose version counter is
+      bumped on writes, so old entries become unreachable immediately
+    - concurrent misses on the same key share one loader call (single flight)
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 30.0, enabled: bool = True):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._versions: Dict[str, int] = {}
+        self._stamps: Dict[str, Any] = {}
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "loads": 0, "coalesced": 0}
+
+    # --- versions ---
+    def version(self, namespace: str) -> int:
+        with self._lock:
+            return self._versions.get(namespace, 0)
+
+    def bump(self, namespace: str) -> int:
+        with self._lock:
+            v = self._versions.get(namespace, 0) + 1
+            self._versions[namespace] = v
+            return v
+
+    def sync(self, namespace: str, stamp: Any) -> None:
+        """
+        Bump `namespace` if an external version stamp (e.g. table_versions in
+        Postgres) moved since we last saw it; this catches writes made by
+        other workers before the TTL would.
+        """
+        with self._lock:
+            if self._stamps.get(namespace) != stamp:
+                self._stamps[namespace] = stamp
+                self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    # --- internals (lock held) ---
+    def _drop(self, key: Hashable) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        size = _approx_size(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (value, size, time.monotonic() + self.ttl)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._stats["evictions"] += 1
+
+    # --- public API ---
+    def get_or_load(self, namespace: str, key: Hashable, loader: Callable[[], Any]) -> Any:
+        if not self.enabled:
+            return loader()
+
+        with self._lock:
+            full_key = (namespace, self._versions.get(namespace, 0), key)
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                if entry[2] > time.monotonic():
+                    self._entries.move_to_end(full_key)
+                    self._stats["hits"] += 1
+                    return entry[0]
+                self._drop(full_key)
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            flight = self._flights.get(full_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[full_key] = _Flight()
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = loader()
+            flight.value = value
+            with self._lock:
+                self._stats["loads"] += 1
+                # Only keep it if no write bumped the version while we were loading.
+                if self._versions.get(namespace, 0) == full_key[1]:
+                    self._store(full_key, value)
+            return value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(full_key, None)
+            flight.done.set()
+
+    def discard(self, namespace: str, key: Hashable) -> None:
+        """Drop one entry (current version) without bumping the whole namespace."""
+        with self._lock:
+            full_key = (namespace, self._versions.get(namespace, 0), key)
+            if full_key in self._entries:
+                self._drop(full_key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                **self._stats,
+            }
+
+
+catalog_cache = CatalogCache(
+    max_bytes=int(os.getenv("CATALOG_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    ttl=float(os.getenv("CATALOG_CACHE_TTL", "30")),
+    enabled=os.getenv("CATALOG_CACHE", "on") != "off",
+)
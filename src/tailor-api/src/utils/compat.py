@@ -0,0 +1,220 @@
+# utils/compat.py
+#
+# Dimensional compatibility between parts. Each FitRule says the value of one
+# part's dimension must fall in a linear range derived from another part's
+# dimension (e.g. a dial's diameter vs. the case width). Per (type, column) we
+# keep a sorted interval index built from one catalog query and memoized until
+# the part type's catalog version moves, so "which dials fit case 12" is a
+# hash lookup plus two bisections, and build validation checks every rule
+# without a query per pair. Parts with an unknown (NULL) dimension are
+# treated as compatible.
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from db.db_utils import exec_get_all
+from utils.catalog_cache import catalog_cache
+
+_EPS = 1e-9
+
+
+class IncompatibleParts(ValueError):
+    """Raised by create_build; `conflicts` lists the violated rules."""
+
+    def __init__(self, conflicts: List[Dict]):
+        super().__init__("incompatible_parts")
+        self.conflicts = conflicts
+
+
+class FitRule(NamedTuple):
+    """b.b_col must lie in [a.a_col * scale_lo + off_lo, a.a_col * scale_hi + off_hi] (mm)."""
+    a_type: str
+    a_col: str
+    b_type: str
+    b_col: str
+    scale_lo: float
+    off_lo: float
+    scale_hi: float
+    off_hi: float
+
+    def describe(self) -> str:
+        return f"{self.b_type}.{self.b_col} must fit {self.a_type}.{self.a_col}"
+
+    def range_for(self, from_type: str, value: float) -> Tuple[str, str, float, float]:
+        """(other_type, other_col, lo, hi) the other side must satisfy given `from_type`'s value."""
+        if from_type == self.a_type:
+            return (self.b_type, self.b_col,
+                    value * self.scale_lo + self.off_lo, value * self.scale_hi + self.off_hi)
+        # Inverse of the (increasing) linear bounds
+        return (self.a_type, self.a_col,
+                (value - self.off_hi) / self.scale_hi, (value - self.off_lo) / self.scale_lo)
+
+
+# dimension1 = case width. Dials sit 3-12 mm inside it; lug (strap) width is
+# roughly half the case width.
+COMPAT_RULES = (
+    FitRule("cases", "dimension1", "dials", "diameter_mm", 1.0, -12.0, 1.0, -3.0),
+    FitRule("cases", "dimension1", "straps", "width_mm", 0.45, 0.0, 0.55, 0.0),
+)
+
+
+class _DimIndex:
+    __slots__ = ("values", "ids", "unknown", "by_id")
+
+    def __init__(self, rows):
+        known = sorted((float(v), pid) for pid, v in rows if v is not None)
+        self.values = [v for v, _ in known]
+        self.ids = [pid for _, pid in known]
+        self.unknown = sorted(pid for pid, v in rows if v is None)
+        self.by_id = {pid: (float(v) if v is not None else None) for pid, v in rows}
+
+    def ids_between(self, lo: float, hi: float) -> List[int]:
+        i = bisect_left(self.values, lo - _EPS)
+        j = bisect_right(self.values, hi + _EPS)
+        return self.ids[i:j]
+
+
+# (part_type, col) -> (catalog version, expires_at, index). Kept apart from the
+# catalog cache entries so a large table is never dropped by its byte budget,
+# but invalidated the same way: version bumps on writes / table_versions sync,
+# and the cache TTL for writes made by other workers.
+_memo: Dict[Tuple[str, str], Tuple[int, float, _DimIndex]] = {}
+_memo_lock = threading.Lock()
+_load_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+
+def _index(part_type: str, col: str) -> _DimIndex:
+    """Interval index for part_type.col, rebuilt when the type's catalog version moves."""
+    key = (part_type, col)
+
+    def cached(version: int) -> Optional[_DimIndex]:
+        hit = _memo.get(key)
+        if hit is not None and hit[0] == version and hit[1] > time.monotonic() and catalog_cache.enabled:
+            return hit[2]
+        return None
+
+    with _memo_lock:
+        version = catalog_cache.version(part_type)
+        hit = cached(version)
+        if hit is not None:
+            return hit
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+    # One full scan per (type, column) at a time; waiters reuse its result.
+    with load_lock:
+        with _memo_lock:
+            version = catalog_cache.version(part_type)
+            hit = cached(version)
+            if hit is not None:
+                return hit
+        idx = _DimIndex(exec_get_all(f"SELECT id, {col} FROM {part_type}"))
+        with _memo_lock:
+            # Only keep it if no write bumped the version while we were loading.
+            if catalog_cache.version(part_type) == version:
+                _memo[key] = (version, time.monotonic() + catalog_cache.ttl, idx)
+        return idx
+
+
+def _lookup(part_type: str, col: str, part_id: int) -> Tuple[bool, Optional[float]]:
+    """
+    (exists, dimension) for one part. A miss (e.g. a part another worker just
+    created) is settled by a primary-key read, never a rescan, so unknown ids
+    can't force full table loads.
+    """
+    idx = _index(part_type, col)
+    if part_id in idx.by_id:
+        return True, idx.by_id[part_id]
+    rows = exec_get_all(f"SELECT {col} FROM {part_type} WHERE id = %s", (part_id,))
+    if not rows:
+        return False, None
+    value = rows[0][0]
+    return True, float(value) if value is not None else None
+
+
+def _rules_between(t1: str, t2: str) -> List[FitRule]:
+    return [r for r in COMPAT_RULES if {r.a_type, r.b_type} == {t1, t2}]
+
+
+def _ranges_from(target_type: str, ref_type: str, ref_id: int) -> List[Tuple[str, float, float]]:
+    out = []
+    for rule in _rules_between(target_type, ref_type):
+        own_col = rule.a_col if ref_type == rule.a_type else rule.b_col
+        found, value = _lookup(ref_type, own_col, ref_id)
+        if not found:
+            raise ValueError("invalid_compatible_with")
+        if value is None:
+            continue  # unknown dimension constrains nothing
+        _, col, lo, hi = rule.range_for(ref_type, value)
+        out.append((col, lo, hi))
+    return out
+
+
+def compat_ranges(target_type: str, refs: List[Tuple[str, int]]) -> List[Tuple[str, float, float]]:
+    """
+    SQL-ready constraints for listing `target_type` parts that fit every
+    (part_type, id) in `refs`: [(column, lo, hi)], NULL column values allowed.
+    Raises ValueError("invalid_compatible_with") for unknown parts.
+    """
+    out = []
+    for ref_type, ref_id in refs:
+        out.extend(_ranges_from(target_type, ref_type, ref_id))
+    return out
+
+
+def compatible_ids(target_type: str, ref_type: str, ref_id: int) -> Optional[List[int]]:
+    """Ids of `target_type` parts that fit the given part; None if no rule relates the two types."""
+    rules = _rules_between(target_type, ref_type)
+    if not rules:
+        return None
+    fits: Optional[set] = None
+    for col, lo, hi in _ranges_from(target_type, ref_type, ref_id):
+        idx = _index(target_type, col)
+        ok = set(idx.ids_between(lo, hi)).union(idx.unknown)
+        fits = ok if fits is None else fits & ok
+    if fits is None:
+        # The reference's own dimension is unknown: everything fits.
+        col = rules[0].a_col if target_type == rules[0].a_type else rules[0].b_col
+        return sorted(_index(target_type, col).by_id)
+    return sorted(fits)
+
+
+def build_conflicts(parts: Dict[str, Optional[int]]) -> List[Dict]:
+    """
+    Rule violations among the chosen parts ({part_type: id or None}); empty
+    when everything fits or dimensions are unknown. Uses only cached indexes.
+    Raises ValueError("invalid_<type>_id") for a part that doesn't exist.
+    """
+    ids: Dict[str, int] = {}
+    values: Dict[Tuple[str, str], Optional[float]] = {}
+    for rule in COMPAT_RULES:
+        for t, col in ((rule.a_type, rule.a_col), (rule.b_type, rule.b_col)):
+            raw = parts.get(t)
+            if raw is None or (t, col) in values:
+                continue
+            try:
+                ids[t] = int(raw)
+            except (TypeError, ValueError):
+                raise ValueError(f"invalid_{t}_id")
+            found, values[(t, col)] = _lookup(t, col, ids[t])
+            if not found:
+                raise ValueError(f"invalid_{t}_id")
+
+    conflicts = []
+    for rule in COMPAT_RULES:
+        if rule.a_type not in ids or rule.b_type not in ids:
+            continue
+        a_id, b_id = ids[rule.a_type], ids[rule.b_type]
+        a_val, b_val = values[(rule.a_type, rule.a_col)], values[(rule.b_type, rule.b_col)]
+        if a_val is None or b_val is None:
+            continue
+        _, _, lo, hi = rule.range_for(rule.a_type, a_val)
+        if not lo - _EPS <= b_val <= hi + _EPS:
+            conflicts.append({
+                "parts": {rule.a_type: a_id, rule.b_type: b_id},
+                "rule": rule.describe(),
+                "expected": [round(lo, 2), round(hi, 2)],
+                "actual": b_val,
+            })
+    return conflicts
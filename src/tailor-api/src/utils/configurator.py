@@ -0,0 +1,211 @@
+# utils/configurator.py
+#
+# Top-k complete builds under a budget. Each part type contributes one
+# ascending array of distinct prices (in cents) with the parts at each price;
+# a depth-first branch-and-bound walks the types smallest-first, pruning on
+# the budget and on the current k-th best total, and the last two levels are
+# solved in closed form with a binary search (vectorized with NumPy when it
+# is installed). Work is capped by a node budget and a deadline, so the
+# answer is always returned in bounded time -- flagged non-exhaustive if the
+# cap was hit.
+from __future__ import annotations
+
+import heapq
+import itertools
+import os
+import time
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-Python bisect fallback
+    np = None
+
+CONFIGURATOR_MAX_NODES = int(os.getenv("CONFIGURATOR_MAX_NODES", "200000"))
+CONFIGURATOR_DEADLINE_MS = float(os.getenv("CONFIGURATOR_DEADLINE_MS", "250"))
+
+
+class PriceGroups:
+    """Distinct ascending prices of one part type and the part ids at each price."""
+
+    __slots__ = ("part_type", "prices", "ids", "_np_prices")
+
+    def __init__(self, part_type: str, rows: Sequence[Tuple[int, int]]):
+        # rows: (part_id, price_cents), any order
+        by_price: Dict[int, List[int]] = {}
+        for pid, cents in rows:
+            by_price.setdefault(cents, []).append(pid)
+        self.part_type = part_type
+        self.prices = sorted(by_price)
+        self.ids = [sorted(by_price[p]) for p in self.prices]
+        self._np_prices = np.asarray(self.prices, dtype=np.int64) if np is not None else None
+
+    def __len__(self):
+        return len(self.prices)
+
+
+class _TopK:
+    """
+    Best price-tuples seen so far, counted in builds (a tuple stands for every
+    combination of the parts sharing those prices). The heap root is the
+    worst kept entry; entries are dropped once the rest already cover k builds.
+    """
+
+    def __init__(self, k: int, maximize: bool):
+        self.k = k
+        self.maximize = maximize
+        self._heap: List[Tuple[int, int, tuple, int]] = []
+        self._count = 0
+        self._seq = itertools.count()
+
+    def full(self) -> bool:
+        return self._count >= self.k
+
+    def threshold(self) -> int:
+        key = self._heap[0][0]
+        return key if self.maximize else -key
+
+    def beats(self, total: int) -> bool:
+        """Could a build costing `total` still make the list?"""
+        if not self.full():
+            return True
+        t = self.threshold()
+        return total > t if self.maximize else total < t
+
+    def push(self, total: int, idx: tuple, count: int) -> None:
+        key = total if self.maximize else -total
+        heapq.heappush(self._heap, (key, next(self._seq), idx, count))
+        self._count += count
+        while self._count - self._heap[0][3] >= self.k:
+            self._count -= heapq.heappop(self._heap)[3]
+
+    def ranked(self) -> List[Tuple[int, tuple]]:
+        entries = sorted(self._heap, key=lambda e: (-e[0], e[1]))
+        return [(e[0] if self.maximize else -e[0], e[2]) for e in entries]
+
+
+class _Search:
+    def __init__(self, groups: List[PriceGroups], budget: int, k: int, maximize: bool,
+                 max_nodes: int, deadline: float):
+        # Fewest distinct prices first: small branching near the root; the
+        # largest arrays end up in the closed-form last two levels.
+        self.groups = sorted(groups, key=len)
+        self.budget = budget
+        self.maximize = maximize
+        self.top = _TopK(k, maximize)
+        self.max_nodes = max_nodes
+        self.deadline = deadline
+        self.nodes = 0
+        self.truncated = False
+        n = len(self.groups)
+        # Cheapest / dearest completion of levels i..n-1
+        self.min_rest = [0] * (n + 1)
+        self.max_rest = [0] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            self.min_rest[i] = self.min_rest[i + 1] + self.groups[i].prices[0]
+            self.max_rest[i] = self.max_rest[i + 1] + self.groups[i].prices[-1]
+
+    def _out_of_time(self) -> bool:
+        self.nodes += 1
+        if self.nodes >= self.max_nodes or (self.nodes & 1023 == 0 and time.monotonic() > self.deadline):
+            self.truncated = True
+        return self.truncated
+
+    def _count(self, idx: tuple) -> int:
+        c = 1
+        for g, i in zip(self.groups, idx):
+            c *= len(g.ids[i])
+        return c
+
+    # --- last level: one binary search, then walk outward from the best slot ---
+    def _leaf(self, partial: int, idx: tuple) -> None:
+        g = self.groups[-1]
+        room = self.budget - partial
+        hi = bisect_right(g.prices, room)  # prices[:hi] fit
+        order = range(hi - 1, -1, -1) if self.maximize else range(hi)
+        for j in order:
+            total = partial + g.prices[j]
+            if not self.top.beats(total):
+                break
+            self.top.push(total, idx + (j,), self._count(idx + (j,)))
+
+    # --- last two levels: best completion of every candidate at once ---
+    def _pair(self, partial: int, idx: tuple) -> None:
+        a, b = self.groups[-2], self.groups[-1]
+        room = self.budget - partial
+        hi = bisect_right(a.prices, room - b.prices[0])
+        if hi == 0:
+            return
+        if np is not None:
+            cand = a._np_prices[:hi]
+            fit = np.searchsorted(b._np_prices, room - cand, side="right")
+            best_b = b._np_prices[fit - 1] if self.maximize else np.full(hi, b.prices[0], dtype=np.int64)
+            bounds = (cand + best_b).tolist()
+        else:
+            if self.maximize:
+                bounds = [x + b.prices[bisect_right(b.prices, room - x) - 1] for x in a.prices[:hi]]
+            else:
+                bounds = [x + b.prices[0] for x in a.prices[:hi]]
+        # Visit the candidates in order of their exact best completion.
+        for i in sorted(range(hi), key=bounds.__getitem__, reverse=self.maximize):
+            if not self.top.beats(partial + bounds[i]) or self._out_of_time():
+                break
+            self._leaf(partial + a.prices[i], idx + (i,))
+
+    def _descend(self, level: int, partial: int, idx: tuple) -> None:
+        n = len(self.groups)
+        if level == n - 1:
+            self._leaf(partial, idx)
+            return
+        if level == n - 2:
+            self._pair(partial, idx)
+            return
+        g = self.groups[level]
+        room = self.budget - partial - self.min_rest[level + 1]
+        hi = bisect_right(g.prices, room)
+        order = range(hi - 1, -1, -1) if self.maximize else range(hi)
+        for i in order:
+            x = g.prices[i]
+            if self.maximize:
+                bound = min(self.budget, partial + x + self.max_rest[level + 1])
+            else:
+                bound = partial + x + self.min_rest[level + 1]
+            if not self.top.beats(bound):
+                break  # candidates only get worse from here
+            if self._out_of_time():
+                return
+            self._descend(level + 1, partial + x, idx + (i,))
+
+    def run(self) -> None:
+        if self.groups and self.min_rest[0] <= self.budget:
+            self._descend(0, 0, ())
+
+
+def top_k_builds(groups: List[PriceGroups], budget_cents: int, k: int = 10, maximize: bool = False,
+                 max_nodes: int = CONFIGURATOR_MAX_NODES,
+                 deadline_ms: float = CONFIGURATOR_DEADLINE_MS) -> Dict:
+    """
+    Up to `k` builds (one part per group) with total <= budget_cents, cheapest
+    first (or dearest first with maximize=True).
+    Returns {"builds": [{"total": cents, "parts": {part_type: id}}], "exhaustive": bool, "nodes": int}.
+    """
+    if any(len(g) == 0 for g in groups):
+        return {"builds": [], "exhaustive": True, "nodes": 0}
+    search = _Search(groups, budget_cents, k, maximize, max_nodes,
+                     time.monotonic() + deadline_ms / 1000.0)
+    search.run()
+
+    builds = []
+    for total, idx in search.top.ranked():
+        id_lists = [g.ids[i] for g, i in zip(search.groups, idx)]
+        for combo in itertools.product(*id_lists):
+            builds.append({
+                "total": total,
+                "parts": {g.part_type: pid for g, pid in zip(search.groups, combo)},
+            })
+            if len(builds) >= k:
+                break
+        if len(builds) >= k:
+            break
+    return {"builds": builds, "exhaustive": not search.truncated, "nodes": search.nodes}
@@ -83,7 +83,7 @@ def create_build(user_id, movement_id, case_id, dial_id, strap_id, hand_id, crow
     return exec_get_one(sql_insert, args)
 
 def get_all_builds():
-    sql = """"
+    sql = """
     SELECT b.*, u.display_name, u.email
     FROM builds b
     LEFT JOIN users u ON b.user_id = u.ID;"""
@@ -1,12 +1,16 @@
+import psycopg2
 from db.db_utils import (
-    exec_get_all_dict, exec_get_one_dict, exec_commit
+    exec_get_all, exec_get_all_dict, exec_get_one_dict, exec_commit, exec_stream_dict, pooled_connection, after_commit,
+    defer_version_bumps, commit_transaction,
 )
 from psycopg2.extras import Json
+from utils.catalog_cache import catalog_cache
+from utils.compat import build_conflicts, IncompatibleParts
 
 # Valid part tables
 _VALID = {"movements", "cases", "dials", "straps", "hands", "crowns"}
 
-def _ensure_valid(part_type: str):
+def ensure_valid_part_type(part_type: str):
     if part_type not in _VALID:
         raise ValueError(f"Invalid part type: {part_type}")
 
@@ -23,7 +27,17 @@ def _apply_json_adapters(d: dict, json_cols: set[str]) -> dict:
         out[k] = _adapt_json_value(v) if k in json_cols or isinstance(v, (dict, list)) else v
     return out
 
-def _normalize_keys(d: dict) -> dict:
+def _copy_rows(rows):
+    # Cached rows are shared between requests; hand callers their own dicts.
+    return [dict(r) for r in rows]
+
+def invalidate_catalog(part_type: str):
+    # Bump now so this request never reads its own stale entries, and again
+    # after commit so concurrent readers can't cache pre-commit rows.
+    catalog_cache.bump(part_type)
+    after_commit(lambda: catalog_cache.bump(part_type))
+
+def normalize_keys(d: dict) -> dict:
     """
     Bring incoming payload keys to our DB schema:
       - product_url / productURL / productLink -> product_link
@@ -62,6 +76,31 @@ def movement_type_id_for_name(type_name: str) -> int | None:
     row = exec_get_one_dict("SELECT id FROM movement_types WHERE type_name=%s", (type_name,))
     return row["id"] if row else None
 
+# ---------- Schema ----------
+def get_schema_epoch() -> str | None:
+    """Random token written by tables.sql; changes on every schema reset."""
+    # Own pooled connection: on an old schema without app_meta the failed
+    # SELECT must not abort the caller's request transaction.
+    try:
+        with pooled_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT value FROM app_meta WHERE key='schema_epoch'")
+            row = cur.fetchone()
+    except psycopg2.Error:
+        return None
+    return row[0] if row else None
+
+def get_table_versions(tables: list[str]) -> dict:
+    """Current version stamp per table (plus the schema epoch) for ETags."""
+    rows = exec_get_all_dict(
+        """
+        SELECT table_name AS k, version::text AS v FROM table_versions WHERE table_name = ANY(%s)
+        UNION ALL
+        SELECT key, value FROM app_meta WHERE key = 'schema_epoch'
+        """,
+        (list(tables),)
+    )
+    return {r["k"]: r["v"] for r in rows}
+
 # ---------- Users ----------
 def get_user_by_google_id(google_id: str):
     return exec_get_one_dict("SELECT * FROM users WHERE google_id=%s", (google_id,))
@@ -103,86 +142,322 @@ def update_user_profile(google_id: str, display_name: str, bio: str):
 
 # ---------- Parts (read) ----------
 def get_all_parts(part_type: str):
-    _ensure_valid(part_type)
-    if part_type == "movements":
-        return exec_get_all_dict(
-            """
-            SELECT m.*, mt.type_name AS movement_type
-            FROM movements m
-            LEFT JOIN movement_types mt ON m.movement_type_id = mt.id
-            ORDER BY m.id DESC
-            """
-        )
-    return exec_get_all_dict(f"SELECT * FROM {part_type} ORDER BY id DESC")
+    ensure_valid_part_type(part_type)
+    rows = catalog_cache.get_or_load(part_type, ("all",), lambda: _fetch_all_parts(part_type))
+    return _copy_rows(rows)
+
+def _fetch_all_parts(part_type: str):
+    return exec_get_all_dict(
+        f"SELECT {_parts_columns(part_type)} FROM {_parts_source(part_type)} ORDER BY p.id DESC"
+    )
 
 def get_parts_by_id(part_type: str, part_id: int):
-    _ensure_valid(part_type)
+    ensure_valid_part_type(part_type)
+    row = catalog_cache.get_or_load(part_type, ("id", part_id), lambda: _fetch_part_by_id(part_type, part_id))
+    return dict(row) if row else None
+
+def _fetch_part_by_id(part_type: str, part_id: int):
+    return exec_get_one_dict(
+        f"SELECT {_parts_columns(part_type)} FROM {_parts_source(part_type)} WHERE p.id=%s", (part_id,)
+    )
+
+# ---------- Parts (filtered / keyset-paginated) ----------
+# Case-insensitive equality filters, per part type (query param -> column)
+PART_TEXT_FILTERS = {
+    "movements": {"brand": "p.brand", "movement_type": "mt.type_name"},
+    "cases":     {"brand": "p.brand", "material": "p.material"},
+    "dials":     {"brand": "p.brand", "material": "p.material", "color": "p.color"},
+    "straps":    {"brand": "p.brand", "material": "p.material", "color": "p.color"},
+    "hands":     {"brand": "p.brand", "material": "p.material", "color": "p.color"},
+    "crowns":    {"brand": "p.brand", "material": "p.material", "color": "p.color"},
+}
+
+# Numeric columns that accept min_<col> / max_<col>
+PART_RANGE_FILTERS = {
+    "movements": {"price"},
+    "cases":     {"price", "dimension1", "dimension2", "dimension3"},
+    "dials":     {"price", "diameter_mm"},
+    "straps":    {"price", "width_mm", "length_mm"},
+    "hands":     {"price"},
+    "crowns":    {"price"},
+}
+
+# sort name -> (key expression or None for id-only, direction).
+# Expressions must match the indexes in db/sql/tables.sql ("popular" reads the
+# joined part_usage counter, so it sorts the filtered rows instead).
+PART_SORTS = {
+    "newest":     (None, "DESC"),
+    "oldest":     (None, "ASC"),
+    "price_asc":  ("COALESCE(p.price, 0)", "ASC"),
+    "price_desc": ("COALESCE(p.price, 0)", "DESC"),
+    "brand":      ("COALESCE(lower(p.brand), '')", "ASC"),
+    "popular":    ("COALESCE(u.builds, 0)", "DESC"),
+}
+
+# "Used in N builds": trigger-maintained counters (db/sql/tables.sql), one
+# primary-key probe per part.
+_USAGE_COLUMNS = "COALESCE(u.builds, 0) AS used_in_builds, COALESCE(u.published, 0) AS used_in_published"
+
+def _parts_columns(part_type: str) -> str:
     if part_type == "movements":
-        return exec_get_one_dict(
-            """
-            SELECT m.*, mt.type_name AS movement_type
-            FROM movements m
-            LEFT JOIN movement_types mt ON m.movement_type_id = mt.id
-            WHERE m.id=%s
-            """,
-            (part_id,)
-        )
-    return exec_get_one_dict(f"SELECT * FROM {part_type} WHERE id=%s", (part_id,))
+        return f"p.*, mt.type_name AS movement_type, {_USAGE_COLUMNS}"
+    return f"p.*, {_USAGE_COLUMNS}"
 
-def list_my_parts(user_id: int):
-    out = {}
-    for t in _VALID:
-        out[t] = exec_get_all_dict(
-            f"SELECT * FROM {t} WHERE user_id=%s ORDER BY id DESC",
-            (user_id,)
+def _parts_source(part_type: str) -> str:
+    usage = f"LEFT JOIN part_usage u ON u.part_type = '{part_type}' AND u.part_id = p.id"
+    if part_type == "movements":
+        return f"movements p LEFT JOIN movement_types mt ON p.movement_type_id = mt.id {usage}"
+    return f"{part_type} p {usage}"
+
+def _parts_select(part_type: str) -> str:
+    # `{key}` is filled in by query_parts with the sort-key column
+    return f"SELECT {_parts_columns(part_type)}{{key}} FROM {_parts_source(part_type)}"
+
+def _parts_query(part_type: str, text_filters: dict | None, ranges: dict | None,
+                 sort: str, after: tuple | None, compat: list | None = None) -> tuple[str, list]:
+    """
+    Filtered, ordered catalog SELECT (no LIMIT) shared by query_parts / stream_parts.
+    compat: [(column, lo, hi)] from utils.compat; unknown (NULL) dimensions pass.
+    """
+    ensure_valid_part_type(part_type)
+    if sort not in PART_SORTS:
+        raise ValueError("invalid_sort")
+    key_expr, direction = PART_SORTS[sort]
+
+    where, args = [], []
+    for name, values in (text_filters or {}).items():
+        col = PART_TEXT_FILTERS[part_type].get(name)
+        if col is None or not values:
+            continue
+        where.append(f"lower({col}) = ANY(%s)")
+        args.append([v.lower() for v in values])
+    for col, (lo, hi) in (ranges or {}).items():
+        if col not in PART_RANGE_FILTERS[part_type]:
+            continue
+        if lo is not None:
+            where.append(f"p.{col} >= %s")
+            args.append(lo)
+        if hi is not None:
+            where.append(f"p.{col} <= %s")
+            args.append(hi)
+    for col, lo, hi in compat or ():
+        if col not in PART_RANGE_FILTERS[part_type]:
+            continue
+        where.append(f"(p.{col} IS NULL OR p.{col} BETWEEN %s AND %s)")
+        args.extend((lo, hi))
+
+    op = "<" if direction == "DESC" else ">"
+    if key_expr is None:
+        select = _parts_select(part_type).format(key=", p.id AS _sort_key")
+        order = f"p.id {direction}"
+        if after is not None:
+            where.append(f"p.id {op} %s")
+            args.append(after[1])
+    else:
+        select = _parts_select(part_type).format(key=f", {key_expr} AS _sort_key")
+        order = f"{key_expr} {direction}, p.id {direction}"
+        if after is not None:
+            where.append(f"({key_expr}, p.id) {op} (%s, %s)")
+            args.extend(after)
+
+    sql = select
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {order}"
+    return sql, args
+
+def query_parts(part_type: str, text_filters: dict | None = None, ranges: dict | None = None,
+                sort: str = "newest", limit: int = 50, after: tuple | None = None,
+                compat: list | None = None):
+    """
+    One page of parts using keyset pagination.
+      text_filters: {"brand": ["seiko", ...], ...}  (OR within a key, AND across keys)
+      ranges:       {"price": (min|None, max|None), ...}
+      after:        (sort_key, id) of the last row already returned, or None
+      compat:       [(column, lo, hi)] fit constraints (compatible_with=)
+    Each row carries `_sort_key`, the value to build the next cursor from.
+    """
+    sql, args = _parts_query(part_type, text_filters, ranges, sort, after, compat)
+    sql += " LIMIT %s"
+    args = tuple(args) + (limit,)
+    rows = catalog_cache.get_or_load(part_type, ("page", sql, args), lambda: exec_get_all_dict(sql, args))
+    return _copy_rows(rows)
+
+def stream_parts(part_type: str, text_filters: dict | None = None, ranges: dict | None = None,
+                 sort: str = "newest", compat: list | None = None):
+    """Every matching part, yielded in batches from a server-side cursor."""
+    sql, args = _parts_query(part_type, text_filters, ranges, sort, None, compat)
+    for row in exec_stream_dict(sql, tuple(args)):
+        row.pop("_sort_key", None)
+        yield row
+
+def get_price_candidates(part_type: str, text_filters: dict | None = None, ranges: dict | None = None,
+                         max_price=None, compat: list | None = None) -> list[tuple[int, int]]:
+    """(id, price in cents) of every priced part matching the filters, cached per catalog version."""
+    sql, args = _parts_query(part_type, text_filters, ranges, "price_asc", None, compat)
+    sql = f"SELECT q.id, round(q.price * 100)::bigint FROM ({sql}) q WHERE q.price IS NOT NULL"
+    if max_price is not None:
+        sql += " AND q.price <= %s"
+        args.append(max_price)
+    args = tuple(args)
+    return catalog_cache.get_or_load(part_type, ("prices", sql, args), lambda: exec_get_all(sql, args))
+
+# ---------- Parts (search) ----------
+def search_parts(tsquery: str, raw: str, types: list[str], limit: int = 20, offset: int = 0,
+                 fuzzy: bool = True, max_hits: int | None = None):
+    """
+    Ranked search over brand/model/description across part tables.
+      tsquery:  prefix query in to_tsquery('simple') syntax, e.g. 'seik:* & blu:*'
+      raw:      the cleaned query text, matched by trigram similarity (typos)
+      max_hits: stop collecting after this many matches per type (ranking and
+                facet counts then only cover those; "capped" says so)
+    Returns {"items": [...], "facets": {part_type: match_count}, "capped": bool} from one statement.
+    """
+    for t in types:
+        ensure_valid_part_type(t)
+    if not types:
+        return {"items": [], "facets": {}}
+
+    match = "part_search_doc(p.brand, p.model, p.description) @@ q.tsq"
+    score = "ts_rank_cd(part_search_doc(p.brand, p.model, p.description), q.tsq)"
+    if fuzzy:
+        match += " OR part_search_text(p.brand, p.model) %% q.raw"
+        score += " + similarity(part_search_text(p.brand, p.model), q.raw)"
+
+    cap = f"LIMIT {int(max_hits)}" if max_hits else ""
+    branches = [
+        f"""
+        (SELECT '{t}' AS part_type, p.id, p.brand, p.model, p.price, p.image_url, {score} AS score
+         FROM {t} p, q
+         WHERE {match}
+         {cap})
+        """
+        for t in types
+    ]
+    sql = f"""
+    WITH q AS (SELECT to_tsquery('simple', %s) AS tsq, %s::text AS raw),
+    hits AS ({" UNION ALL ".join(branches)})
+    SELECT
+        (SELECT COALESCE(json_object_agg(part_type, n), '{{}}'::json)
+           FROM (SELECT part_type, count(*) AS n FROM hits GROUP BY part_type) f) AS facets,
+        (SELECT COALESCE(json_agg(h ORDER BY h.score DESC, h.id DESC), '[]'::json)
+           FROM (SELECT * FROM hits ORDER BY score DESC, id DESC LIMIT %s OFFSET %s) h) AS items
+    """
+    row = exec_get_one_dict(sql, (tsquery, raw, limit, offset))
+    capped = bool(max_hits) and any(n >= max_hits for n in row["facets"].values())
+    return {"items": row["items"], "facets": row["facets"], "capped": capped}
+
+def get_parts_batch(refs: list[tuple[str, int]]):
+    """
+    Hydrate arbitrary (part_type, id) pairs in one UNION ALL statement.
+    Returns rows of {"part_type", "id", "part"} for the ids that exist.
+    """
+    by_type: dict[str, list[int]] = {}
+    for t, pid in refs:
+        ensure_valid_part_type(t)
+        by_type.setdefault(t, []).append(pid)
+    if not by_type:
+        return []
+    branches, args = [], []
+    for t in sorted(by_type):
+        extra = "'used_in_builds', COALESCE(u.builds, 0), 'used_in_published', COALESCE(u.published, 0)"
+        if t == "movements":
+            extra += ", 'movement_type', mt.type_name"
+        part = f"to_jsonb(p) || jsonb_build_object({extra})"
+        branches.append(f"SELECT '{t}' AS part_type, p.id, {part} AS part FROM {_parts_source(t)} WHERE p.id = ANY(%s)")
+        args.append(by_type[t])
+    return exec_get_all_dict(" UNION ALL ".join(branches), tuple(args))
+
+def get_part_prices(refs: list[tuple[str, int]]) -> dict[tuple[str, int], object]:
+    """
+    {(part_type, id): price} for many (part_type, id) pairs in one UNION ALL
+    statement (one ANY(array) probe per type). Missing ids are absent; a part
+    without a price maps to None.
+    """
+    by_type: dict[str, set[int]] = {}
+    for t, pid in refs:
+        ensure_valid_part_type(t)
+        by_type.setdefault(t, set()).add(pid)
+    if not by_type:
+        return {}
+    branches, args = [], []
+    for t in sorted(by_type):
+        branches.append(f"SELECT '{t}' AS part_type, id, price FROM {t} WHERE id = ANY(%s)")
+        args.append(sorted(by_type[t]))
+    rows = exec_get_all(" UNION ALL ".join(branches), tuple(args))
+    return {(t, pid): price for t, pid, price in rows}
+
+def list_my_parts(user_id: int, limit: int | None = None, before: dict | None = None):
+    """
+    All of a user's parts grouped by type, in one statement: each type is a
+    json_agg subselect over (user_id, id DESC). Optional per-type keyset
+    pagination: `limit` rows per type, `before={"cases": <id>, ...}`.
+    """
+    before = before or {}
+    selects, args = [], []
+    for t in sorted(_VALID):
+        where = "p.user_id = %s"
+        args.append(user_id)
+        if before.get(t) is not None:
+            where += " AND p.id < %s"
+            args.append(before[t])
+        selects.append(
+            f"""(SELECT COALESCE(json_agg(r ORDER BY r.id DESC), '[]'::json) FROM (
+                   SELECT {_parts_columns(t)} FROM {_parts_source(t)}
+                   WHERE {where} ORDER BY p.id DESC LIMIT %s
+               ) r) AS {t}"""
         )
-    return out
+        args.append(limit)  # LIMIT NULL == no limit
+    row = exec_get_one_dict("SELECT " + ",\n".join(selects), tuple(args))
+    return dict(row)
 
 # ---------- Parts (create/update/delete) ----------
+# Writable columns per part type (create_part, bulk import)
+PART_COLUMNS = {
+    "movements": {
+        "brand", "model", "movement_type_id", "price", "image_url",
+        "power_reserve", "accuracy", "description", "product_link",
+        "user_id", "align_meta"
+    },
+    "cases": {
+        "brand", "model", "price", "image_url",
+        "material", "dimension1", "dimension2", "dimension3",
+        "description", "product_link",
+        "user_id", "align_meta"
+    },
+    "dials": {
+        "brand", "model", "price", "image_url",
+        "color", "material", "diameter_mm",
+        "description", "product_link",
+        "user_id", "align_meta"
+    },
+    "straps": {
+        "brand", "model", "price", "image_url",
+        "color", "material", "width_mm", "length_mm",
+        "description", "product_link",
+        "user_id", "align_meta"
+    },
+    "hands": {
+        "brand", "model", "price", "image_url",
+        "color", "material", "type_",
+        "description", "product_link",
+        "user_id", "align_meta"
+    },
+    "crowns": {
+        "brand", "model", "price", "image_url",
+        "color", "material",
+        "description", "product_link",
+        "user_id", "align_meta"
+    },
+}
+PART_REQUIRED = ("brand", "model", "price")
+PART_JSON_COLS = {"align_meta"}
+
 def create_part(part_type: str, part_data: dict, user_id: int | None = None):
-    _ensure_valid(part_type)
-
-    ALLOWED = {
-        "movements": {
-            "brand", "model", "movement_type_id", "price", "image_url",
-            "power_reserve", "accuracy", "description", "product_link",
-            "user_id", "align_meta"
-        },
-        "cases": {
-            "brand", "model", "price", "image_url",
-            "material", "dimension1", "dimension2", "dimension3",
-            "description", "product_link",
-            "user_id", "align_meta"
-        },
-        "dials": {
-            "brand", "model", "price", "image_url",
-            "color", "material", "diameter_mm",
-            "description", "product_link",
-            "user_id", "align_meta"
-        },
-        "straps": {
-            "brand", "model", "price", "image_url",
-            "color", "material", "width_mm", "length_mm",
-            "description", "product_link",
-            "user_id", "align_meta"
-        },
-        "hands": {
-            "brand", "model", "price", "image_url",
-            "color", "material", "type_",
-            "description", "product_link",
-            "user_id", "align_meta"
-        },
-        "crowns": {
-            "brand", "model", "price", "image_url",
-            "color", "material",
-            "description", "product_link",
-            "user_id", "align_meta"
-        },
-    }
-    JSON_COLS = {"align_meta"}
+    ensure_valid_part_type(part_type)
 
     # Normalize and copy
-    data = _normalize_keys(dict(part_data or {}))
+    data = normalize_keys(dict(part_data or {}))
 
     # Map movements.type_ => movement_type_id
     if part_type == "movements":
@@ -195,24 +470,25 @@ def create_part(part_type: str, part_data: dict, user_id: int | None = None):
     if user_id is not None:
         data["user_id"] = user_id
 
-    allowed = ALLOWED[part_type]
+    allowed = PART_COLUMNS[part_type]
     filtered = {k: v for k, v in data.items() if k in allowed and v is not None}
 
-    for req in ("brand", "model", "price"):
+    for req in PART_REQUIRED:
         if req not in filtered:
             raise ValueError(f"missing_{req}")
 
-    filtered = _apply_json_adapters(filtered, JSON_COLS)
+    filtered = _apply_json_adapters(filtered, PART_JSON_COLS)
 
     cols = ", ".join(filtered.keys())
     placeholders = ", ".join(["%s"] * len(filtered))
     sql = f"INSERT INTO {part_type} ({cols}) VALUES ({placeholders}) RETURNING *;"
     row = exec_get_one_dict(sql, tuple(filtered.values()))
+    invalidate_catalog(part_type)
     return row
 
 def update_part(part_type: str, part_id: int, data: dict, user_id: int):
-    _ensure_valid(part_type)
-    payload = _normalize_keys(dict(data or {}))
+    ensure_valid_part_type(part_type)
+    payload = normalize_keys(dict(data or {}))
     JSON_COLS = {"align_meta"}
 
     if part_type == "movements" and "type_" in payload and "movement_type_id" not in payload:
@@ -232,20 +508,41 @@ def update_part(part_type: str, part_id: int, data: dict, user_id: int):
     payload = _apply_json_adapters(payload, JSON_COLS)
 
     sets = ", ".join([f"{k}=%s" for k in payload.keys()])
-    sql = f"UPDATE {part_type} SET {sets}, updated_at=NOW() WHERE id=%s AND user_id=%s RETURNING *;"
+    sql = f"UPDATE {part_type} SET {sets} WHERE id=%s AND user_id=%s RETURNING *;"
     args = tuple(payload.values()) + (part_id, user_id)
-    return exec_get_one_dict(sql, args)
+    row = exec_get_one_dict(sql, args)
+    if row:
+        invalidate_catalog(part_type)
+    return row
 
 def delete_part(part_type: str, part_id: int, user_id: int) -> bool:
-    _ensure_valid(part_type)
+    ensure_valid_part_type(part_type)
     changed = exec_commit(
         f"DELETE FROM {part_type} WHERE id=%s AND user_id=%s",
         (part_id, user_id)
     )
+    if changed > 0:
+        invalidate_catalog(part_type)
     return changed > 0
 
 # ---------- Builds ----------
-def create_build(user_id: int, payload: dict):
+# Sum of the current prices of a build's parts; {b} is the builds row alias.
+_BUILD_TOTAL_EXPR = " + ".join(
+    f"COALESCE((SELECT price FROM {t} WHERE id = {{b}}.{t}_id), 0)"
+    for t in ("movements", "cases", "dials", "straps", "hands", "crowns")
+)
+
+def create_build(user_id: int, payload: dict, allow_incompatible: bool = False):
+    """
+    Insert a build. Dimensional conflicts between the chosen parts (checked
+    against the cached fit indexes, no per-pair queries) raise
+    IncompatibleParts unless allow_incompatible; then they are returned on the
+    row as `compat_warnings`.
+    """
+    conflicts = build_conflicts({t: payload.get(f"{t}_id") for t in _VALID})
+    if conflicts and not allow_incompatible:
+        raise IncompatibleParts(conflicts)
+
     movement_id = payload.get("movements_id")
     case_id     = payload.get("cases_id")
     dial_id     = payload.get("dials_id")
@@ -253,31 +550,109 @@ def create_build(user_id: int, payload: dict):
     hand_id     = payload.get("hands_id")
     crown_id    = payload.get("crowns_id")
 
-    sql_total = """
-        SELECT COALESCE(SUM(price), 0) AS total FROM (
-            SELECT price FROM movements WHERE id = %s
-            UNION ALL SELECT price FROM cases WHERE id = %s
-            UNION ALL SELECT price FROM dials WHERE id = %s
-            UNION ALL SELECT price FROM straps WHERE id = %s
-            UNION ALL SELECT price FROM hands WHERE id = %s
-            UNION ALL SELECT price FROM crowns WHERE id = %s
-        ) t;
+    # Total priced in the same statement as the insert; later price changes
+    # are applied by the reprice triggers (db/sql/tables.sql).
+    ins = f"""
+        INSERT INTO builds (user_id, movements_id, cases_id, dials_id, straps_id, hands_id, crowns_id, total_price)
+        SELECT v.user_id, v.movements_id, v.cases_id, v.dials_id, v.straps_id, v.hands_id, v.crowns_id,
+               {_BUILD_TOTAL_EXPR.format(b="v")}
+        FROM (VALUES (%s::int, %s::int, %s::int, %s::int, %s::int, %s::int, %s::int))
+             AS v(user_id, movements_id, cases_id, dials_id, straps_id, hands_id, crowns_id)
+        RETURNING *;
     """
-    total_row = exec_get_one_dict(sql_total, (movement_id, case_id, dial_id, strap_id, hand_id, crown_id))
-    total = total_row["total"]
+    row = exec_get_one_dict(ins, (user_id, movement_id, case_id, dial_id, strap_id, hand_id, crown_id))
+    if row is not None and conflicts:
+        row = dict(row, compat_warnings=conflicts)
+    return row
 
-    ins = """
-        INSERT INTO builds (user_id, movements_id, cases_id, dials_id, straps_id, hands_id, crowns_id, total_price)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-      RETURNING *;
+def recompute_build_totals(build_ids: list[int] | None = None) -> int:
     """
-    return exec_get_one_dict(ins, (user_id, movement_id, case_id, dial_id, strap_id, hand_id, crown_id, total))
+    Reconcile builds.total_price with current part prices in one statement
+    (all builds, or just `build_ids`); returns how many totals were wrong.
+    """
+    total = _BUILD_TOTAL_EXPR.format(b="b")
+    return exec_commit(
+        f"""
+        UPDATE builds b SET total_price = {total}
+        WHERE (%s::int[] IS NULL OR b.id = ANY(%s::int[]))
+          AND b.total_price IS DISTINCT FROM {total}
+        """,
+        (build_ids, build_ids)
+    )
 
-def get_user_builds(user_id: int):
-    sql = """
+def reconcile_part_usage() -> dict:
+    """
+    Recount part_usage from builds and repair any drift, in one statement
+    under a lock that holds off concurrent build writes (their triggers would
+    race the recount). Drops counter rows that fell to zero. Returns
+    {"repaired": n, "removed": n}.
+    """
+    slots = ", ".join(f"('{t}', b.{t}_id)" for t in ("movements", "cases", "dials", "straps", "hands", "crowns"))
+    with pooled_connection() as conn:
+        conn.autocommit = False
+        try:
+            defer_version_bumps(conn)
+            with conn.cursor() as cur:
+                cur.execute("LOCK TABLE builds IN SHARE MODE")
+                cur.execute(
+                    f"""
+                    WITH truth AS (
+                        SELECT x.part_type, x.part_id, count(*)::int AS builds,
+                               (count(*) FILTER (WHERE b.published))::int AS published
+                        FROM builds b CROSS JOIN LATERAL (VALUES {slots}) x(part_type, part_id)
+                        WHERE x.part_id IS NOT NULL
+                        GROUP BY 1, 2
+                    ),
+                    fixed AS (
+                        INSERT INTO part_usage AS u (part_type, part_id, builds, published)
+                        SELECT part_type, part_id, builds, published FROM truth
+                        ON CONFLICT (part_type, part_id) DO UPDATE
+                            SET builds = EXCLUDED.builds, published = EXCLUDED.published
+                            WHERE (u.builds, u.published) IS DISTINCT FROM (EXCLUDED.builds, EXCLUDED.published)
+                        RETURNING u.part_type
+                    ),
+                    stale AS (
+                        DELETE FROM part_usage u
+                        WHERE NOT EXISTS (SELECT 1 FROM truth t WHERE t.part_type = u.part_type AND t.part_id = u.part_id)
+                        RETURNING u.part_type, (u.builds <> 0 OR u.published <> 0) AS drifted
+                    ),
+                    touched AS (
+                        SELECT part_type FROM fixed UNION SELECT part_type FROM stale WHERE drifted
+                    )
+                    SELECT (SELECT count(*) FROM fixed) + (SELECT count(*) FROM stale WHERE drifted) AS repaired,
+                           (SELECT count(*) FROM stale) AS removed,
+                           bump_versions(ARRAY(SELECT part_type || '_usage' FROM touched))
+                    """
+                )
+                repaired, removed, _ = cur.fetchone()
+            commit_transaction(conn)
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+    return {"repaired": repaired, "removed": removed}
+
+# Hydrated build parts: one jsonb object per slot, keyed by part type.
+_BUILD_PARTS_JSON = """
+    jsonb_build_object(
+        'movements', CASE WHEN m.id IS NULL THEN NULL
+                          ELSE to_jsonb(m) || jsonb_build_object('movement_type', mt.type_name) END,
+        'cases',     CASE WHEN c.id  IS NULL THEN NULL ELSE to_jsonb(c)  END,
+        'dials',     CASE WHEN d.id  IS NULL THEN NULL ELSE to_jsonb(d)  END,
+        'straps',    CASE WHEN s.id  IS NULL THEN NULL ELSE to_jsonb(s)  END,
+        'hands',     CASE WHEN h.id  IS NULL THEN NULL ELSE to_jsonb(h)  END,
+        'crowns',    CASE WHEN cr.id IS NULL THEN NULL ELSE to_jsonb(cr) END
+    ) AS parts
+"""
+
+def _builds_sql(where: str, expand: bool) -> str:
+    parts = f", {_BUILD_PARTS_JSON}" if expand else ""
+    movement_types = "LEFT JOIN movement_types mt ON m.movement_type_id = mt.id" if expand else ""
+    return f"""
     SELECT b.*,
         m.model AS movement_model, c.model AS case_model, d.model AS dial_model,
-        s.model AS strap_model, h.model AS hand_model, cr.model AS crown_model
+        s.model AS strap_model, h.model AS hand_model, cr.model AS crown_model{parts}
     FROM builds b
         LEFT JOIN movements m ON b.movements_id = m.id
         LEFT JOIN cases     c ON b.cases_id     = c.id
@@ -285,10 +660,21 @@ def get_user_builds(user_id: int):
         LEFT JOIN straps    s ON b.straps_id    = s.id
         LEFT JOIN hands     h ON b.hands_id     = h.id
         LEFT JOIN crowns    cr ON b.crowns_id   = cr.id
-    WHERE b.user_id = %s
-    ORDER BY b.id DESC;
+        {movement_types}
+    WHERE {where}
+    ORDER BY b.id DESC
     """
-    return exec_get_all_dict(sql, (user_id,))
+
+def get_user_builds(user_id: int, expand: bool = False):
+    """A user's builds; expand=True adds fully hydrated `parts` in the same query."""
+    return exec_get_all_dict(_builds_sql("b.user_id = %s", expand), (user_id,))
+
+def get_build_detail(build_id: int, viewer_id: int | None = None):
+    """One build with hydrated parts, visible to its owner or if published."""
+    return exec_get_one_dict(
+        _builds_sql("b.id = %s AND (b.published OR b.user_id = %s)", expand=True),
+        (build_id, viewer_id)
+    )
 
 def delete_build_for_user(user_id: int, build_id: int) -> bool:
     changed = exec_commit("DELETE FROM builds WHERE id=%s AND user_id=%s", (build_id, user_id))
@@ -298,3 +684,81 @@ def publish_build_for_user(user_id: int, build_id: int, published: bool=True) ->
     changed = exec_commit("UPDATE builds SET published=%s, updated_at=NOW() WHERE id=%s AND user_id=%s",
                         (published, build_id, user_id))
     return changed > 0
+
+# ---------- Published feed ----------
+# sort -> (key column, direction, SQL cast for the cursor key); each matches an
+# index on build_feed / build_views (db/sql/tables.sql), so a page is one range scan.
+FEED_SORTS = {
+    "newest":    ("f.published_at", "DESC", "timestamptz"),
+    "cheapest":  ("f.total_price", "ASC", "numeric"),
+    "popular":   ("v.views", "DESC", "bigint"),
+}
+
+def query_build_feed(sort: str = "newest", brand: str | None = None, limit: int = 20,
+                     after: tuple | None = None):
+    """
+    A page of published builds from the build_feed read model, joined only to
+    their build_views counter row.
+    `after` = (sort_key, build_id) of the previous page's last row. Rows carry
+    `_sort_key` for the next cursor.
+    """
+    if sort not in FEED_SORTS:
+        raise ValueError("invalid_sort")
+    col, direction, cast = FEED_SORTS[sort]
+    where, args = [], []
+    if brand:
+        where.append("f.brand_key = %s")
+        args.append(brand.lower())
+    if after is not None:
+        op = "<" if direction == "DESC" else ">"
+        where.append(f"({col}, f.build_id) {op} (%s::{cast}, %s)")
+        args.extend(after)
+    sql = f"""
+        SELECT f.build_id AS id, f.user_id, f.owner_name, f.total_price, f.thumbnail_url,
+               f.parts, v.views, f.published_at, {col} AS _sort_key
+        FROM build_feed f
+        JOIN build_views v ON v.build_id = f.build_id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {col} {direction}, f.build_id {direction}
+        LIMIT %s
+    """
+    args.append(limit)
+    return exec_get_all_dict(sql, tuple(args))
+
+def add_build_views(counts: dict[int, int]) -> int:
+    """
+    Add buffered view counts ({build_id: n}) in one statement; ids without a
+    build_views row (never published, deleted) are skipped. Sorted so
+    concurrent flushes lock rows in the same order.
+    """
+    ids = sorted(counts)
+    return exec_commit(
+        """
+        UPDATE build_views v SET views = v.views + d.n
+        FROM unnest(%s::int[], %s::bigint[]) AS d(build_id, n)
+        WHERE v.build_id = d.build_id
+        """,
+        (ids, [counts[i] for i in ids])
+    )
+
+# ---------- Upload references ----------
+# Storage key behind an image URL we minted (relative or absolute; ?w= etc. stripped).
+_UPLOAD_KEY_EXPR = "substring({col} from '/api/uploads/file/([^?#]+)')"
+
+def _upload_refs_sql() -> str:
+    branches = [f"SELECT {_UPLOAD_KEY_EXPR.format(col='image_url')} AS key FROM {t}" for t in sorted(_VALID)]
+    branches.append(f"SELECT {_UPLOAD_KEY_EXPR.format(col='avatar_url')} AS key FROM users")
+    return f"SELECT key FROM ({' UNION ALL '.join(branches)}) refs WHERE key IS NOT NULL"
+
+def stream_upload_refs():
+    """Distinct referenced upload keys in byte order, via a server-side cursor."""
+    return (r["key"] for r in exec_stream_dict(
+        f'SELECT DISTINCT key COLLATE "C" AS key FROM ({_upload_refs_sql()}) k ORDER BY 1'
+    ))
+
+def referenced_upload_keys(keys: list[str]) -> set[str]:
+    """Subset of `keys` referenced right now (re-check just before deleting)."""
+    if not keys:
+        return set()
+    rows = exec_get_all_dict(f"SELECT DISTINCT key FROM ({_upload_refs_sql()}) k WHERE key = ANY(%s)", (keys,))
+    return {r["key"] for r in rows}
@@ -103,7 +103,7 @@ function UploadInner() {
   const uploadImageAndBuildPayload = async () => {
     const presign = await api("/api/uploads/presign", {
       method: "POST",
-      body: { filename: "cutout.png", contentType: "image/png" },
+      body: { filename: "cutout.png", contentType: "image/png", size: finalBlob.size },
     });
     const putRes = await fetch(presign.uploadUrl, {
       method: "PUT",
@@ -132,7 +132,7 @@ function UploadInner() {
     if (finalBlob) {
       const presign = await api("/api/uploads/presign", {
         method: "POST",
-        body: { filename: "cutout.png", contentType: "image/png" },
+        body: { filename: "cutout.png", contentType: "image/png", size: finalBlob.size },
       });
       const putRes = await fetch(presign.uploadUrl, {
         method: "PUT",